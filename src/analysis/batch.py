@@ -0,0 +1,293 @@
+"""Batch jobs: several variants of the config's analysis settings run on the same target folder in a single pass.
+
+A batch file lists the variants, each of which overrides some of the input section's settings. Rather than running the
+whole analysis once per variant, the variants are planned as jobs that depend on each other's work: every measurement is
+read from the cache once, variants with the same preprocessing settings share the processed traces and their window
+statistics, and only the classification of the cells is done separately for each variant, which then gets its own set
+of reports.
+"""
+from __future__ import annotations
+
+from copy import deepcopy
+from dataclasses import dataclass
+from pathlib import Path
+from threading import Lock
+import time
+from typing import Any
+
+import toml
+
+from .converter import CacheManifest, FolderStore, ArchiveStore, TraceTable, is_report
+from .processor import DataProcessor
+from .results import ResultBuffer
+from .scheduler import Scheduler
+from .telemetry import FileFinished, Progress, StageStarted
+from .toml_data import Config, Input
+from .validation import validate_config
+from .window_stats import WindowStats, check_windows
+
+BATCH_NAME = "batch.toml" # the batch file is looked for in the target folder
+# the input settings a variant can't change, every variant runs on the same data
+FIXED_KEYS = {"target_folder"}
+
+
+@dataclass
+class Variant:
+    name: str
+    config: Config
+
+@dataclass
+class PreprocessingGroup:
+    """Variants whose processed traces are the same, so they are only computed once for all of them.
+    """
+    settings: tuple[Any, ...]
+    variants: list[Variant]
+
+
+def preprocessing_settings(options: Input) -> tuple[Any, ...]:
+    """The settings of the input section that the processed traces depend on, the same ones that
+    DataProcessor.preprocessing_key covers.
+    """
+    return (options.smoothing_range, options.smoothing_filter, options.correction.lower() == "true",
+            options.correction_model)
+
+def load_batch(path: Path, config: Config) -> tuple[list[Variant], str]:
+    """Reads a batch file and builds the config of every variant in it, from the config and the variant's overrides.
+
+    Args:
+        path (Path): The batch file's path.
+        config (Config): The config the variants are based on.
+
+    Returns:
+        tuple[list[Variant], str]: The variants in the order they are in the file, and an error message describing the
+        problems encountered, or an empty string if there are none. No variants are returned if there are errors.
+    """
+    try:
+        with open(path, "r") as f:
+            batch = toml.load(f)
+    except FileNotFoundError:
+        return [], f"Batch file missing from {path.parent}."
+    except toml.TomlDecodeError as e:
+        return [], f"Batch file {path} could not be read: {e}"
+
+    variants_section = batch.get("variants", {})
+    if not isinstance(variants_section, dict) or not variants_section:
+        return [], f"Batch file {path} has no variants, see README.md"
+
+    errors = ""
+    variants: list[Variant] = []
+    base = config.to_dict()
+    for name, overrides in variants_section.items():
+        if not isinstance(overrides, dict):
+            errors += f"\nVariant {name}: must be a table of settings"
+            continue
+        if not name.replace("_", "").replace("-", "").isalnum(): # it goes into the names of the reports
+            errors += f"\nVariant {name}: names can only contain letters, numbers, _ and -"
+            continue
+        unknown = set(overrides) - (set(base["input"]) - FIXED_KEYS)
+        if unknown:
+            errors += f"\nVariant {name}: unknown or fixed settings: {', '.join(sorted(unknown))}"
+            continue
+
+        variant = deepcopy(base)
+        variant["input"].update(overrides)
+        # every variant gets its own reports, named so that they are still recognized as reports (see is_report)
+        variant["output"]["report_name"] = f"{base['output']['report_name']}{name}_"
+        variant_errors = validate_config(variant)
+        if variant_errors:
+            errors += f"\nVariant {name}: {variant_errors}"
+            continue
+        variants.append(Variant(name, Config(config.standalone, variant)))
+
+    if errors:
+        return [], f"Batch file {path} has the following errors:{errors}"
+    return variants, ""
+
+def plan_jobs(variants: list[Variant]) -> list[PreprocessingGroup]:
+    """Groups the variants by their preprocessing settings, keeping the order in which each group first appears.
+    """
+    groups: dict[tuple[Any, ...], PreprocessingGroup] = {}
+    for variant in variants:
+        settings = preprocessing_settings(variant.config.input)
+        groups.setdefault(settings, PreprocessingGroup(settings, [])).variants.append(variant)
+    return list(groups.values())
+
+
+class SharedReads:
+    """Wraps the cache of a folder so that each cached sheet is read only once, however many variants need it. Writes
+    go straight to the cache, and drop anything read earlier from the sheets they replace.
+
+    Args:
+        store (FolderStore | ArchiveStore): The folder's cache.
+    """
+    def __init__(self, store: FolderStore | ArchiveStore) -> None:
+        self.store = store
+        self.tables: dict[tuple[str, str], TraceTable] = {}
+
+    def read(self, file_name: str, sheet: str) -> TraceTable:
+        if (file_name, sheet) not in self.tables:
+            self.tables[file_name, sheet] = self.store.read(file_name, sheet)
+        return self.tables[file_name, sheet]
+
+    def write(self, file_name: str, tables: dict[str, TraceTable]) -> None:
+        for sheet in tables:
+            self.tables.pop((file_name, sheet), None)
+        self.store.write(file_name, tables)
+
+    def forget(self, file_name: str) -> None:
+        """Frees the sheets of a measurement file once every variant is done with it.
+        """
+        for key in [key for key in self.tables if key[0] == file_name]:
+            del self.tables[key]
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.store, name)
+
+
+class DiscardedWrites:
+    """Wraps the shared cache of a folder for a preprocessing group with other settings than the config. The cache
+    keeps one set of processed traces per measurement, which should be the ones a run without the batch uses, so the
+    traces of this group are not written at all.
+
+    Args:
+        store (SharedReads): The folder's shared cache.
+    """
+    def __init__(self, store: SharedReads) -> None:
+        self.store = store
+
+    def write(self, file_name: str, tables: dict[str, TraceTable]) -> None:
+        pass
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.store, name)
+
+
+class BatchRunner:
+    """Runs every variant of a batch on every subdirectory of the target folder, one scheduler task per subdirectory.
+
+    Args:
+        config (Config): The config the variants are based on.
+        variants (list[Variant]): The variants to run.
+        progress (Progress): Publishes the telemetry events, a measurement file is finished once for all variants.
+        repeat (bool): Whether to redo variants whose report already exists.
+    """
+    _error_lock = Lock()
+
+    def __init__(self, config: Config, variants: list[Variant], progress: Progress, repeat: bool) -> None:
+        self.config = config
+        self.variants = variants
+        self.plan = plan_jobs(variants)
+        self.progress = progress
+        self.repeat = repeat
+
+    def run(self, scheduler: Scheduler) -> list[str]:
+        """Writes the reports of every variant in every subdirectory, each subdirectory in a task of its own.
+
+        Args:
+            scheduler (Scheduler): Runs the tasks, it publishes their progress itself.
+
+        Returns:
+            list[str]: Error messages from the subdirectories, empty if there were none.
+        """
+        paths = [path for path in self.config.input.target_folder.iterdir() if path.is_dir()]
+        tasks = {path.name: (batch_task, (path, self.config, self.variants, self.repeat)) for path in paths}
+        results, errors = scheduler.run(tasks)
+        return [error for folder in sorted(results) for error in results[folder]] + errors
+
+    def run_folder(self, path: Path, error_list: list[str]) -> None:
+        """Processes one subdirectory for every variant whose report is missing (or all of them, with repeat). Each
+        measurement file is preprocessed once per preprocessing group, and classified once per variant.
+        """
+        processors = {variant.name: DataProcessor(path, variant.config) for variant in self.variants}
+        pending: list[PreprocessingGroup] = []
+        for group in self.plan:
+            variants = []
+            for variant in group.variants:
+                error = processors[variant.name].preprocessing(self.repeat)
+                if error is not None:
+                    with self._error_lock:
+                        error_list.append(error)
+                    return # every variant reads the same metadata, so they all have the same errors
+                if processors[variant.name].need_to_work:
+                    variants.append(variant)
+            if variants:
+                pending.append(PreprocessingGroup(group.settings, variants))
+        if not pending:
+            return
+
+        # all the variants share one view of the cache, and none of them take the reports of the config or another
+        # variant for measurements
+        first = processors[pending[0].variants[0].name]
+        store = SharedReads(first.store)
+        measurement_files = [f for f in path.glob("*.xlsx") if not is_report(f, self.config.output.report_name)]
+        self.progress(StageStarted("batch", len(measurement_files))) # every folder announces its own files
+        own_settings = preprocessing_settings(self.config.input)
+        for group in self.plan:
+            for variant in group.variants:
+                processors[variant.name].store = store if group.settings == own_settings else DiscardedWrites(store)
+
+        names = [variant.name for group in pending for variant in group.variants]
+        results = {name: ResultBuffer() for name in names}
+        bad_files: dict[str, list[Path]] = {"groups": [], "sheets": [], "windows": []}
+        manifest = CacheManifest(store)
+        for file in measurement_files:
+            start = time.perf_counter()
+            cells, frames = 0, 0
+            # what makes a file unusable is the same for every group, so it is checked once, before anything is loaded
+            problem = file_problem(first, file)
+            if problem is not None:
+                bad_files[problem].append(file)
+            else:
+                condition = first.file_condition(file)
+                for group in pending:
+                    lead = processors[group.variants[0].name]
+                    try:
+                        cell_cols, data = lead.load_cells(file, manifest)
+                    except (SyntaxError, FileNotFoundError): # the F340 sheet can be missing even if F380 is there
+                        bad_files["sheets"].append(file)
+                        break
+
+                    cells, frames = data.shape
+                    stats = WindowStats(data, lead.treatment_windows)
+                    cell_types = [c.strip("1234567890") for c in cell_cols]
+                    for variant in group.variants:
+                        file_result = processors[variant.name].classify_cells(stats)
+                        results[variant.name].append(file.name, condition, cell_types, file_result)
+            store.forget(file.name)
+            self.progress(FileFinished("batch", path.name, file.name, cells, frames,
+                                       duration=time.perf_counter() - start))
+
+        for name in names:
+            # the file errors are the same for every variant, so they are only reported once
+            reported = bad_files if name == names[0] else {kind: [] for kind in bad_files}
+            processors[name].finish_report(results[name], reported["groups"], reported["sheets"], reported["windows"],
+                                           error_list)
+
+
+def file_problem(processor: DataProcessor, file: Path) -> str | None:
+    """Finds what keeps a measurement file from being processed, which is the same for every variant, from the header
+    of its cached input sheet.
+
+    Returns:
+        str | None: "sheets" if the input sheet isn't in the cache, "groups" if the file is named after neither
+        experimental group, "windows" if it ends before one of the treatments begins, or None if it can be processed.
+    """
+    try:
+        _, frames = processor.input_shape(file)
+    except (FileNotFoundError, ValueError):
+        return "sheets"
+    if processor.file_condition(file) is None:
+        return "groups"
+    try:
+        check_windows(processor.treatment_windows, frames)
+    except ValueError:
+        return "windows"
+    return None
+
+
+def batch_task(path: Path, config: Config, variants: list[Variant], repeat: bool, progress: Progress) -> list[str]:
+    """Runs every variant of a batch on a subdirectory. Returns error messages about the subdirectory.
+    """
+    errors: list[str] = []
+    BatchRunner(config, variants, progress, repeat).run_folder(path, errors)
+    return errors
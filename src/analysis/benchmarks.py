@@ -0,0 +1,129 @@
+"""Small benchmarks to help choose the performance settings in config.toml. Run them from the src folder, like this:
+
+    uv run -m analysis.benchmarks codecs "path/to/a/measurement/folder"
+    uv run -m analysis.benchmarks smoothing --frames 1200 --cells 100
+"""
+import argparse
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+import numpy as np
+import pandas as pd
+import python_calamine as cala
+
+from .converter import CODECS, TraceTable, read_sheet, read_traces, write_traces
+from .filters import FILTERS, smooth_traces
+
+try:
+    from .compiled.cy_smooth import smooth # type: ignore it actually works
+except ImportError: # not compiled, compare against the pure Python version instead
+    from .smooth import smooth
+
+
+def load_sample_tables(folder: Path) -> list[TraceTable]:
+    """Reads every sheet of every Excel file in a measurement folder, to be used as benchmark data.
+    """
+    tables = []
+    for file in sorted(folder.glob("*.xlsx")):
+        wb = cala.CalamineWorkbook.from_path(file)
+        tables.extend(read_sheet(wb.get_sheet_by_name(sheet)) for sheet in wb.sheet_names)
+    return tables
+
+def benchmark_codecs(folder: Path, repeats: int = 3) -> pd.DataFrame:
+    """Writes the sheets of a measurement folder into trace files with every available codec, then reads them back
+    repeatedly. Read throughput is measured in uncompressed megabytes per second, reading every value. Note that the
+    files are read back from the operating system's file cache, so the uncompressed read speed is what a fast local
+    disk would give, on a network drive it will be limited by the network instead.
+
+    Args:
+        folder (Path): A measurement folder with Excel files in it.
+        repeats (int, optional): How many times to read everything back, the best time is reported. Defaults to 3.
+
+    Returns:
+        pd.DataFrame: One row per codec, with the cache size, its ratio to the uncompressed size, the time it took to
+        write, and the read throughput.
+    """
+    tables = load_sample_tables(folder)
+    raw_bytes = sum(table.data.nbytes for table in tables)
+    results = []
+    for codec in CODECS:
+        with TemporaryDirectory() as temp:
+            paths = [Path(temp) / f"{i}.trc" for i in range(len(tables))]
+            start = perf_counter()
+            for path, table in zip(paths, tables):
+                write_traces(path, table, codec)
+            write_time = perf_counter() - start
+            size = sum(path.stat().st_size for path in paths)
+
+            read_time = float("inf")
+            for _ in range(repeats):
+                start = perf_counter()
+                for path in paths:
+                    read_traces(path).data.sum() # touch every value so that memory maps are actually read
+                read_time = min(read_time, perf_counter() - start)
+
+        results.append({
+            "codec": codec,
+            "size (MB)": size / 1e6,
+            "size ratio": size / raw_bytes,
+            "write (s)": write_time,
+            "read (MB/s)": raw_bytes / 1e6 / read_time
+        })
+
+    return pd.DataFrame(results).set_index("codec")
+
+def best_time(function, repeats: int) -> float:
+    best = float("inf")
+    for _ in range(repeats):
+        start = perf_counter()
+        function()
+        best = min(best, perf_counter() - start)
+    return best
+
+def benchmark_smoothing(frames: int = 1200, cells: int = 100, window_size: int = 5, repeats: int = 5) -> pd.DataFrame:
+    """Times smoothing a synthetic measurement one cell at a time with the original smooth function, the way the
+    processor used to do it, against smoothing every cell at once with each of the filters in analysis.filters.
+
+    Args:
+        frames (int, optional): The length of the measurement. Defaults to 1200.
+        cells (int, optional): The number of cells. Defaults to 100.
+        window_size (int, optional): The smoothing range. Defaults to 5.
+        repeats (int, optional): How many times to run each filter, the best time is reported. Defaults to 5.
+
+    Returns:
+        pd.DataFrame: One row per method, with the time it took and the speedup relative to the per-cell smoothing.
+    """
+    rng = np.random.default_rng(0)
+    traces = 1 + np.cumsum(rng.normal(0, 0.01, (frames, cells)), axis=0)
+
+    timings = {"smooth, per cell": best_time(lambda: np.apply_along_axis(smooth, 0, traces, window_size=window_size),
+                                             repeats)}
+    for method in FILTERS:
+        timings[method] = best_time(lambda: smooth_traces(traces, window_size, method), repeats)
+
+    results = pd.DataFrame({"time (ms)": pd.Series(timings) * 1000})
+    results["speedup"] = timings["smooth, per cell"] / pd.Series(timings)
+    return results.rename_axis("method")
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmarks for choosing performance settings.")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+    codecs = subparsers.add_parser("codecs", help="compare the cache compression codecs on a measurement folder")
+    codecs.add_argument("folder", type=Path)
+    codecs.add_argument("--repeats", type=int, default=3)
+    smoothing = subparsers.add_parser("smoothing", help="compare the smoothing filters on synthetic data")
+    smoothing.add_argument("--frames", type=int, default=1200)
+    smoothing.add_argument("--cells", type=int, default=100)
+    smoothing.add_argument("--window", type=int, default=5)
+    smoothing.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.benchmark == "codecs":
+        print(benchmark_codecs(args.folder, args.repeats).to_string(float_format=lambda x: f"{x:.3f}"))
+    elif args.benchmark == "smoothing":
+        results = benchmark_smoothing(args.frames, args.cells, args.window, args.repeats)
+        print(results.to_string(float_format=lambda x: f"{x:.3f}"))
+
+if __name__ == "__main__":
+    main()
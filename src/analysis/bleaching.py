@@ -0,0 +1,132 @@
+"""Photobleaching correction for every trace of a measurement at once. All functions take the time axis, which every
+cell shares, and a 2d array of frames x cells (the traces of several channels can be stacked side by side and corrected
+in the same call).
+
+The linear model fits a line to each trace and subtracts time * slope, which is what the program has always done. Since
+the time axis is shared, the least squares slopes of all traces are a single matrix product with a precomputed
+projection, no lstsq call is needed. The exponential models fit baseline + amplitude * exp(-t / tau) (with one or two
+exponential terms) and subtract the decaying part, keeping the starting level of each trace. The time constants are
+found by searching a grid of candidates, for a given set of time constants the rest of the model is linear, so every
+candidate is solved in closed form for all traces at once.
+"""
+from __future__ import annotations
+
+from itertools import combinations
+
+import numpy as np
+
+
+# the parameters each model saves per trace, in the order they are stored in the Coeffs table
+MODELS: dict[str, list[str]] = {
+    "linear": ["slope"],
+    "exponential": ["amplitude", "tau"],
+    "biexponential": ["amplitude_1", "tau_1", "amplitude_2", "tau_2"]
+}
+TAU_GRID_SIZE = 24 # the number of candidate time constants, between a 20th and 10 times the measurement's duration
+
+
+def linear_projection(time: np.ndarray) -> np.ndarray:
+    """Returns the vector that gives the least squares slopes of traces sampled at these time points, when multiplied
+    with them.
+    """
+    centered = time - time.mean()
+    return centered / (centered @ centered)
+
+def linear_correction(time: np.ndarray, traces: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Fits a line to every trace and subtracts time * slope from it.
+
+    Args:
+        time (np.ndarray): The time values, 1d.
+        traces (np.ndarray): The traces, frames x cells.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: The corrected traces, and the slopes (1 x cells).
+    """
+    slopes = linear_projection(time) @ traces
+    return traces - time[:, np.newaxis] * slopes, slopes[np.newaxis, :]
+
+def tau_grid(time: np.ndarray) -> np.ndarray:
+    duration = max(float(time[-1] - time[0]), np.finfo(np.float64).eps)
+    return np.geomspace(duration / 20, duration * 10, TAU_GRID_SIZE)
+
+def exponential_correction(time: np.ndarray, traces: np.ndarray, terms: int = 1) -> tuple[np.ndarray, np.ndarray]:
+    """Fits baseline + amplitude * exp(-t / tau) to every trace, with one or two exponential terms, and subtracts the
+    exponential terms, shifted so they are zero at the first frame.
+
+    Args:
+        time (np.ndarray): The time values, 1d.
+        traces (np.ndarray): The traces, frames x cells.
+        terms (int, optional): 1 for a single, 2 for a double exponential. Defaults to 1.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: The corrected traces, and the parameters (amplitude and tau for every term, so
+        2 * terms x cells).
+    """
+    taus = tau_grid(time)
+    decays = np.exp(-np.outer(1 / taus, time - time[0])) # one row per candidate tau
+    # centering takes care of the baseline (the intercept), what's left is solved from the centered normal equations
+    centered_decays = decays - decays.mean(axis=1, keepdims=True)
+    centered_traces = traces - traces.mean(axis=0)
+    gram = centered_decays @ centered_decays.T
+    products = centered_decays @ centered_traces # candidates x cells
+
+    candidates = list(combinations(range(len(taus)), terms))
+    explained = np.empty((len(candidates), traces.shape[1]))
+    amplitudes = np.empty((len(candidates), terms, traces.shape[1]))
+    for i, candidate in enumerate(candidates):
+        indices = list(candidate)
+        amplitudes[i] = np.linalg.pinv(gram[np.ix_(indices, indices)]) @ products[indices]
+        explained[i] = np.sum(amplitudes[i] * products[indices], axis=0)
+
+    # the best candidate is the one that explains the most variance, which is the one with the smallest residuals, but
+    # two terms pulling in opposite directions are not bleaching, just two large terms cancelling each other out to fit
+    # the cell's responses, so those candidates are not allowed
+    same_sign = np.all(amplitudes >= 0, axis=1) | np.all(amplitudes <= 0, axis=1)
+    best = np.argmax(np.where(same_sign, explained, -np.inf), axis=0)
+    cells = np.arange(traces.shape[1])
+    best_amplitudes = amplitudes[best, :, cells].T # terms x cells
+    best_indices = np.array(candidates)[best].T # terms x cells
+
+    corrected = np.array(traces, dtype=np.float64)
+    parameters = np.empty((2 * terms, traces.shape[1]))
+    for term in range(terms):
+        decay = decays[best_indices[term]].T - 1 # frames x cells, 0 at the first frame since decays start from 1
+        corrected -= best_amplitudes[term] * decay
+        parameters[2 * term] = best_amplitudes[term]
+        parameters[2 * term + 1] = taus[best_indices[term]]
+
+    # traces that no pair of same signed terms fits get a single exponential (and a second term with 0 amplitude)
+    single = ~same_sign.any(axis=0)
+    if terms == 2 and single.any():
+        corrected[:, single], single_parameters = exponential_correction(time, traces[:, single], 1)
+        no_amplitude = np.zeros_like(single_parameters[:1])
+        parameters[:, single] = np.vstack((single_parameters, no_amplitude, single_parameters[1:]))
+    return corrected, parameters
+
+def correct_bleaching(time: np.ndarray, traces: np.ndarray, model: str = "linear") -> tuple[np.ndarray, np.ndarray]:
+    """Photobleaching correction of every trace in one call.
+
+    Args:
+        time (np.ndarray): The time values, 1d (or a single column).
+        traces (np.ndarray): The traces, frames x cells.
+        model (str, optional): One of the keys of MODELS. Defaults to "linear".
+
+    Raises:
+        ValueError: If the model is not one of the available models.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: The corrected traces, and the fitted parameters, one row for each of the model's
+        parameters listed in MODELS, one column per trace.
+    """
+    time = np.asarray(time, dtype=np.float64).ravel()
+    traces = np.asarray(traces, dtype=np.float64)
+    match model:
+        case "linear":
+            return linear_correction(time, traces)
+        case "exponential":
+            return exponential_correction(time, traces, 1)
+        case "biexponential":
+            return exponential_correction(time, traces, 2)
+        case _:
+            raise ValueError(f"Unknown photobleaching correction model: {model}. Available models are: "
+                             f"{', '.join(MODELS)}.")
@@ -1,18 +1,37 @@
 import os
+import sys
 import numpy as np
 
 from setuptools import setup, Extension
 from Cython.Build import cythonize
 from pathlib import Path
 
-extension = Extension(
-    name="cy_smooth",
-    sources=["cy_smooth.pyx"],
-    include_dirs=[np.get_include()]
-)
+# the preprocessing kernel uses OpenMP to process cells in parallel, Apple's compiler doesn't support it out of the box
+# so there it is compiled without it (it still works, just on a single core)
+if sys.platform == "win32":
+    openmp_args = ["/openmp"]
+elif sys.platform == "darwin":
+    openmp_args = []
+else:
+    openmp_args = ["-fopenmp"]
+
+extensions = [
+    Extension(
+        name="cy_smooth",
+        sources=["cy_smooth.pyx"],
+        include_dirs=[np.get_include()]
+    ),
+    Extension(
+        name="cy_preprocess",
+        sources=["cy_preprocess.pyx"],
+        include_dirs=[np.get_include()],
+        extra_compile_args=openmp_args,
+        extra_link_args=openmp_args if sys.platform != "win32" else []
+    )
+]
 
 setup(
-    ext_modules=cythonize(extension),
+    ext_modules=cythonize(extensions),
     include_dirs=[np.get_include()],
     py_modules=[],
 )
@@ -20,9 +39,10 @@ setup(
 folder = Path(__file__).parent
 for file in folder.iterdir():
     if file.is_file():
-        if file.match("cy_smooth.c"):
-            os.remove(file) # not entirely necessary, but might as well
-        if file.match("cy_smooth.cpython*.so"):
-            os.rename(file, folder / "cy_smooth.so")
-        elif file.match("cy_smooth.cpython*.pyd"):
-            os.rename(file, folder / "cy_smooth.pyd")
\ No newline at end of file
+        for name in ["cy_smooth", "cy_preprocess"]:
+            if file.match(f"{name}.c"):
+                os.remove(file) # not entirely necessary, but might as well
+            if file.match(f"{name}.cpython*.so"):
+                os.rename(file, folder / f"{name}.so")
+            elif file.match(f"{name}.cp*.pyd"):
+                os.rename(file, folder / f"{name}.pyd")
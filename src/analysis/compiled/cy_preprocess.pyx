@@ -0,0 +1,189 @@
+# cython: boundscheck=False, wraparound=False, cdivision=True, initializedcheck=False
+import os
+
+import numpy as np
+from cython.parallel cimport parallel, prange
+from libc.stdlib cimport malloc, free
+from libc.math cimport NAN
+
+ctypedef fused floating:
+    float
+    double
+
+
+cdef void moving_average(const double* trace, double* out, Py_ssize_t length, Py_ssize_t window_size) noexcept nogil:
+    """Same as analysis.filters.moving_average for a single trace: the window shrinks at the edges, and NaN values only
+    affect the windows they are in.
+    """
+    cdef Py_ssize_t half_size = window_size // 2
+    cdef Py_ssize_t frame, start, stop, i
+    cdef double total
+    for frame in range(length):
+        start = frame - half_size if frame > half_size else 0
+        stop = frame + half_size + 1 if frame + half_size + 1 < length else length
+        total = 0
+        for i in range(start, stop):
+            total = total + trace[i]
+        out[frame] = total / (stop - start)
+
+
+cdef double detrend(const double* time, double* trace, Py_ssize_t length) noexcept nogil:
+    """Photobleaching correction: fits a line to the trace with least squares and subtracts time * slope from it, in
+    place. Returns the slope.
+    """
+    cdef Py_ssize_t frame
+    cdef double time_mean = 0, trace_mean = 0, covariance = 0, variance = 0, slope
+    for frame in range(length):
+        time_mean = time_mean + time[frame]
+        trace_mean = trace_mean + trace[frame]
+    time_mean = time_mean / length
+    trace_mean = trace_mean / length
+    for frame in range(length):
+        covariance = covariance + (time[frame] - time_mean) * (trace[frame] - trace_mean)
+        variance = variance + (time[frame] - time_mean) * (time[frame] - time_mean)
+    slope = covariance / variance if variance != 0 else NAN
+    for frame in range(length):
+        trace[frame] = trace[frame] - time[frame] * slope
+    return slope
+
+
+def thread_count(int workers, Py_ssize_t cells) -> int:
+    """One thread per CPU core (or the configured number of workers), but no more than the number of cells.
+    """
+    return max(1, min(workers if workers > 0 else os.cpu_count() or 1, cells))
+
+
+def preprocess_ratiometric(const double[::1] time, const floating[::1] background_340, const floating[:, ::1] cells_340,
+                           const floating[::1] background_380, const floating[:, ::1] cells_380, int window_size,
+                           bint correction, int workers = 0):
+    """Does all the preprocessing of a Fura2 measurement in one pass per cell: background substraction, smoothing,
+    photobleaching correction and taking the 340/380 ratio. Cells are processed in parallel without holding the GIL.
+
+    Args:
+        time (np.ndarray): The time values, float64.
+        background_340 (np.ndarray): The background at 340 nm.
+        cells_340 (np.ndarray): The cells at 340 nm, cells x frames, C contiguous.
+        background_380 (np.ndarray): The background at 380 nm.
+        cells_380 (np.ndarray): The cells at 380 nm, cells x frames, C contiguous.
+        window_size (int): The smoothing range.
+        correction (bool): Whether to do photobleaching correction.
+        workers (int, optional): The number of threads to use, 0 means one per CPU core. Defaults to 0.
+
+    Raises:
+        ValueError: If the time values, the backgrounds and the cells at 380 nm don't have as many frames as the cells
+        at 340 nm, or the two wavelengths don't have the same number of cells.
+        MemoryError: If the scratch buffers could not be allocated.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: The ratios (cells x frames), and the correction coefficients (2 x cells, the
+        first row is for 340 nm, the second for 380 nm), which are NaN if there was no correction.
+    """
+    cdef Py_ssize_t cells = cells_340.shape[0], length = cells_340.shape[1]
+    # bounds aren't checked in the loops, so a shorter input would be read past its end
+    if not time.shape[0] == background_340.shape[0] == background_380.shape[0] == length:
+        raise ValueError(f"The time values and backgrounds have {time.shape[0]}, {background_340.shape[0]} and "
+                         f"{background_380.shape[0]} frames, but the measurement has {length} frames.")
+    if cells_380.shape[0] != cells or cells_380.shape[1] != length:
+        raise ValueError(f"The cells at 380 nm are {cells_380.shape[0]} x {cells_380.shape[1]}, but the cells at "
+                         f"340 nm are {cells} x {length}.")
+    ratios = np.empty((cells, length), dtype=np.float64)
+    coeffs = np.full((2, cells), np.nan, dtype=np.float64)
+    cdef double[:, ::1] out = ratios
+    cdef double[:, ::1] slopes = coeffs
+    cdef Py_ssize_t cell, frame
+    cdef double* raw
+    cdef double* smooth_340
+    cdef double* smooth_380
+    cdef int threads = thread_count(workers, cells)
+    failures = np.zeros(1, dtype=np.intc)
+    cdef int[::1] failed = failures # shared between the threads, unlike variables assigned in the parallel block
+
+    with nogil, parallel(num_threads=threads):
+        # every thread gets its own scratch buffers, the output is written directly into the result array
+        raw = <double*> malloc(length * sizeof(double))
+        smooth_340 = <double*> malloc(length * sizeof(double))
+        smooth_380 = <double*> malloc(length * sizeof(double))
+        if raw == NULL or smooth_340 == NULL or smooth_380 == NULL:
+            failed[0] = 1
+        for cell in prange(cells, schedule="static"):
+            if failed[0]:
+                continue
+            for frame in range(length):
+                raw[frame] = <double> cells_340[cell, frame] - <double> background_340[frame]
+            moving_average(raw, smooth_340, length, window_size)
+            for frame in range(length):
+                raw[frame] = <double> cells_380[cell, frame] - <double> background_380[frame]
+            moving_average(raw, smooth_380, length, window_size)
+            if correction:
+                slopes[0, cell] = detrend(&time[0], smooth_340, length)
+                slopes[1, cell] = detrend(&time[0], smooth_380, length)
+            for frame in range(length):
+                out[cell, frame] = smooth_340[frame] / smooth_380[frame]
+        free(raw)
+        free(smooth_340)
+        free(smooth_380)
+
+    if failures[0]:
+        raise MemoryError("Could not allocate the preprocessing buffers.")
+    return ratios, coeffs
+
+
+def preprocess_single(const double[::1] time, const floating[:, ::1] cells, int baseline, int window_size,
+                      bint correction, int workers = 0):
+    """Does all the preprocessing of a measurement with a non-ratiometric dye in one pass per cell: normalization to the
+    baseline mean, smoothing and photobleaching correction. Cells are processed in parallel without holding the GIL.
+
+    Args:
+        time (np.ndarray): The time values, float64.
+        cells (np.ndarray): The cells, cells x frames, C contiguous.
+        baseline (int): The length of the baseline in frames, used for the normalization.
+        window_size (int): The smoothing range.
+        correction (bool): Whether to do photobleaching correction.
+        workers (int, optional): The number of threads to use, 0 means one per CPU core. Defaults to 0.
+
+    Raises:
+        ValueError: If the baseline is empty or longer than the measurement, or there are not as many time values as
+        frames, the loops below don't check bounds.
+        MemoryError: If the scratch buffers could not be allocated.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: The processed traces (cells x frames), and the correction coefficients (one per
+        cell), which are NaN if there was no correction.
+    """
+    cdef Py_ssize_t count = cells.shape[0], length = cells.shape[1]
+    traces = np.empty((count, length), dtype=np.float64)
+    coeffs = np.full(count, np.nan, dtype=np.float64)
+    cdef double[:, ::1] out = traces
+    cdef double[::1] slopes = coeffs
+    cdef Py_ssize_t cell, frame
+    cdef double baseline_mean
+    cdef double* raw
+    cdef int threads = thread_count(workers, count)
+    failures = np.zeros(1, dtype=np.intc)
+    cdef int[::1] failed = failures
+    if not 0 < baseline <= length:
+        raise ValueError(f"The baseline is {baseline} frames long, but the measurement has {length} frames.")
+    if time.shape[0] != length:
+        raise ValueError(f"There are {time.shape[0]} time values, but the measurement has {length} frames.")
+
+    with nogil, parallel(num_threads=threads):
+        raw = <double*> malloc(length * sizeof(double))
+        if raw == NULL:
+            failed[0] = 1
+        for cell in prange(count, schedule="static"):
+            if failed[0]:
+                continue
+            baseline_mean = 0
+            for frame in range(baseline):
+                baseline_mean = baseline_mean + cells[cell, frame]
+            baseline_mean = baseline_mean / baseline
+            for frame in range(length):
+                raw[frame] = cells[cell, frame] / baseline_mean
+            moving_average(raw, &out[cell, 0], length, window_size)
+            if correction:
+                slopes[cell] = detrend(&time[0], &out[cell, 0], length)
+        free(raw)
+
+    if failures[0]:
+        raise MemoryError("Could not allocate the preprocessing buffer.")
+    return traces, coeffs
@@ -1,112 +1,792 @@
+from __future__ import annotations
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import glob
+import hashlib
+import json
+import lzma
+import os
 from pathlib import Path
 from shutil import rmtree
-from threading import Lock, Thread
-from tkinter import IntVar
+from typing import BinaryIO
+import zlib
 
+import numpy as np
+from openpyxl import Workbook
 import pandas as pd
 import python_calamine as cala
 
+from .scheduler import POOL_CONTEXT
+from .shards import Shard, in_shard
+from .telemetry import FileFinished, Progress, StageStarted, timed
+from .toml_data import Performance
+
+if os.name == "nt":
+    import msvcrt
+else:
+    import fcntl
+
 NAME_SHEET_SEP: str = " SHEET_"
 CACHE_NAME = ".cache"
+REACTIONS_SHEET = "Reactions" # which cells reacted to what, cached by processing for graphing
+RESULT_SHEET = "Result" # the checkpoint of a processed file, cached next to its reactions
+INTERNAL_SHEETS = {REACTIONS_SHEET, RESULT_SHEET} # only for the program itself, never exported to Excel
+CACHE_EXT = ".trc"
+ARCHIVE_NAME = "experiment.dpca"
+MANIFEST_NAME = "manifest.json"
+HASH_CHUNK_SIZE = 1 << 20
+TRACE_MAGIC = b"DPCTRACE"
+TRACE_ALIGNMENT = 64 # the data block starts at a multiple of this many bytes, which keeps memory maps aligned
+ARCHIVE_MAGIC = b"DPCARCHV"
+ARCHIVE_HEADER_SIZE = 64 # magic, index offset, index length, padding up to the first aligned entry
+CACHE_DTYPES = {"float64", "float32"}
+CODECS = {
+    "none": (lambda b: b, lambda b: b),
+    "zlib": (zlib.compress, zlib.decompress),
+    "lzma": (lzma.compress, lzma.decompress)
+} # (compress, decompress) function pairs, the stdlib ones so that there are no extra dependencies
+EXPORT_CHUNK_FRAMES = 256 # this many rows are converted to Python objects at a time when writing Excel files
+
+
+def cached_sheet_path(cache_path: Path, file_name: str, sheet: str) -> Path:
+    return cache_path / f"{file_name}{NAME_SHEET_SEP}{sheet}{CACHE_EXT}"
+
+def is_report(file: Path, report_name: str) -> bool:
+    """Tells reports apart from measurement files. Reports are named report_name + the folder's name, with anything in
+    between (batch jobs put the variant's name there), so those of every batch variant are recognized as well.
+    """
+    return file.name.startswith(report_name) and file.name.endswith(f"{file.parent.name}.xlsx")
+
+class TraceTable:
+    """One cached sheet: its column names and the data as a (columns x frames) array, so that every column (Time,
+    Background, and each cell) is a contiguous block of memory. Cell columns always follow each other in the order they
+    had in the sheet, so selecting all of them is a view rather than a copy.
+
+    Attributes:
+        columns (list[str]): The column names, in their original order.
+        data (np.ndarray): The values, one row per column. Usually a read-only memory map of the cache file.
+        attrs (dict): Small pieces of extra information stored in the file's header.
+    """
+    def __init__(self, columns: list[str], data: np.ndarray, attrs: dict | None = None) -> None:
+        self.columns = [str(c) for c in columns]
+        self.data = data
+        self.attrs = attrs if attrs is not None else {}
+        self._index = {c: i for i, c in enumerate(self.columns)}
+
+    @classmethod
+    def from_frame(cls, frame: pd.DataFrame, attrs: dict | None = None) -> TraceTable:
+        numbers = frame.apply(pd.to_numeric, errors="coerce") # text cells become NaN instead of object columns
+        return cls(list(frame.columns), numbers.to_numpy(dtype=np.float64).T, attrs)
+
+    @property
+    def frames(self) -> int:
+        return self.data.shape[1]
+
+    @property
+    def cell_columns(self) -> list[str]:
+        return [c for c in self.columns if c not in {"Time", "Background"}]
+
+    def __getitem__(self, column: str) -> np.ndarray:
+        return self.data[self._index[column]]
+
+    def select(self, columns: list[str]) -> np.ndarray:
+        """Returns the given columns as a (columns x frames) array. This is a view if the columns are adjacent and in
+        order (which is always the case for the cell columns), and a copy otherwise.
+        """
+        indices = [self._index[c] for c in columns]
+        if indices and indices == list(range(indices[0], indices[0] + len(indices))):
+            return self.data[indices[0]:indices[0] + len(indices)]
+        return self.data[indices]
+
+    def copy(self) -> TraceTable:
+        """Returns a copy of the table that is held in memory instead of being backed by a memory map.
+        """
+        return TraceTable(self.columns, np.array(self.data), dict(self.attrs))
+
+    def to_frame(self) -> pd.DataFrame:
+        return pd.DataFrame(np.transpose(self.data), columns=self.columns)
+
+def aligned(offset: int) -> int:
+    return -(-offset // TRACE_ALIGNMENT) * TRACE_ALIGNMENT
+
+def shuffle_bytes(data: np.ndarray) -> bytes:
+    """Groups the first bytes of every value together, then the second bytes, and so on. Neighbouring values in a Ca
+    trace have the same sign, exponent and leading mantissa bytes, so this makes the data far more compressible.
+    """
+    return np.ascontiguousarray(data.reshape(-1).view(np.uint8).reshape(-1, data.itemsize).T).tobytes()
+
+def unshuffle_bytes(buffer: bytes, dtype: str, shape: tuple[int, ...]) -> np.ndarray:
+    itemsize = np.dtype(dtype).itemsize
+    grouped = np.frombuffer(buffer, dtype=np.uint8).reshape(itemsize, -1)
+    return np.ascontiguousarray(grouped.T).view(dtype).reshape(shape)
+
+def encode_traces(f: BinaryIO, table: TraceTable, compression: str = "none") -> None:
+    """Writes a TraceTable to an open file at its current position, which must be aligned. The encoded table starts
+    with a magic string and the length of a JSON header holding the column names, shape, dtype, codec, and attrs,
+    followed by the data block (columns x frames, C order) at an aligned offset. Compressed data blocks are byte
+    shuffled before compression.
+
+    Args:
+        f (BinaryIO): The file to write to.
+        table (TraceTable): The table to save.
+        compression (str, optional): "none", "zlib" or "lzma". Defaults to "none".
+    """
+    dtype = table.data.dtype if table.data.dtype.name in CACHE_DTYPES else np.float64
+    data = np.ascontiguousarray(table.data, dtype=dtype)
+    if compression == "none":
+        payload = data.tobytes()
+    else:
+        payload = CODECS[compression][0](shuffle_bytes(data))
+    header = {
+        "columns": table.columns,
+        "shape": list(data.shape),
+        "dtype": data.dtype.str,
+        "codec": compression,
+        "nbytes": len(payload),
+        "attrs": table.attrs
+    }
+    header_bytes = json.dumps(header).encode("utf-8")
+    prefix_len = len(TRACE_MAGIC) + 4
+    header_bytes = header_bytes.ljust(aligned(prefix_len + len(header_bytes)) - prefix_len)
+
+    f.write(TRACE_MAGIC)
+    f.write(len(header_bytes).to_bytes(4, "little"))
+    f.write(header_bytes)
+    f.write(payload)
+
+def write_traces(path: Path, table: TraceTable, compression: str = "none") -> None:
+    """Writes a TraceTable to its own file. The file is written under a temporary name first and then moved into
+    place, so readers never see half a file.
+
+    Args:
+        path (Path): Where to save the table.
+        table (TraceTable): The table to save.
+        compression (str, optional): "none", "zlib" or "lzma". Defaults to "none".
+    """
+    temp_path = path.with_suffix(".tmp")
+    with open(temp_path, "wb") as f:
+        encode_traces(f, table, compression)
+    os.replace(temp_path, path)
+
+def read_trace_header(path: Path, offset: int = 0) -> tuple[dict, int]:
+    """Reads only the header of a trace file, which is enough to find out its columns and number of frames.
+
+    Args:
+        path (Path): The trace file, or an archive holding the table.
+        offset (int, optional): Where the table starts within the file. Defaults to 0.
+
+    Returns:
+        tuple[dict, int]: The header, and the offset where the data block begins.
+    """
+    with open(path, "rb") as f:
+        f.seek(offset)
+        if f.read(len(TRACE_MAGIC)) != TRACE_MAGIC:
+            raise ValueError(f"{path} does not have a trace table at offset {offset}.")
+        header_len = int.from_bytes(f.read(4), "little")
+        header = json.loads(f.read(header_len))
+    return header, offset + len(TRACE_MAGIC) + 4 + header_len
+
+def read_traces(path: Path, offset: int = 0) -> TraceTable:
+    """Opens a trace table as a read-only memory map, so no data is actually read until it is used, and only the
+    columns and frames that are used are read at all. Compressed tables can't be memory mapped, those are read and
+    decompressed in full.
+
+    Args:
+        path (Path): The trace file, or an archive holding the table.
+        offset (int, optional): Where the table starts within the file. Defaults to 0.
+
+    Returns:
+        TraceTable: The table, backed by the memory map, or in memory if it was compressed.
+    """
+    header, data_offset = read_trace_header(path, offset)
+    shape = tuple(header["shape"])
+    codec = header.get("codec", "none")
+    if 0 in shape: # memory maps can't be empty
+        data = np.empty(shape, dtype=header["dtype"])
+    elif codec != "none":
+        with open(path, "rb") as f:
+            f.seek(data_offset)
+            buffer = CODECS[codec][1](f.read(header["nbytes"]))
+        data = unshuffle_bytes(buffer, header["dtype"], shape)
+    else:
+        data = np.memmap(path, dtype=header["dtype"], mode="r", offset=data_offset, shape=shape)
+    return TraceTable(header["columns"], data, header["attrs"])
+
+class FileLock:
+    """An exclusive lock shared between processes, held on a separate lock file. The operating system releases it if
+    the process holding it dies, so a crash can't leave it locked forever.
+    """
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.handle: BinaryIO
+
+    def __enter__(self) -> FileLock:
+        self.handle = open(self.path, "a+b")
+        if os.name == "nt":
+            self.handle.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(self.handle.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError: # LK_LOCK gives up after 10 seconds, but we want to wait as long as needed
+                    continue
+        else:
+            fcntl.flock(self.handle, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *args) -> None:
+        if os.name == "nt":
+            self.handle.seek(0)
+            msvcrt.locking(self.handle.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            fcntl.flock(self.handle, fcntl.LOCK_UN)
+        self.handle.close()
+
+class FolderStore:
+    """Cache layout with every cached sheet in its own trace file inside the cache folder.
+    """
+    def __init__(self, cache_path: Path, compression: str = "none") -> None:
+        self.cache_path = cache_path
+        self.compression = compression
+
+    def read(self, file_name: str, sheet: str) -> TraceTable:
+        return read_traces(cached_sheet_path(self.cache_path, file_name, sheet))
+
+    def header(self, file_name: str, sheet: str) -> dict:
+        return read_trace_header(cached_sheet_path(self.cache_path, file_name, sheet))[0]
+
+    def write(self, file_name: str, tables: dict[str, TraceTable]) -> None:
+        for sheet, table in tables.items():
+            write_traces(cached_sheet_path(self.cache_path, file_name, sheet), table, self.compression)
+
+    def remove(self, file_name: str) -> None:
+        # file names may contain [ ] * or ?, which must not be read as a pattern
+        for cached in self.cache_path.glob(f"{glob.escape(file_name)}{NAME_SHEET_SEP}*{CACHE_EXT}"):
+            cached.unlink()
+
+    def contents(self) -> dict[str, list[str]]:
+        """Returns:
+            dict[str, list[str]]: Measurement file names mapped to the names of their cached sheets.
+        """
+        result: dict[str, list[str]] = {}
+        for cached in sorted(self.cache_path.glob(f"*{CACHE_EXT}")):
+            file_name, sheet = cached.name.removesuffix(CACHE_EXT).split(sep=NAME_SHEET_SEP)
+            result.setdefault(file_name, []).append(sheet)
+        return result
+
+    def compact(self) -> None:
+        pass # nothing to do, deleted sheets are deleted right away
+
+class ArchiveStore:
+    """Cache layout with everything cached for one measurement folder in a single archive file, so that working on a
+    folder opens one file instead of one per sheet, which matters a lot on network drives.
+
+    The archive is append-only: it starts with a fixed size header pointing to a JSON index, which maps file names and
+    sheet names to the offsets of trace tables (encoded exactly like trace files) stored after the header. Writing
+    appends the new tables and a new index to the end of the archive, then updates the pointer in the header. This
+    means readers never see a half-written index, even while another process is writing, and tables that readers
+    already have memory mapped stay valid. Replaced and removed tables are left in place until compact() is called.
+    Writers are serialized with a FileLock, as workers in different processes may write to the same archive.
+    """
+    def __init__(self, cache_path: Path, compression: str = "none") -> None:
+        self.cache_path = cache_path
+        self.compression = compression
+        self.path = cache_path / ARCHIVE_NAME
+        self.lock_path = cache_path / f"{ARCHIVE_NAME}.lock"
+
+    def _read_index(self, f: BinaryIO) -> dict[str, dict[str, int]]:
+        f.seek(0)
+        header = f.read(ARCHIVE_HEADER_SIZE)
+        if header[:len(ARCHIVE_MAGIC)] != ARCHIVE_MAGIC:
+            raise ValueError(f"{self.path} is not a cache archive.")
+        index_offset = int.from_bytes(header[8:16], "little")
+        index_length = int.from_bytes(header[16:24], "little")
+        f.seek(index_offset)
+        return json.loads(f.read(index_length))
+
+    def index(self) -> dict[str, dict[str, int]]:
+        """Returns:
+            dict[str, dict[str, int]]: File names mapped to their sheet names, which are mapped to table offsets.
+        """
+        if not self.path.exists():
+            return {}
+        with open(self.path, "rb") as f:
+            return self._read_index(f)
+
+    def read(self, file_name: str, sheet: str) -> TraceTable:
+        try:
+            offset = self.index()[file_name][sheet]
+        except KeyError:
+            raise FileNotFoundError(f"{file_name}{NAME_SHEET_SEP}{sheet} is not in {self.path}.")
+        return read_traces(self.path, offset)
+
+    def header(self, file_name: str, sheet: str) -> dict:
+        try:
+            offset = self.index()[file_name][sheet]
+        except KeyError:
+            raise FileNotFoundError(f"{file_name}{NAME_SHEET_SEP}{sheet} is not in {self.path}.")
+        return read_trace_header(self.path, offset)[0]
+
+    def _update(self, file_name: str, tables: dict[str, TraceTable] | None) -> None:
+        """Appends tables for a file (or removes the file if tables is None) and commits a new index.
+        """
+        with FileLock(self.lock_path):
+            if not self.path.exists():
+                with open(self.path, "wb") as f:
+                    f.write(ARCHIVE_MAGIC.ljust(ARCHIVE_HEADER_SIZE, b"\0"))
+                    f.write(b"{}")
+                    f.seek(8)
+                    f.write(ARCHIVE_HEADER_SIZE.to_bytes(8, "little"))
+                    f.write((2).to_bytes(8, "little"))
+
+            with open(self.path, "r+b") as f:
+                index = self._read_index(f)
+                if tables is None:
+                    index.pop(file_name, None)
+                else:
+                    entry = index.setdefault(file_name, {})
+                    f.seek(0, os.SEEK_END)
+                    for sheet, table in tables.items():
+                        offset = aligned(f.tell())
+                        f.write(b"\0" * (offset - f.tell()))
+                        encode_traces(f, table, self.compression)
+                        entry[sheet] = offset
+
+                f.seek(0, os.SEEK_END)
+                index_offset = f.tell()
+                index_bytes = json.dumps(index).encode("utf-8")
+                f.write(index_bytes)
+                f.flush()
+                os.fsync(f.fileno()) # the new index must be on disk before the header points to it
+                f.seek(8)
+                f.write(index_offset.to_bytes(8, "little"))
+                f.write(len(index_bytes).to_bytes(8, "little"))
+
+    def write(self, file_name: str, tables: dict[str, TraceTable]) -> None:
+        self._update(file_name, tables)
+
+    def remove(self, file_name: str) -> None:
+        if file_name in self.index():
+            self._update(file_name, None)
+
+    def contents(self) -> dict[str, list[str]]:
+        """Returns:
+            dict[str, list[str]]: Measurement file names mapped to the names of their cached sheets.
+        """
+        return {file_name: list(sheets) for file_name, sheets in self.index().items()}
+
+    def compact(self) -> None:
+        """Rewrites the archive without the tables that were replaced or removed, if they take up more than half of it.
+        The encoded tables are copied byte for byte (they only need to start at an aligned offset), and the lock is held
+        for the whole rewrite, so a write from another process can't slip in between and be lost. Must not be called
+        while other processes are reading the archive.
+        """
+        if not self.path.exists():
+            return
+        with FileLock(self.lock_path):
+            temp_path = self.path.with_suffix(".tmp")
+            with open(self.path, "rb") as source:
+                index = self._read_index(source)
+                extents: dict[int, int] = {} # the offset of every live table mapped to its length
+                for sheets in index.values():
+                    for offset in sheets.values():
+                        header, data_offset = read_trace_header(self.path, offset)
+                        extents[offset] = data_offset + header["nbytes"] - offset
+                if not index or self.path.stat().st_size < 2 * sum(extents.values()) + ARCHIVE_HEADER_SIZE:
+                    return
+
+                moved: dict[int, int] = {}
+                with open(temp_path, "wb") as target:
+                    target.write(b"\0" * ARCHIVE_HEADER_SIZE)
+                    for offset, length in sorted(extents.items()):
+                        moved[offset] = aligned(target.tell())
+                        target.write(b"\0" * (moved[offset] - target.tell()))
+                        source.seek(offset)
+                        while length > 0:
+                            chunk = source.read(min(length, HASH_CHUNK_SIZE))
+                            target.write(chunk)
+                            length -= len(chunk)
+                    index_offset = target.tell()
+                    index_bytes = json.dumps({file_name: {sheet: moved[offset] for sheet, offset in sheets.items()}
+                                              for file_name, sheets in index.items()}).encode("utf-8")
+                    target.write(index_bytes)
+                    target.seek(0)
+                    target.write(ARCHIVE_MAGIC)
+                    target.write(index_offset.to_bytes(8, "little"))
+                    target.write(len(index_bytes).to_bytes(8, "little"))
+                    target.flush()
+                    os.fsync(target.fileno())
+            os.replace(temp_path, self.path)
+
+def open_store(cache_path: Path, performance: Performance) -> FolderStore | ArchiveStore:
+    """Args:
+        cache_path (Path): The cache folder.
+        performance (Performance): The performance section of the config, which decides the cache layout ("files" for
+        one trace file per sheet, or "archive" for a single archive file per folder) and compression.
+    """
+    if performance.cache_layout == "archive":
+        return ArchiveStore(cache_path, performance.cache_compression)
+    return FolderStore(cache_path, performance.cache_compression)
+
+def file_hash(path: Path) -> str:
+    """Hashes the contents of a file in chunks, so that large workbooks don't have to be read into memory at once.
+
+    Args:
+        path (Path): The file to hash.
+
+    Returns:
+        str: The hex digest of the file's contents.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        while chunk := f.read(HASH_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def as_number(value) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError): # empty cells come in as empty strings
+        return np.nan
+
+def read_sheet(sheet: cala.CalamineSheet, dtype: str = "float64") -> TraceTable:
+    """Reads a sheet straight into a preallocated (columns x frames) array one row at a time, instead of having
+    calamine build a list of lists holding every cell as a Python object first. Empty and non-numeric cells become NaN,
+    so the result is always a numeric array of the requested dtype.
+
+    Args:
+        sheet (cala.CalamineSheet): The sheet to read. Its first row must contain the column names.
+        dtype (str, optional): "float64" or "float32". Defaults to "float64".
+
+    Returns:
+        TraceTable: The sheet's contents.
+    """
+    rows = sheet.iter_rows()
+    headers = next(rows, [])
+    data = np.empty((len(headers), max(sheet.height - 1, 0)), dtype=dtype)
+    frames = 0
+    for frames, row in enumerate(rows, start=1):
+        try:
+            data[:, frames - 1] = row
+        except (TypeError, ValueError): # only rows with empty or text cells need to be converted value by value
+            data[:, frames - 1] = [as_number(value) for value in row]
+
+    return TraceTable(headers, data[:, :frames])
+
+def convert_workbook(source: Path, store: FolderStore | ArchiveStore, dtype: str = "float64") -> list[str]:
+    """Converts every sheet of one measurement file into a trace table in the cache. Runs in a worker process, which is
+    why it is a module level function and only deals with paths (the stores are just paths too).
+
+    Args:
+        source (Path): The measurement file.
+        store (FolderStore | ArchiveStore): The cache to write into.
+        dtype (str, optional): The dtype of the cached data, "float64" or "float32". Defaults to "float64".
+
+    Returns:
+        list[str]: The names of the sheets that were converted.
+    """
+    wb = cala.CalamineWorkbook.from_path(source)
+    tables = {sheet: read_sheet(wb.get_sheet_by_name(sheet), dtype) for sheet in wb.sheet_names}
+    store.write(source.name, tables)
+
+    return wb.sheet_names
+
+def export_workbook(destination: Path, store: FolderStore | ArchiveStore, sheets: list[str]) -> None:
+    """Writes the cached sheets of one measurement file into an Excel file. Uses openpyxl in write-only mode, which
+    streams rows to disk instead of keeping the whole workbook in memory, and only turns a small block of rows into
+    Python objects at a time. The workbook is saved under a temporary name first so that a failed export can't leave a
+    broken file in place of the original. Runs in a worker process.
+
+    Args:
+        destination (Path): The Excel file to (over)write.
+        store (FolderStore | ArchiveStore): The cache holding the sheets.
+        sheets (list[str]): The sheets to write, in the order they should appear in the workbook.
+    """
+    wb = Workbook(write_only=True)
+    for sheet in sheets:
+        table = store.read(destination.name, sheet)
+        ws = wb.create_sheet(title=sheet)
+        ws.append(table.columns)
+        for start in range(0, table.frames, EXPORT_CHUNK_FRAMES):
+            block = np.transpose(table.data[:, start:start + EXPORT_CHUNK_FRAMES])
+            missing = np.isnan(block)
+            for row, row_missing in zip(block.tolist(), missing):
+                if row_missing.any(): # openpyxl would write NaN as text, empty cells are what we want instead
+                    row = [None if m else v for v, m in zip(row, row_missing)]
+                ws.append(row)
+
+    temp_path = destination.with_suffix(".tmp")
+    wb.save(temp_path)
+    os.replace(temp_path, destination)
+
+class CacheManifest:
+    """Records which source files have been converted into a given cache folder, along with the size, modification time
+    and content hash they had when they were converted, the dtype they were cached as, and the names of the sheets
+    produced from them. This lets the Converter redo only the files that are new or have changed since the last
+    conversion, or that were cached with a different cache_dtype.
+    """
+    def __init__(self, store: FolderStore | ArchiveStore) -> None:
+        self.store = store
+        self.path = store.cache_path / MANIFEST_NAME
+        self.entries: dict[str, dict] = {}
+        if self.path.exists():
+            with open(self.path, "r") as f:
+                self.entries = json.load(f)
+
+    def is_current(self, source: Path, dtype: str) -> bool:
+        """Checks whether the cached sheets of a source file are up to date. Size and modification time are checked
+        first, the content hash is only computed if the modification time changed but the size did not (for example if
+        the file was copied or touched without being edited).
+
+        Args:
+            source (Path): The measurement file's path.
+            dtype (str): The dtype the cache should have, "float64" or "float32".
+
+        Returns:
+            bool: True if the file does not need to be converted again.
+        """
+        entry = self.entries.get(source.name)
+        if entry is None:
+            return False
+        if entry.get("dtype", "float64") != dtype: # manifests written before the dtype was recorded are all float64
+            return False
+        stat = source.stat()
+        if stat.st_size != entry["size"]:
+            return False
+        if stat.st_mtime_ns == entry["mtime_ns"]:
+            return True
+        if file_hash(source) == entry["hash"]:
+            entry["mtime_ns"] = stat.st_mtime_ns
+            return True
+        return False
+
+    def record(self, source: Path, sheets: list[str], dtype: str) -> None:
+        stat = source.stat()
+        self.entries[source.name] = {
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "hash": file_hash(source),
+            "dtype": dtype,
+            "sheets": sheets
+        }
+
+    def forget(self, name: str) -> None:
+        """Removes a source file from the manifest and deletes everything cached from it, including processed data.
+
+        Args:
+            name (str): The source file's name.
+        """
+        self.entries.pop(name, None)
+        self.store.remove(name)
+
+    def save(self) -> None:
+        """Writes the manifest to a temporary file first and then moves it into place, so an interrupted save can't
+        leave a half-written manifest behind.
+        """
+        temp_path = self.path.with_suffix(".tmp")
+        with open(temp_path, "w") as f:
+            json.dump(self.entries, f, indent=1)
+        os.replace(temp_path, self.path)
+
 
 class Converter:
     """Serves the purpose of creating and managing a cache from the input measurement files because reading Excel with
-    pandas is painfully slow compared to pickle or other binary file formats.
+    pandas is painfully slow compared to binary file formats. Each sheet is cached as a memory-mappable trace table,
+    either in its own file or in a single archive per folder, depending on the layout. In a sharded run only the
+    caches of the shard's folders are brought up to date.
     """
-    def __init__(self, folder: Path, report_name: str) -> None:
+    def __init__(self, folder: Path, report_name: str, performance: Performance = Performance(),
+                 shard: Shard | None = None) -> None:
         self.target_folder = folder.absolute()
         self.report_name = report_name
-        self.lock = Lock()
+        self.performance = performance
+        self.shard = shard
+        self.workers = performance.workers if performance.workers > 0 else (os.cpu_count() or 1)
 
-    def convert_to_pickle(self, finished_files: IntVar):
+    def convert_to_cache(self, progress: Progress) -> list[str]:
         """Reads in all Excel files found in this measurement folders and converts each of their sheets into a separate
-        pickled file. Uses calamine because it is a bit faster than openpyxl.
+        trace file. Uses calamine because it is a bit faster than openpyxl. Only files that are new or have changed
+        since the last conversion are read, and cached data belonging to files that no longer exist is removed.
+        Parsing Excel holds the GIL, so every workbook is converted in its own task on a pool of worker processes,
+        while this process keeps the manifests up to date and publishes the progress.
 
         Args:
-            finished_files (IntVar): A tk variable received from the GUI to keep track of how many files have been
-            finished.
-        """
-        def work(folder: Path, cache_path: Path, files: list[Path]):
-            for file in files:
-                wb = cala.CalamineWorkbook.from_path(folder / file)
-                for sheet in wb.sheet_names:
-                    content = wb.get_sheet_by_name(sheet).to_python()
-                    headers, numbers = content[0], content[1:]
-                    df = pd.DataFrame(data=numbers, columns=headers)
-
-                    df.to_pickle(cache_path / f"{file.name}{NAME_SHEET_SEP}{sheet}.pkl")
-
-                with self.lock:
-                    finished_files.set(finished_files.get() + 1)
-        
-        threads = []
+            progress (Progress): Publishes the telemetry events, one when the stage starts and one for every file.
+
+        Returns:
+            list[str]: Error messages for the files that could not be converted. Empty if there were none.
+        """
+        manifests, tasks = self.plan_conversion()
+        progress(StageStarted("convert", len(tasks)))
+        errors: list[str] = []
+        if tasks: # at least one file needs to be converted
+            with ProcessPoolExecutor(max_workers=min(self.workers, len(tasks)), mp_context=POOL_CONTEXT) as pool:
+                futures = {pool.submit(timed, convert_workbook, source, manifests[cache_path].store,
+                                       self.performance.cache_dtype): (source, cache_path)
+                           for source, cache_path in tasks}
+                for future in as_completed(futures):
+                    source, cache_path = futures[future]
+                    try:
+                        sheets, duration = future.result()
+                    except Exception as e:
+                        # not recording the file in the manifest means it will be tried again next time
+                        errors.append(f"Could not convert {source}: {e}")
+                        continue
+                    manifest = manifests[cache_path]
+                    manifest.record(source, sheets, self.performance.cache_dtype)
+                    manifest.save() # saving after every file means an interrupted conversion keeps its finished files
+                    progress(FileFinished("convert", source.parent.name, source.name, bytes=source.stat().st_size,
+                                          duration=duration))
+
+        for manifest in manifests.values():
+            manifest.store.compact()
+
+        return errors
+
+    def plan_conversion(self) -> tuple[dict[Path, CacheManifest], list[tuple[Path, Path]]]:
+        """Brings every cache folder's layout and manifest up to date, and finds the measurement files that need to be
+        converted.
+
+        Returns:
+            tuple[dict[Path, CacheManifest], list[tuple[Path, Path]]]: The manifests by cache folder, and the files to
+            convert as (measurement file, cache folder) pairs.
+        """
+        manifests: dict[Path, CacheManifest] = {}
+        tasks: list[tuple[Path, Path]] = [] # (measurement file, cache folder) pairs
         for folder in self.target_folder.iterdir():
-            if folder.is_dir():
+            if folder.is_dir() and in_shard(folder, self.shard):
                 cache_path = folder / CACHE_NAME
-                report_path = folder / f"{self.report_name}{folder.name}.xlsx"
-                measurement_files = [Path(f.name) for f in folder.glob("*.xlsx") if f != report_path]
+                measurement_files = [Path(f.name) for f in folder.glob("*.xlsx") if not is_report(f, self.report_name)]
                 if not cache_path.exists():
                     Path.mkdir(cache_path)
-                    threads.append(Thread(target=work, args=(folder, cache_path, measurement_files)))
-        
-        if threads: # at least one cache needs to be created
-            for thread in threads:
-                thread.start()
-            for thread in threads:
-                thread.join()
+                store = open_store(cache_path, self.performance)
+                self.migrate_pickles(store)
+                self.migrate_layout(store)
+
+                if (cache_path / MANIFEST_NAME).exists():
+                    manifest = CacheManifest(store)
+                else:
+                    manifest = self.adopt_cache(folder, store, measurement_files)
 
-        with self.lock:
-            finished_files.set(0)
+                present = {f.name for f in measurement_files}
+                for name in [n for n in manifest.entries if n not in present]:
+                    manifest.forget(name)
 
-    def convert_to_excel(self, finished_files: IntVar):
-        """Converts the cached pickle files back into Excel, overwriting the original files.
+                for file in measurement_files:
+                    if not manifest.is_current(folder / file, self.performance.cache_dtype):
+                        manifest.forget(file.name) # stale sheets and processed data of a changed file must not survive
+                        tasks.append((folder / file, cache_path))
+                manifest.save()
+                manifests[cache_path] = manifest
+
+        return manifests, tasks
+
+    @staticmethod
+    def migrate_pickles(store: FolderStore | ArchiveStore) -> None:
+        """Converts the pickled DataFrames that older versions of the program used as their cache into trace tables.
 
         Args:
-            finished_files (IntVar): A tk variable received from the GUI to keep track of how many files have been
-            finished.
-        """
-        def work(folder: Path, cache_path: Path):
-            cached_files = [f for f in cache_path.glob("*.pkl")]
-            excel_data: dict[str, list[tuple[str, pd.DataFrame]]] = {}
-            # filenames mapped to lists of their content as (sheetname, data) pairs
-            
-            for file in cached_files:
-                file_name = file.name
-                file_data = pd.read_pickle(cache_path / file_name)
-                
-                file_name, sheet_name = file_name.split(sep=NAME_SHEET_SEP)
-                sheet_name = sheet_name.rstrip(".pkl")
-
-                if file_name in excel_data:
-                    excel_data[file_name].append((sheet_name, file_data))
-                else:
-                    excel_data[file_name] = [(sheet_name, file_data)]
+            store (FolderStore | ArchiveStore): The cache to migrate.
+        """
+        for pickled in store.cache_path.glob("*.pkl"):
+            file_name, sheet_name = pickled.name.removesuffix(".pkl").split(sep=NAME_SHEET_SEP)
+            store.write(file_name, {sheet_name: TraceTable.from_frame(pd.read_pickle(pickled))})
+            pickled.unlink()
+
+    @staticmethod
+    def migrate_layout(store: FolderStore | ArchiveStore) -> None:
+        """Moves everything cached in the other layout into the given store, so that changing the cache_layout setting
+        doesn't require converting the Excel files again.
+
+        Args:
+            store (FolderStore | ArchiveStore): The cache in the layout that is currently selected.
+        """
+        if isinstance(store, ArchiveStore):
+            other = FolderStore(store.cache_path, store.compression)
+        else:
+            other = ArchiveStore(store.cache_path, store.compression)
+        for file_name, sheets in other.contents().items():
+            store.write(file_name, {sheet: other.read(file_name, sheet).copy() for sheet in sheets})
+            if isinstance(other, FolderStore):
+                other.remove(file_name)
+        if isinstance(other, ArchiveStore) and other.path.exists():
+            other.path.unlink()
+            other.lock_path.unlink(missing_ok=True)
 
-            for file_name, contents in excel_data.items():
-                contents = sorted(contents, key=lambda x: x[0])
-                with pd.ExcelWriter(folder / file_name) as writer:
-                    for sheet, df in contents:
-                        df.to_excel(writer, sheet_name=sheet, index=False)
-                
-                with self.lock:
-                    finished_files.set(finished_files.get() + 1)
+    @staticmethod
+    def adopt_cache(folder: Path, store: FolderStore | ArchiveStore, files: list[Path]) -> CacheManifest:
+        """Creates a manifest for a cache folder made by an older version of the program, which did not keep one. Files
+        that already have cached sheets are assumed to be up to date, just like the old version assumed, and to be
+        float64, the only dtype it cached.
 
+        Args:
+            folder (Path): The measurement folder.
+            store (FolderStore | ArchiveStore): The existing cache inside it.
+            files (list[Path]): The names of the measurement files in the folder.
+
+        Returns:
+            CacheManifest: The new manifest, already saved to disk.
+        """
+        manifest = CacheManifest(store)
+        cached = store.contents()
+        for file in files:
+            if file.name in cached:
+                manifest.record(folder / file, sorted(cached[file.name]), "float64")
+        manifest.save()
+        return manifest
+
+    def convert_to_excel(self, progress: Progress) -> list[str]:
+        """Converts the cached trace files back into Excel, overwriting the original files. Like the conversion to the
+        cache, every workbook is written by its own task on a pool of worker processes.
 
-        threads = []
+        Args:
+            progress (Progress): Publishes the telemetry events, one when the stage starts and one for every file.
+
+        Returns:
+            list[str]: Error messages for the files that could not be written. Empty if there were none.
+        """
+        manifests: dict[Path, CacheManifest] = {}
+        tasks: list[tuple[Path, Path, list[str]]] = [] # (destination, cache folder, sheet names) triples
         for folder in self.target_folder.iterdir():
             cache_path = folder / CACHE_NAME
-            if cache_path.exists:
-                threads.append(Thread(target=work, args=(folder, cache_path)))
-            else:
+            if not cache_path.exists() or not in_shard(folder, self.shard):
                 continue
+            store = open_store(cache_path, self.performance)
+            self.migrate_pickles(store)
+            self.migrate_layout(store)
+            manifest = CacheManifest(store)
+            manifests[cache_path] = manifest
+
+            for file_name, sheets in store.contents().items():
+                sheets = [s for s in sheets if s not in INTERNAL_SHEETS]
+                # the original sheets keep their original order, sheets added by processing follow in alphabetical order
+                original = manifest.entries.get(file_name, {}).get("sheets", [])
+                order = [s for s in original if s in sheets] + sorted(s for s in sheets if s not in original)
+                tasks.append((folder / file_name, cache_path, order))
 
-        for thread in threads:
-            thread.start()
-        for thread in threads:
-            thread.join()
+        progress(StageStarted("export", len(tasks)))
+        errors: list[str] = []
+        if tasks:
+            with ProcessPoolExecutor(max_workers=min(self.workers, len(tasks)), mp_context=POOL_CONTEXT) as pool:
+                futures = {pool.submit(timed, export_workbook, destination, manifests[cache_path].store, sheets):
+                           (destination, cache_path, sheets)
+                           for destination, cache_path, sheets in tasks}
+                for future in as_completed(futures):
+                    destination, cache_path, sheets = futures[future]
+                    try:
+                        _, duration = future.result()
+                    except Exception as e:
+                        errors.append(f"Could not write {destination}: {e}")
+                        continue
+                    # the rewritten file has the same content as the cache, so it shouldn't be converted again
+                    manifest = manifests[cache_path]
+                    dtype = manifest.entries.get(destination.name, {}).get("dtype", "float64")
+                    manifest.record(destination, sheets, dtype)
+                    manifest.save()
+                    progress(FileFinished("export", destination.parent.name, destination.name,
+                                          bytes=destination.stat().st_size, duration=duration))
 
-        with self.lock:
-            finished_files.set(0)
+        return errors
 
     def purge_cache(self):
         for folder in self.target_folder.iterdir():
@@ -1,14 +1,19 @@
 from pathlib import Path
-from threading import Thread
-from tkinter import IntVar
 
 import pandas as pd
 
+from .batch import BATCH_NAME, BatchRunner, load_batch
 from .converter import Converter
-from .processor import DataProcessor
+from .pipeline import PipelineRunner
+from .processor import DataProcessor, counts_task, file_task, graph_task, report_task, sweep_task
+from .results import FileResult
+from .scheduler import Scheduler
+from .shards import Shard, in_shard, merge_shard_indexes
+from .summary import SummaryIndex
+from .telemetry import Progress, StageStarted
 from .toml_data import Config
 
-type ExperimentalCondition = list[str] # list of agonists used in this particular experiment
+type ExperimentalCondition = tuple[str, ...] # the agonists used in this particular experiment
 type ExperimentalData = tuple[str, pd.Series] # the string is the folder name where the experiment's data is;
 # the pd.Series is multi-indexed, by the reaction column names and shows how many cells belong to a given combination
 # of reactions (such as TRPM3+ TRPA1- TRPV1- neurons)
@@ -22,13 +27,17 @@ class AnalysisEngine:
         config (dict[str, dict[str, str]]): The config file as a Python dict.
         repeat (bool): The --repeat command line flag as a bool. Tells the subdirectory level processors to skip already
         processed directories.
+        shard (Shard | None): Only the subdirectories of this shard are worked on, and the summary is left to the merge
+        step, see analysis.shards. None if the run isn't sharded.
     """
-    def __init__(self, config: Config, finished_files: IntVar, repeat: bool) -> None:
+    def __init__(self, config: Config, progress: Progress, repeat: bool, shard: Shard | None = None) -> None:
         self.config = config
+        self.shard = shard
         self._processors: list[DataProcessor] = []
         self.repeat = repeat
-        self.finished_files = finished_files
-        self.experiments: dict[ExperimentalCondition, list[ExperimentalData]]
+        self.progress = progress
+        self.experiments: dict[ExperimentalCondition, list[ExperimentalData]] = {}
+        self.scheduler = Scheduler(config.performance, progress)
 
     def create_processor_instances(self) -> list[str]:
         """Creates a new SubDir object for the given path and appends it to a (private) list.
@@ -39,7 +48,7 @@ class AnalysisEngine:
         """
         errors = []
         for path in self.config.input.target_folder.iterdir():
-            if path.is_dir():
+            if path.is_dir() and in_shard(path, self.shard):
                 instance = DataProcessor(path, self.config)
                 error = instance.preprocessing(self.repeat)
                 if error is not None:
@@ -48,76 +57,203 @@ class AnalysisEngine:
         
         return errors
     
-    def create_caches(self) -> None:
-        converter = Converter(self.config.input.target_folder, self.config.output.report_name)
-        converter.convert_to_pickle(self.finished_files)
+    def create_caches(self) -> list[str]:
+        """Brings the cache of every subdirectory up to date.
+
+        Returns:
+            list[str]: Error messages about measurement files that could not be converted. Empty if there were none.
+        """
+        converter = Converter(self.config.input.target_folder, self.config.output.report_name, self.config.performance,
+                              self.shard)
+        return converter.convert_to_cache(self.progress)
 
     def process_data(self, errors: list[str]):
-        """Processes all subdirectories in the target directory, using the method set in the config file.
+        """Processes all subdirectories in the target directory, using the method set in the config file. Every
+        measurement file is a task of its own, and the biggest ones are started first, so that a folder with many (or
+        long) measurements doesn't keep one worker busy while the others are idle. Then the reports are put together,
+        one task per folder.
         """
-        arg_tuple = (self.finished_files, errors)
-        threads = []
-        
-        for processor in self._processors:
-            thread = Thread(target=processor.make_report, args=arg_tuple)
-            threads.append(thread)
-            thread.start()
+        processors = {processor.path.name: processor for processor in self._processors if processor.need_to_work}
+        sizes = {file: processor.file_size(file) for processor in processors.values()
+                 for file in processor.measurement_files}
+        tasks = {file: (file_task, (file, self.config)) for file in sorted(sizes, key=sizes.get, reverse=True)}
+        self.progress(StageStarted("process", len(tasks)))
+        file_results, task_errors = self.scheduler.run(tasks)
 
-        for thread in threads:
-            thread.join()
-        
-        self.finished_files.set(0)
+        folder_results: dict[str, dict[str, FileResult]] = {name: {} for name in processors}
+        for file, file_result in file_results.items():
+            folder_results[file.parent.name][file.name] = file_result
+        # the reports are written without publishing progress, every file has been counted already
+        tasks = {name: (report_task, (processor.path, self.config, folder_results[name]))
+                 for name, processor in processors.items()}
+        results, report_errors = self.scheduler.run(tasks)
+        for folder in sorted(results):
+            errors.extend(results[folder])
+        errors.extend(task_errors + report_errors)
+
+    def summarize_results(self) -> list[str]:
+        """Creates a summary file from all available measurement reports. Only the reports that changed since the last
+        summary are loaded (by the scheduler), the counts of the other experiments are taken from the summary index.
+
+        Returns:
+            list[str]: Error messages about reports that could not be loaded, these are left out of the summary.
+        """
+        index = self.summary_index()
+        tasks = {name: (counts_task, (processor.path, self.config))
+                 for name, processor in self.stale_reports(index).items()}
+        self.progress(StageStarted("summary", len(tasks)))
+        counts, errors = self.scheduler.run(tasks)
+        self.write_summary(index, counts, set(tasks) - set(counts))
+        return errors
+
+    def summary_index(self) -> SummaryIndex:
+        """The summary index of the target folder, or that of the shard if the run is sharded.
+        """
+        if self.shard is None:
+            return SummaryIndex(self.config.input.target_folder)
+        return SummaryIndex(self.config.input.target_folder, self.shard.index_name)
+
+    def stale_reports(self, index: SummaryIndex) -> dict[str, DataProcessor]:
+        """Finds the reports that changed since they were last counted.
+
+        Returns:
+            dict[str, DataProcessor]: The processors of these reports, by folder name.
+        """
+        return {p.path.name: p for p in self._processors
+                if p.has_metadata and p.report_path.exists() and not index.is_current(p.path.name, p.report_path)}
+
+    def write_summary(self, index: SummaryIndex, counts: dict[str, pd.Series], failed: set[str]) -> None:
+        """Records the new counts in the summary index, then writes the summary of every experiment in it. A sharded run
+        only saves the index of its shard, the summary is written by merge_shards.
+
+        Args:
+            index (SummaryIndex): The summary index of the target folder.
+            counts (dict[str, pd.Series]): The reaction counts of the reports that were loaded, by folder name.
+            failed (set[str]): The folders whose reports could not be loaded, a report like that is left out rather
+            than counted wrong.
+        """
+        processors = {p.path.name: p for p in self._processors if p.has_metadata and p.report_path.exists()}
+        for folder, folder_counts in counts.items():
+            index.record(folder, processors[folder].report_path, processors[folder].agonists, folder_counts)
+        index.retain([folder for folder in processors if folder not in failed])
+        index.save()
+        if self.shard is None:
+            self.write_summary_workbook(index)
+
+    def merge_shards(self) -> list[str]:
+        """Merges the summary indexes written by the shards of a sharded run into the summary index of the target
+        folder, and writes the summary from it, the same one an unsharded run would have written.
+
+        Returns:
+            list[str]: Error messages if some of the shards haven't finished, in which case nothing is written.
+        """
+        index, errors = merge_shard_indexes(self.config.input.target_folder)
+        if errors:
+            return errors
+        index.save()
+        self.write_summary_workbook(index)
+        return []
 
-    def summarize_results(self):
-        """Creates a summary file from all available measurement reports.
+    def write_summary_workbook(self, index: SummaryIndex) -> None:
+        """Writes the summary of every experiment in the summary index, one sheet for every experimental condition.
         """
         name = self.config.output.summary_name
         summary_file_name: Path = self.config.input.target_folder / f"{name}.xlsx"
-        threads = []
-        for processor in self._processors:
-            thread = Thread(target=processor.load_summary_from_report, args=(self.finished_files,))
-            threads.append(thread)
-            thread.start()
-
-        for thread in threads:
-            thread.join()
-
-        for processor in self._processors:
-            assert isinstance(processor.report, pd.DataFrame) # will never fail, but Pylance can't see why
-            condition: ExperimentalCondition = list(processor.treatment_col_names)
-            results: ExperimentalData = (processor.path.name, processor.report[["cell_type"] + processor.treatment_col_names].value_counts())
-            if condition not in self.experiments.keys():
-                self.experiments[condition] = [results]
-            else:
-                self.experiments[condition].append(results)
+        self.experiments = {}
+        for folder in sorted(index.entries):
+            condition, folder_counts = index.experiment(folder)
+            results: ExperimentalData = (folder, folder_counts)
+            self.experiments.setdefault(condition, []).append(results)
         
         with pd.ExcelWriter(summary_file_name) as writer:
             for condition, data in self.experiments.items():
-                summary = pd.DataFrame(index=data[0][1].index)
-                for name, series in data:
-                    summary[name] = series
+                # every combination of reactions found in any of the experiments gets a row
+                summary = pd.concat({name: series for name, series in data}, axis=1).fillna(0).astype(int)
                 
                 sheet_name = ""
                 for agonist in condition:
                     sheet_name += f"{agonist} "
-                sheet_name = sheet_name.rstrip()
+                sheet_name = sheet_name.rstrip()[:31] # Excel doesn't allow longer sheet names
                 
                 summary.to_excel(writer, sheet_name=sheet_name)
 
-        self.finished_files.set(0)
+    def run_pipeline(self, process: bool, summarize: bool, graph: bool) -> list[str]:
+        """Brings the caches up to date and runs the selected stages as a pipeline, where every file moves on to the
+        next stage as soon as it's ready, see analysis.pipeline. The processors need to exist already.
 
+        Args:
+            process (bool): Whether to process the data.
+            summarize (bool): Whether to summarize the results.
+            graph (bool): Whether to make graphs.
 
-    def graph_data(self):
-        """Makes graphs from every measurement in every subdirectory. The graphs will be saved in new folders, each
-        named after the measurement file from which the graphs were created.
+        Returns:
+            list[str]: Error messages from every stage, empty if there were none.
+        """
+        index = self.summary_index()
+
+        def write_summary(counts: dict[str, pd.Series], failed: set[str]) -> None:
+            self.write_summary(index, counts, failed)
+
+        runner = PipelineRunner(self.config, self._processors, self.scheduler, self.progress, process, graph,
+                                write_summary if summarize else None, self.stale_reports(index) if summarize else {},
+                                self.shard)
+        return runner.run()
+
+    def sweep_thresholds(self) -> tuple[Path, list[str]]:
+        """Counts reacting cells and cells passing the neuron filter in every subdirectory with every value in the sweep
+        section of the config, and saves the counts to a single workbook in the target folder. Every subdirectory is a
+        task on the scheduler.
+
+        Returns:
+            tuple[Path, list[str]]: The path of the workbook, and error messages about subdirectories that could not
+            be swept, these are left out of the workbook.
+        """
+        sweep_file_name: Path = self.config.input.target_folder / f"{self.config.output.summary_name}_sweep.xlsx"
+        processors = [processor for processor in self._processors if processor.has_metadata]
+        self.progress(StageStarted("sweep", sum(len(processor.measurement_files) for processor in processors)))
+        tasks = {processor.path.name: (sweep_task, (processor.path, self.config)) for processor in processors}
+        results, errors = self.scheduler.run(tasks)
+
+        folders = sorted(results)
+        if not folders: # the workbook is still written, with the settings and no counts
+            errors.append(f"No subdirectory of {self.config.input.target_folder} could be swept.")
+        reactions = pd.concat([results[folder][0] for folder in folders]) if folders else pd.DataFrame()
+        filters = pd.concat([results[folder][1] for folder in folders]) if folders else pd.DataFrame()
+        if not reactions.empty:
+            reactions["fraction"] = reactions["reacting"] / reactions["cells"]
+            filters["fraction"] = filters["passing"] / filters["cells"]
+
+        with pd.ExcelWriter(sweep_file_name) as writer:
+            reactions.to_excel(writer, sheet_name="Reactions", index=False)
+            filters.to_excel(writer, sheet_name="Neuron filter", index=False)
+            settings = pd.Series({"method": self.config.input.method, "smoothing_range": self.config.input.smoothing_range,
+                                  "correction": self.config.input.correction}, name="value")
+            settings.to_excel(writer, sheet_name="Settings", index_label="setting")
+
+        return sweep_file_name, errors
+
+    def run_batch(self) -> list[str]:
+        """Runs every variant listed in the batch file of the target folder, writing a set of reports for each. Work that
+        variants have in common is only done once, see analysis.batch.
+
+        Returns:
+            list[str]: Error messages about the batch file or the subdirectories. Empty if there were none.
         """
-        threads = []
-        for processor in self._processors:
-            thread = Thread(target=processor.make_graphs, args=(self.finished_files,))
-            threads.append(thread)
-            thread.start()
+        variants, error = load_batch(self.config.input.target_folder / BATCH_NAME, self.config)
+        if error:
+            return [error]
+        return BatchRunner(self.config, variants, self.progress, self.repeat).run(self.scheduler)
 
-        for thread in threads:
-            thread.join()
+    def graph_data(self) -> list[str]:
+        """Makes graphs from every measurement in every subdirectory. The graphs will be saved in new folders, each
+        named after the measurement file from which the graphs were created.
 
-        self.finished_files.set(0)
+        Returns:
+            list[str]: Error messages about subdirectories whose graphs could not be drawn.
+        """
+        processors = [processor for processor in self._processors if processor.has_metadata]
+        sizes = {file: processor.file_size(file) for processor in processors for file in processor.measurement_files}
+        tasks = {file: (graph_task, (file, self.config)) for file in sorted(sizes, key=sizes.get, reverse=True)}
+        self.progress(StageStarted("graph", len(tasks)))
+        _, errors = self.scheduler.run(tasks)
+        return errors
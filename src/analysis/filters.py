@@ -0,0 +1,186 @@
+"""Smoothing filters that work on every trace of a measurement at once. All of them take a 2d array of frames x cells,
+smooth each column with a centered window of window_size frames, and shrink the window near the edges of the
+measurement, so that the first and last frames are smoothed using only the frames that actually exist. With the
+"mean" filter this gives exactly what the original smooth function does for a single trace.
+"""
+from __future__ import annotations
+
+from typing import Callable
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+SAVGOL_ORDER = 2 # the order of the polynomial fitted by the Savitzky-Golay filter
+
+
+def edge_windows(length: int, window_size: int) -> list[slice]:
+    """Returns the windows of the frames near the edges of a measurement, where the full window doesn't fit. The first
+    half of the list belongs to the first frames, the second half to the last ones, in order.
+    """
+    half_size = min(window_size // 2, (length + 1) // 2)
+    starts = [slice(0, min(index + window_size // 2 + 1, length)) for index in range(half_size)]
+    ends = [slice(max(index - window_size // 2, 0), length) for index in range(length - half_size, length)]
+    return starts + ends
+
+def edge_rows(length: int, window_size: int) -> list[int]:
+    """Returns the frame indices that belong to the windows returned by edge_windows, in the same order.
+    """
+    half_size = min(window_size // 2, (length + 1) // 2)
+    return list(range(half_size)) + list(range(length - half_size, length))
+
+def moving_average(data: np.ndarray, window_size: int) -> np.ndarray:
+    """Replaces every value with the mean of the window_size values centered on it. Uses cumulative sums, so the cost
+    doesn't depend on the window size. NaN values only affect the windows they are in, same as with a plain mean.
+
+    Args:
+        data (np.ndarray): The traces to smooth, frames x cells.
+        window_size (int): The size of the window, it should be an odd number.
+
+    Returns:
+        np.ndarray: The smoothed traces, same shape as the input.
+    """
+    length = data.shape[0]
+    # subtracting the first frame keeps the cumulative sums small, which keeps them accurate on long measurements
+    missing = np.isnan(data)
+    has_missing = bool(missing.any())
+    offset = np.nan_to_num(data[:1])
+    sums = np.zeros((length + 1,) + data.shape[1:], dtype=np.float64)
+    np.cumsum(np.where(missing, 0.0, data - offset) if has_missing else data - offset, axis=0, out=sums[1:])
+    result = window_means(sums, window_size)
+    if has_missing:
+        nan_counts = np.zeros(sums.shape, dtype=np.float64)
+        np.cumsum(missing, axis=0, out=nan_counts[1:])
+        result[window_means(nan_counts, window_size) > 0] = np.nan
+    return result + offset
+
+def window_means(sums: np.ndarray, window_size: int) -> np.ndarray:
+    """Turns cumulative sums (with a leading row of zeros) into the means of the windows used by moving_average.
+    """
+    length = sums.shape[0] - 1
+    result = np.empty(sums[1:].shape, dtype=np.float64)
+    if length >= window_size:
+        half_size = window_size // 2
+        np.subtract(sums[window_size:], sums[:length - window_size + 1], out=result[half_size:length - half_size])
+        result[half_size:length - half_size] /= window_size
+    for row, window in zip(edge_rows(length, window_size), edge_windows(length, window_size)):
+        result[row] = (sums[window.stop] - sums[window.start]) / (window.stop - window.start)
+    return result
+
+def weighted_window(data: np.ndarray, weights: np.ndarray, edge_weights: list[np.ndarray]) -> np.ndarray:
+    """Smooths with a fixed set of weights where the whole window fits, and separate weights for every edge frame.
+
+    Args:
+        data (np.ndarray): The traces to smooth, frames x cells.
+        weights (np.ndarray): The weights of a full window.
+        edge_weights (list[np.ndarray]): The weights of every window returned by edge_windows.
+
+    Returns:
+        np.ndarray: The smoothed traces, same shape as the input.
+    """
+    length, window_size = data.shape[0], len(weights)
+    result = np.empty(data.shape, dtype=np.float64)
+    if length >= window_size:
+        half_size = window_size // 2
+        middle = result[half_size:length - half_size]
+        middle[:] = weights[0] * data[:length - window_size + 1]
+        for tap in range(1, window_size): # the windows are short, so looping over them is cheap
+            middle += weights[tap] * data[tap:length - window_size + 1 + tap]
+    for row, window, row_weights in zip(edge_rows(length, window_size), edge_windows(length, window_size), edge_weights):
+        result[row] = row_weights @ data[window]
+    return result
+
+def gaussian(data: np.ndarray, window_size: int) -> np.ndarray:
+    """Gaussian weighted average, with a standard deviation of a quarter of the window size, so the window spans two
+    standard deviations on either side. The weights are renormalized where the window is cut short at the edges.
+
+    Args:
+        data (np.ndarray): The traces to smooth, frames x cells.
+        window_size (int): The size of the window, it should be an odd number.
+
+    Returns:
+        np.ndarray: The smoothed traces, same shape as the input.
+    """
+    half_size = window_size // 2
+    offsets = np.arange(-half_size, half_size + 1)
+    sigma = max(window_size / 4, 1e-12)
+    weights = np.exp(-0.5 * (offsets / sigma) ** 2)
+
+    edge_weights = []
+    for row, window in zip(edge_rows(data.shape[0], window_size), edge_windows(data.shape[0], window_size)):
+        row_weights = weights[window.start - row + half_size:window.stop - row + half_size]
+        edge_weights.append(row_weights / row_weights.sum())
+    return weighted_window(data, weights / weights.sum(), edge_weights)
+
+def savgol_weights(offsets: np.ndarray, order: int) -> np.ndarray:
+    """Computes the weights that give the value of a least squares polynomial fit at offset 0, for the given offsets.
+    """
+    order = min(order, len(offsets) - 1)
+    vandermonde = np.vander(offsets.astype(np.float64), order + 1, increasing=True)
+    return np.linalg.pinv(vandermonde)[0]
+
+def savitzky_golay(data: np.ndarray, window_size: int) -> np.ndarray:
+    """Savitzky-Golay filter, which fits a polynomial of order 2 to each window and takes its value in the middle. This
+    preserves the height of sharp peaks better than a moving average does. At the edges the polynomial is fitted to the
+    shortened window, and evaluated at the frame being smoothed.
+
+    Args:
+        data (np.ndarray): The traces to smooth, frames x cells.
+        window_size (int): The size of the window, it should be an odd number.
+
+    Returns:
+        np.ndarray: The smoothed traces, same shape as the input.
+    """
+    half_size = window_size // 2
+    weights = savgol_weights(np.arange(-half_size, half_size + 1), SAVGOL_ORDER)
+    edge_weights = [savgol_weights(np.arange(window.start, window.stop) - row, SAVGOL_ORDER)
+                    for row, window in zip(edge_rows(data.shape[0], window_size), edge_windows(data.shape[0], window_size))]
+    return weighted_window(data, weights, edge_weights)
+
+def median(data: np.ndarray, window_size: int) -> np.ndarray:
+    """Replaces every value with the median of the window centered on it, which removes single frame spikes without
+    flattening real responses as much as a mean does.
+
+    Args:
+        data (np.ndarray): The traces to smooth, frames x cells.
+        window_size (int): The size of the window, it should be an odd number.
+
+    Returns:
+        np.ndarray: The smoothed traces, same shape as the input.
+    """
+    length = data.shape[0]
+    result = np.empty(data.shape, dtype=np.float64)
+    if length >= window_size:
+        half_size = window_size // 2
+        result[half_size:length - half_size] = np.median(sliding_window_view(data, window_size, axis=0), axis=-1)
+    for row, window in zip(edge_rows(length, window_size), edge_windows(length, window_size)):
+        result[row] = np.median(data[window], axis=0)
+    return result
+
+FILTERS: dict[str, Callable[[np.ndarray, int], np.ndarray]] = {
+    "mean": moving_average,
+    "median": median,
+    "gaussian": gaussian,
+    "savgol": savitzky_golay
+}
+
+def smooth_traces(data: np.ndarray, window_size: int = 5, method: str = "mean") -> np.ndarray:
+    """Smooths every trace of a measurement in one call.
+
+    Args:
+        data (np.ndarray): The traces to smooth, frames x cells (a 1d array is treated as a single trace).
+        window_size (int, optional): The size of the window, it should be an odd number. Defaults to 5.
+        method (str, optional): One of the keys of FILTERS. Defaults to "mean".
+
+    Raises:
+        ValueError: If the method is not one of the available filters.
+
+    Returns:
+        np.ndarray: The smoothed traces as float64, same shape as the input.
+    """
+    if method not in FILTERS:
+        raise ValueError(f"Unknown smoothing filter: {method}. Available filters are: {', '.join(FILTERS)}.")
+    data = np.asarray(data, dtype=np.float64)
+    if data.ndim == 1:
+        return FILTERS[method](data[:, np.newaxis], max(int(window_size), 1))[:, 0]
+    return FILTERS[method](data, max(int(window_size), 1))
@@ -0,0 +1,191 @@
+"""Streaming mode: conversion, processing, the summary and graphing run as one pipeline instead of one stage after the
+other.
+
+Every measurement file moves on to the next stage as soon as it is ready: it is processed as soon as it is in the cache,
+and its graphs are drawn as soon as it is processed. A folder's report is put together when its last file is processed,
+and the summary is written when the last report is counted, while the rest of the graphs are still being drawn. This
+way converting files (mostly reading them from disk) overlaps with processing and drawing graphs (mostly computation),
+and no worker waits for a whole stage to finish. The stages are tasks on the engine's scheduler, see
+Scheduler.stream for how many are queued at a time.
+"""
+from __future__ import annotations
+
+from pathlib import Path
+from typing import Any, Callable, NamedTuple
+
+import pandas as pd
+
+from .converter import CacheManifest, Converter, FolderStore, ArchiveStore, convert_workbook
+from .processor import DataProcessor, counts_task, file_task, graph_task, report_task
+from .results import FileResult
+from .scheduler import FAILED, Scheduler, Task
+from .shards import Shard
+from .telemetry import FileFinished, Progress, StageStarted, timed
+from .toml_data import Config
+
+type Summarize = Callable[[dict[str, pd.Series], set[str]], None] # the counts by folder, and the folders that failed
+
+
+class Step(NamedTuple):
+    """A task of the pipeline: a stage, and the folder (and file) it is done for.
+    """
+    stage: str # "convert", "process", "graph", "report" or "counts"
+    folder: str
+    file: str = "" # empty for the stages done once per folder
+
+    def __str__(self) -> str:
+        return f"{self.folder}/{self.file} ({self.stage})" if self.file else f"{self.folder} ({self.stage})"
+
+
+def convert_task(source: Path, store: FolderStore | ArchiveStore, dtype: str, progress: Progress) -> list[str]:
+    """Converts a measurement file to the cache. The main process records it in the manifest.
+    """
+    sheets, duration = timed(convert_workbook, source, store, dtype)
+    progress(FileFinished("convert", source.parent.name, source.name, bytes=source.stat().st_size, duration=duration))
+    return sheets
+
+
+class PipelineRunner:
+    """Runs the stages selected in the GUI on every subdirectory, as a pipeline.
+
+    Args:
+        config (Config): The config.
+        processors (list[DataProcessor]): The engine's processors, with their metadata already read.
+        scheduler (Scheduler): The engine's scheduler.
+        progress (Progress): Publishes the telemetry events, every stage announces all of its files at the start.
+        process (bool): Whether to make the reports (of the folders that need them).
+        graph (bool): Whether to draw graphs.
+        summarize (Summarize | None): Writes the summary, given the counts of the reports that changed. None if there
+        should be no summary.
+        stale (dict[str, DataProcessor]): The reports that changed since they were last counted. Those made in this run
+        are counted either way.
+        shard (Shard | None, optional): Only the caches of this shard's folders are converted. Defaults to None, all of
+        them.
+    """
+    def __init__(self, config: Config, processors: list[DataProcessor], scheduler: Scheduler, progress: Progress,
+                 process: bool, graph: bool, summarize: Summarize | None, stale: dict[str, DataProcessor],
+                 shard: Shard | None = None) -> None:
+        self.config = config
+        self.shard = shard
+        self.processors = {processor.path.name: processor for processor in processors if processor.has_metadata}
+        self.scheduler = scheduler
+        self.progress = progress
+        self.graph = graph
+        self.summarize = summarize
+        self.reporting = {name for name, processor in self.processors.items() if process and processor.need_to_work}
+        # files still to be processed, the results of those that were, and the reports still to be counted
+        self.unprocessed = {name: {f.name for f in self.processors[name].measurement_files} for name in self.reporting}
+        self.file_results: dict[str, dict[str, FileResult]] = {name: {} for name in self.reporting}
+        self.uncounted = set(self.reporting) | set(stale) if summarize is not None else set()
+        self.counts: dict[str, pd.Series] = {}
+        self.failed_counts: set[str] = set()
+        self.errors: list[str] = []
+        self.manifests: dict[str, CacheManifest] = {} # by folder name
+
+    def run(self) -> list[str]:
+        """Runs the pipeline until every stage of every file is done.
+
+        Returns:
+            list[str]: Error messages from every stage, empty if there were none.
+        """
+        converter = Converter(self.config.input.target_folder, self.config.output.report_name, self.config.performance,
+                              self.shard)
+        manifests, conversions = converter.plan_conversion()
+        self.manifests = {cache_path.parent.name: manifest for cache_path, manifest in manifests.items()}
+        # the files that have to be converted come first, the biggest of each kind first
+        tasks: dict[Step, Task] = {}
+        converting: set[tuple[str, str]] = set()
+        for source, cache_path in sorted(conversions, key=lambda pair: pair[0].stat().st_size, reverse=True):
+            step = Step("convert", source.parent.name, source.name)
+            tasks[step] = (convert_task, (source, manifests[cache_path].store, self.config.performance.cache_dtype))
+            converting.add((step.folder, step.file))
+        cached = [(processor, file) for processor in self.processors.values() for file in processor.measurement_files
+                  if (processor.path.name, file.name) not in converting]
+        for processor, file in sorted(cached, key=lambda pair: pair[0].file_size(pair[1]), reverse=True):
+            tasks.update(self.after_conversion(processor.path.name, file.name))
+        for name in self.reporting:
+            if not self.unprocessed[name]: # an empty folder still gets its (empty) report
+                tasks[Step("report", name)] = (report_task, (self.processors[name].path, self.config, {}))
+        for name in self.uncounted - self.reporting:
+            tasks[Step("counts", name)] = (counts_task, (self.processors[name].path, self.config))
+
+        graphed = [file for processor in self.processors.values() for file in processor.measurement_files]
+        self.progress(StageStarted("convert", len(conversions)))
+        self.progress(StageStarted("process", sum(len(files) for files in self.unprocessed.values())))
+        self.progress(StageStarted("graph", len(graphed) if self.graph else 0))
+        self.progress(StageStarted("summary", len(self.uncounted)))
+        if not self.uncounted and self.summarize is not None: # every count is in the summary index already
+            self.summarize({}, set())
+        _, errors = self.scheduler.stream(tasks, self.follow_up)
+
+        for manifest in self.manifests.values():
+            manifest.store.compact()
+        return self.errors + errors
+
+    def follow_up(self, step: Step, result: Any) -> dict[Step, Task]:
+        """Records the result of a finished step, and returns the steps that can start because of it.
+        """
+        match step.stage:
+            case "convert":
+                if result is FAILED: # the file is left out, and tried again next time
+                    return self.file_done(step.folder, step.file, None)
+                manifest = self.manifests[step.folder]
+                source = manifest.store.cache_path.parent / step.file
+                manifest.record(source, result, self.config.performance.cache_dtype)
+                manifest.save() # saving after every file means an interrupted run keeps its finished files
+                return self.after_conversion(step.folder, step.file)
+            case "process":
+                return self.file_done(step.folder, step.file, None if result is FAILED else result)
+            case "report":
+                if result is not FAILED:
+                    self.errors.extend(result)
+                if step.folder in self.uncounted:
+                    if result is FAILED:
+                        return self.counted(step.folder, FAILED)
+                    return {Step("counts", step.folder): (counts_task, (self.processors[step.folder].path,
+                                                                         self.config))}
+            case "counts":
+                return self.counted(step.folder, result)
+        return {}
+
+    def after_conversion(self, folder: str, file: str) -> dict[Step, Task]:
+        """The next step of a file that is in the cache: processing if its folder gets a report, otherwise graphing (with
+        the reactions of its last report).
+        """
+        if folder not in self.processors:
+            return {} # no metadata, only the cache is made
+        path = self.processors[folder].path / file
+        if folder in self.reporting:
+            return {Step("process", folder, file): (file_task, (path, self.config))}
+        if self.graph:
+            return {Step("graph", folder, file): (graph_task, (path, self.config))}
+        return {}
+
+    def file_done(self, folder: str, file: str, result: FileResult | None) -> dict[Step, Task]:
+        """Records the result of a processed file (None if it failed), and returns its graphing step, and the report of
+        its folder if this was the last file.
+        """
+        if folder not in self.reporting:
+            return {}
+        tasks: dict[Step, Task] = {}
+        if result is not None:
+            self.file_results[folder][file] = result
+            if self.graph and not (result.bad_sheets or result.bad_groups or result.bad_windows):
+                tasks[Step("graph", folder, file)] = (graph_task, (self.processors[folder].path / file, self.config))
+        self.unprocessed[folder].discard(file)
+        if not self.unprocessed[folder]:
+            tasks[Step("report", folder)] = (report_task, (self.processors[folder].path, self.config,
+                                                            self.file_results.pop(folder)))
+        return tasks
+
+    def counted(self, folder: str, result: Any) -> dict[Step, Task]:
+        """Records the reaction counts of a report, and writes the summary once every report is counted.
+        """
+        if result is FAILED:
+            self.failed_counts.add(folder)
+        else:
+            self.counts[folder] = result
+        self.uncounted.discard(folder)
+        if not self.uncounted and self.summarize is not None:
+            self.summarize(self.counts, self.failed_counts)
+        return {}
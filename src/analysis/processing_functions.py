@@ -1,7 +1,8 @@
 from __future__ import annotations
 
 import numpy as np
-import pandas as pd
+
+from .window_stats import WindowStats
 
 
 def normalize(array: np.ndarray, baseline: int) -> np.ndarray:
@@ -16,97 +17,128 @@ def normalize(array: np.ndarray, baseline: int) -> np.ndarray:
     """
     return array / array[0:baseline].mean()
 
-def baseline_threshold(cell_data: np.ndarray, agonist_slices: dict[str, slice[int]], file_result: pd.DataFrame, sd_mult: int):
+def baseline_threshold(stats: WindowStats, file_result: dict[str, np.ndarray], sd_mult: int):
     """Determines which agonists cells reacted to and measures the response amplitudes. Reaction state is determined by
     comparing the response amplitude with the mean of the baseline + sd_mult * baseline standard deviation.
 
     Args:
-        cell_data (np.ndarray): The 2d numpy array representing data from all cells in the given measurement.
-        agonist_slices (dict[str, slice[int]]): A dictionary mapping agonist names to the indices where each agonist was
-        applied.
-        file_result (pd.DataFrame): The DataFrame storing all output for this measurement file.
+        stats (WindowStats): The statistics of every cell in every treatment window of the given measurement.
+        file_result (dict[str, np.ndarray]): The columns storing all output for this measurement file.
         sd_mult (int): Determines by how many standard deviations must a cell's response exceed the baseline mean to be
         considered positive for any given agonist.
     """
-    baseline_means = cell_data[:,agonist_slices["baseline"]].mean(axis=1, keepdims=True)
-    baseline_stdevs = cell_data[:,agonist_slices["baseline"]].std(axis=1, mean=baseline_means, keepdims=False)
-    thresholds = baseline_means.flatten() + sd_mult*baseline_stdevs
+    baseline_means = stats.mean("baseline")
+    thresholds = baseline_means + sd_mult*stats.std("baseline")
     
-    for agonist, time_window in agonist_slices.items():
-        if agonist == "baseline":
-            continue
-        maximums = cell_data[:,time_window].max(axis=1, keepdims=False)
-        amplitudes = maximums - baseline_means.flatten()
+    for agonist in stats.agonists:
+        maximums = stats.max(agonist)
+        amplitudes = maximums - baseline_means
         reactions = np.where(maximums > thresholds, True, False)
         file_result[agonist + "_reaction"] = reactions
         file_result[agonist + "_amp"] = amplitudes
 
-def previous_threshold(cell_data: np.ndarray, agonist_slices: dict[str, slice[int]], file_result: pd.DataFrame, sd_mult: int):
+def previous_threshold(stats: WindowStats, file_result: dict[str, np.ndarray], sd_mult: int):
     """Determines which agonists cells reacted to and measures the response amplitudes. Reaction state is determined by
     comparing the response amplitude with the mean of the last 10 values in the previous agonist's time window + 
     sd_mult * baseline standard deviation.
 
     Args:
-        cell_data (np.ndarray): The 2d numpy array representing data from all cells in the given measurement.
-        agonist_slices (dict[str, slice[int]]): A dictionary mapping agonist names to the indices where each agonist was
-        applied.
-        file_result (pd.DataFrame): The DataFrame storing all output for this measurement file.
+        stats (WindowStats): The statistics of every cell in every treatment window of the given measurement.
+        file_result (dict[str, np.ndarray]): The columns storing all output for this measurement file.
         sd_mult (int): Determines by how many standard deviations must a cell's response exceed the mean of the last 10
         values in the previous agonist's time window to be considered positive for any given agonist.
     """
-    baseline_means = cell_data[:,agonist_slices["baseline"]].mean(axis=1, keepdims=True)
-    baseline_stdevs = cell_data[:,agonist_slices["baseline"]].std(axis=1, mean=baseline_means, keepdims=False)
+    baseline_stdevs = stats.std("baseline")
 
-    for agonist, time_window in agonist_slices.items():
-        if agonist == "baseline":
-            continue
-        prev_means = cell_data[:,time_window.start - 10:time_window.start].mean(axis=1, keepdims=False)
+    for agonist in stats.agonists:
+        prev_means = stats.tail_mean(agonist)
         thresholds = prev_means + sd_mult*baseline_stdevs
-        maximums = cell_data[:,time_window].max(axis=1, keepdims=False)
-        amplitudes = maximums - prev_means.flatten()
+        maximums = stats.max(agonist)
+        amplitudes = maximums - prev_means
         # using amplitudes to determine reactions is wrong because of the baseline substraction
         # (only cells where the max is larger than the threshold by at least the value of the baseline mean would be 
         # considered to have reacted)
         reactions = np.where(maximums > thresholds, True, False)
-        file_result[agonist + "_reaction"] = reactions.flatten()
-        file_result[agonist + "_amp"] = amplitudes.flatten()
+        file_result[agonist + "_reaction"] = reactions
+        file_result[agonist + "_amp"] = amplitudes
 
-def derivate_threshold(cell_data: np.ndarray, agonist_slices: dict[str, slice[int]], file_result: pd.DataFrame, sd_mult: int):
+def derivate_threshold(stats: WindowStats, file_result: dict[str, np.ndarray], sd_mult: int):
     """Determines which agonists cells reacted to and measures the response amplitudes. Reaction state is determined by
     comparing the response amplitude with the mean of the baseline's first derivative + sd_mult * standard deviation of
     the baseline's first derivative.
 
     Args:
-        cell_data (np.ndarray): The 2d numpy array representing data from all cells in the given measurement.
-        agonist_slices (dict[str, slice[int]]): A dictionary mapping agonist names to the indices where each agonist was
-        applied.
-        file_result (pd.DataFrame): The DataFrame storing all output for this measurement file.
+        stats (WindowStats): The statistics of every cell in every treatment window of the given measurement.
+        file_result (dict[str, np.ndarray]): The columns storing all output for this measurement file.
         sd_mult (int): Determines by how many standard deviations must a cell's response exceed the mean of the
         baseline's first derivative to be considered positive for any given agonist.
     """
-    derivs = np.gradient(f=cell_data, axis=1)
-    baseline_deriv_means = derivs[:,agonist_slices["baseline"]].mean(axis=1, keepdims=True)
-    baseline_deriv_stdevs = derivs[:,agonist_slices["baseline"]].std(axis=1, mean=baseline_deriv_means, keepdims=False)
-    thresholds = baseline_deriv_means.flatten() + sd_mult*baseline_deriv_stdevs
+    baseline_deriv_means = stats.derivative_mean("baseline")
+    thresholds = baseline_deriv_means + sd_mult*stats.derivative_std("baseline")
     
-    for agonist, time_window in agonist_slices.items():
-        if agonist == "baseline":
-            continue
-        amplitudes = cell_data[:,time_window].max(axis=1, keepdims=False) - baseline_deriv_means.flatten()
-        maximum_derivs = derivs[:,time_window].max(axis=1, keepdims=False)
+    for agonist in stats.agonists:
+        amplitudes = stats.max(agonist) - baseline_deriv_means
+        maximum_derivs = stats.derivative_max(agonist)
         reactions = np.where(maximum_derivs > thresholds, True, False)
-        file_result[agonist + "_reaction"] = reactions.flatten()
-        file_result[agonist + "_amp"] = amplitudes.flatten()
+        file_result[agonist + "_reaction"] = reactions
+        file_result[agonist + "_amp"] = amplitudes
 
-def neuron_filter(cell_data: np.ndarray, agonist_slices: dict[str, slice[int]], file_result: pd.DataFrame, 
-                  amp_threshold: float, cv_threshold: float):
-    baseline, potassium = cell_data[:, agonist_slices["baseline"]], cell_data[:, agonist_slices["KCl"]]
-    baseline_means = np.mean(baseline, axis=1)
-    potassium_cv = np.std(potassium, axis=1) / np.mean(potassium, axis=1)
-    potassium_amp = np.max(potassium - baseline_means[:, np.newaxis], axis=1)
+def neuron_filter(stats: WindowStats, file_result: dict[str, np.ndarray], amp_threshold: float, cv_threshold: float):
+    baseline_means = stats.mean("baseline")
+    potassium_cv = stats.std("KCl") / stats.mean("KCl")
+    potassium_amp = stats.max("KCl") - baseline_means
 
     amp_mask = potassium_amp > amp_threshold
     cv_mask = potassium_cv > cv_threshold
 
     file_result["KCl amp filter"] = amp_mask
     file_result["KCl cv filter"] = cv_mask
+
+def sweep_reactions(stats: WindowStats, method: str, sd_mults: np.ndarray) -> dict[str, np.ndarray]:
+    """Determines which agonists cells reacted to with many SD multipliers at once, the same way the threshold function
+    of the given method does with one. Every method compares a value (the maximum or the maximum derivative in the
+    agonist's window) with a basis of comparison + sd_mult * a standard deviation, so the thresholds of every multiplier
+    are broadcast against the cached window statistics in one go.
+
+    Args:
+        stats (WindowStats): The statistics of every cell in every treatment window of the given measurement.
+        method (str): "baseline", "previous", or "derivative".
+        sd_mults (np.ndarray): The SD multipliers to try, 1d.
+
+    Returns:
+        dict[str, np.ndarray]: Agonist names mapped to boolean arrays of multipliers x cells, True where the cell
+        reacted.
+    """
+    sd_mults = np.asarray(sd_mults, dtype=np.float64)[:, np.newaxis]
+    results = {}
+    for agonist in stats.agonists:
+        match method:
+            case "baseline":
+                basis, spread, values = stats.mean("baseline"), stats.std("baseline"), stats.max(agonist)
+            case "previous":
+                basis, spread, values = stats.tail_mean(agonist), stats.std("baseline"), stats.max(agonist)
+            case "derivative":
+                basis, spread = stats.derivative_mean("baseline"), stats.derivative_std("baseline")
+                values = stats.derivative_max(agonist)
+            case _:
+                raise ValueError(f"Unknown reaction testing method: {method}")
+        results[agonist] = values > basis + sd_mults * spread
+    return results
+
+def sweep_neuron_filter(stats: WindowStats, amp_thresholds: np.ndarray, cv_thresholds: np.ndarray) -> np.ndarray:
+    """Applies the neuron filter with every combination of amplitude and CV thresholds at once.
+
+    Args:
+        stats (WindowStats): The statistics of every cell in every treatment window of the given measurement.
+        amp_thresholds (np.ndarray): The amplitude thresholds to try, 1d.
+        cv_thresholds (np.ndarray): The CV thresholds to try, 1d.
+
+    Returns:
+        np.ndarray: Boolean array of amplitude thresholds x CV thresholds x cells, True where the cell passes both
+        filters.
+    """
+    potassium_cv = stats.std("KCl") / stats.mean("KCl")
+    potassium_amp = stats.max("KCl") - stats.mean("baseline")
+    amp_mask = potassium_amp > np.asarray(amp_thresholds, dtype=np.float64)[:, np.newaxis]
+    cv_mask = potassium_cv > np.asarray(cv_thresholds, dtype=np.float64)[:, np.newaxis]
+    return amp_mask[:, np.newaxis, :] & cv_mask[np.newaxis, :, :]
@@ -1,38 +1,67 @@
+import hashlib
+import json
+import os
 from pathlib import Path
+from shutil import rmtree
+import time
 from threading import Lock
-from tkinter import IntVar
 from typing import Optional
+import zipfile
 
 import numpy as np
 from matplotlib.figure import Figure
 import pandas as pd
 import toml
 
-from analysis.compiled.cy_smooth import smooth # type: ignore it actually works
+try:
+    from analysis.compiled.cy_preprocess import preprocess_ratiometric, preprocess_single # type: ignore it actually works
+    COMPILED_KERNELS = True
+except ImportError: # not compiled, the same preprocessing is done with NumPy instead
+    COMPILED_KERNELS = False
 
-from .converter import NAME_SHEET_SEP
-from .toml_data import Metadata, Conditions, Config
+from .converter import CACHE_NAME, REACTIONS_SHEET, RESULT_SHEET, CacheManifest, TraceTable, is_report, open_store
+from .bleaching import MODELS, correct_bleaching
+from .filters import smooth_traces
+from .toml_data import Metadata, Conditions, Config, Sweep
 from .processing_functions import normalize, baseline_threshold, previous_threshold, derivate_threshold, neuron_filter
+from .processing_functions import sweep_reactions, sweep_neuron_filter
+from .reports import ExcelReport, ReportWriter, Sidecar, read_report, sidecar_path
+from .results import FileResult, ResultBuffer
+from .scheduler import in_worker
+from .telemetry import FileFinished, Progress, timed
 from .validation import validate_metadata
+from .window_stats import WindowStats
+
+# bump this whenever the preprocessing steps change, so that traces cached by older versions are not reused
+PREPROCESSING_VERSION = 1
+GRAPHS_DONE_NAME = ".graphs.json" # written into a graph folder last, with the key of the data it was drawn from
+PARTIAL_SUFFIX = ".partial" # graphs are drawn into a folder named like this, and moved into place when they're done
 
 class DataProcessor:
     _error_lock = Lock()
-    _file_count_lock = Lock()
 
     def __init__(self, path: Path, config: Config) -> None:
         self.path = path
         self.config = config
-        self.cache_path = path / ".cache"
+        self.cache_path = path / CACHE_NAME
+        self.store = open_store(self.cache_path, config.performance)
         self.report_path = path / f"{self.config.output.report_name}{path.name}.xlsx"
+        # the workbook comes first, so that the sidecar is never older than it
+        self.report_writers: list[ReportWriter] = [ExcelReport(self.report_path),
+                                                   Sidecar(sidecar_path(self.cache_path, self.report_path))]
         self.treatment_col_names: list[str] = []
         self.treatment_windows: dict[str, slice[int]] = {}
         self.report: Optional[pd.DataFrame] = None
+        self.reactions: dict[str, pd.DataFrame] = {} # measurement file names mapped to the reaction columns of their cells
         self.need_to_work: bool = True
+        self.has_metadata: bool = False # whether the metadata was read without errors
         self.conditions: Conditions
-        self.measurement_files = [f for f in self.path.glob("*.xlsx") if f != self.report_path]
+        self.measurement_files = [f for f in self.path.glob("*.xlsx") if not is_report(f, config.output.report_name)]
 
     def preprocessing(self, repeat: bool) -> str | None:
-        if self.report_path.exists() and not repeat:
+        # reports are saved under a temporary name and then renamed, but a copy or an older version of the program can
+        # still leave a cut off workbook behind, which is missing the end of its zip archive and gets made again
+        if self.report_path.exists() and not repeat and zipfile.is_zipfile(self.report_path):
             self.need_to_work = False
 
         errors = self.parse_metadata()
@@ -53,6 +82,7 @@ class DataProcessor:
             return f"Metadata file missing from {self.path}."
 
         self.conditions = metadata.conditions
+        self.has_metadata = True
 
         for agonist_name, treatment_obj in metadata.treatments.items():
             self.treatment_windows[agonist_name] = slice(int(treatment_obj.begin), int(treatment_obj.end))
@@ -61,75 +91,209 @@ class DataProcessor:
             self.treatment_col_names.append(agonist_name + "_reaction")
             self.treatment_col_names.append(agonist_name + "_amp")
     
-    def make_report(self, finished_files: IntVar, error_list: list[str]) -> None:
-        """Encapsulates all data processing work needed to produce a report.
+    def make_report(self, progress: Progress, error_list: list[str]) -> None:
+        """Encapsulates all data processing work needed to produce a report, in this process. The engine does the same
+        with every file as a separate task, see file_task.
 
         Args:
-              finished_files (tk.IntVar): used to keep track of how many files we have finished processing, for the
-            progress tracker in the GUI.
+              progress (Progress): publishes an event when a file is finished, see analysis.telemetry.
 
               error_list (list[str]): a list of error messages to display, received from the AnalysisEngine overseeing the
             processing work. If an error occurs, the corresponding message is appended to this list.
         """
         if not self.need_to_work:
             return
-        
+
+        file_results: dict[str, FileResult] = {}
+        manifest = CacheManifest(self.store)
+        for file in self.measurement_files:
+            file_results[file.name], duration = timed(self.process_file, file, manifest)
+            progress(file_results[file.name].event("process", file, duration))
+
+        self.assemble_report(file_results, error_list)
+
+    def process_file(self, file: Path, manifest: CacheManifest) -> FileResult:
+        """Classifies the cells of a measurement file, and saves which cells reacted to what in the cache. The result is
+        saved in the cache as well, as a checkpoint: if the run is interrupted before the report is written, the next
+        run takes the result of every file that was finished from there, instead of processing it again.
+
+        Args:
+            file (Path): The measurement file's path.
+            manifest (CacheManifest): The manifest of this folder's cache.
+
+        Returns:
+            FileResult: The file's cells, or the reason it couldn't be processed.
+        """
+        key = self.checkpoint_key(file, manifest)
+        checkpoint = self.load_checkpoint(file, key)
+        if checkpoint is not None:
+            return checkpoint
+        try:
+            cell_cols, data = self.load_cells(file, manifest)
+        except (SyntaxError, FileNotFoundError): # no cached sheet with the expected name
+            return FileResult(bad_sheets=True)
+
+        condition = self.file_condition(file)
+        if condition is None:
+            return FileResult(bad_groups=True)
+
+        # every statistic the methods and the filter need is computed in one pass over the data
+        try:
+            stats = WindowStats(data, self.treatment_windows)
+        except ValueError: # the measurement is too short for the treatments in the metadata
+            return FileResult(bad_windows=True)
+        file_result = self.classify_cells(stats)
+
+        # graphing needs to know which cells reacted to what, file by file, even if it runs in a later session
+        reaction_cols = [c for c in self.treatment_col_names if "_reaction" in c]
+        reactions = np.vstack([file_result[c] for c in reaction_cols]).astype(np.float64)
+        # in the Excel files, columns will be called N1, N2, N3... for neurons and DPC1, DPC2, DPC3... for DPCs
+        result = FileResult(condition, [c.strip("1234567890") for c in cell_cols], file_result, data.shape[1])
+        attrs = {"checkpoint": key} if key is not None else {}
+        tables = {REACTIONS_SHEET: TraceTable(reaction_cols, reactions, attrs)}
+        if key is not None: # the checkpoint goes last, a file is only finished once everything else is saved
+            tables[RESULT_SHEET] = result.to_table(key)
+        self.store.write(file.name, tables)
+        return result
+
+    def checkpoint_key(self, file: Path, manifest: CacheManifest) -> str | None:
+        """Builds the key that the result of a processed file is cached under. It covers everything the result depends
+        on: the processed traces (through their preprocessing key), the reaction testing settings, the treatments and
+        the group names.
+
+        Args:
+            file (Path): The measurement file's path.
+            manifest (CacheManifest): The manifest of this folder's cache.
+
+        Returns:
+            str | None: The key, or None if there is no preprocessing key, in which case no checkpoint is kept.
+        """
+        preprocessing = self.preprocessing_key(file, manifest)
+        if preprocessing is None:
+            return None
         options = self.config.input
-        output_columns = ["cell_ID", "condition", "cell_type"] + self.treatment_col_names
+        parameters = {
+            "preprocessing": preprocessing,
+            "method": options.method,
+            "SD_multiplier": options.SD_multiplier,
+            "amp_threshold": options.amp_threshold,
+            "cv_threshold": options.cv_threshold,
+            "treatments": {name: [window.start, window.stop] for name, window in self.treatment_windows.items()},
+            "groups": [self.conditions.group1, self.conditions.group2]
+        }
+        return hashlib.blake2b(json.dumps(parameters, sort_keys=True).encode(), digest_size=16).hexdigest()
+
+    def load_checkpoint(self, file: Path, key: str | None) -> FileResult | None:
+        """Returns the cached result of a file if it was made with the same key, None if it needs to be processed.
+        """
+        if key is None:
+            return None
+        try:
+            table = self.store.read(file.name, RESULT_SHEET)
+        except FileNotFoundError:
+            return None
+        if table.attrs.get("checkpoint") != key:
+            return None
+        return FileResult.from_table(table)
+
+    def file_size(self, file: Path) -> int:
+        """Estimates how much work a measurement file is, as frames x columns of its cached input sheet. Only the
+        header of the sheet is read.
+
+        Returns:
+            int: The estimate, 0 if the sheet isn't in the cache.
+        """
+        try:
+            columns, frames = self.input_shape(file)
+        except (FileNotFoundError, ValueError):
+            return 0
+        return columns * frames
+
+    def input_shape(self, file: Path) -> tuple[int, int]:
+        """Returns the number of columns and frames of a measurement file's cached input sheet, F380 for a ratiometric
+        dye. Only the header of the sheet is read.
+
+        Raises:
+            FileNotFoundError: If the sheet isn't in the cache.
+        """
+        sheet = "F380" if self.conditions.ratiometric_dye.lower() == "true" else "Raw"
+        columns, frames = self.store.header(file.name, sheet)["shape"]
+        return columns, frames
 
-        # self.report = pd.DataFrame(columns=output_columns)
-        results: list[pd.DataFrame] = []
-        cell_ID: int = 0
+    def assemble_report(self, file_results: dict[str, FileResult], error_list: list[str]) -> None:
+        """Adds the cells of every file to the report in the order of measurement_files, so cell IDs don't depend on
+        the order the files were finished in, then saves the report.
+
+        Args:
+            file_results (dict[str, FileResult]): The results of the files, by name. Files without a result (whose
+            task failed) are left out of the report, their errors are reported by whoever ran them.
+            error_list (list[str]): The error messages shared with the AnalysisEngine.
+        """
+        results = ResultBuffer()
         bad_groups_files: list[Path] = []
         bad_sheet_files: list[Path] = []
+        bad_window_files: list[Path] = []
         for file in self.measurement_files:
-            file_result = pd.DataFrame(columns=output_columns)
-            try:
-                if self.conditions.ratiometric_dye.lower() == "true":
-                    cell_cols, data = self.prepare_ratiometric_data(file, options.smoothing_range, options.correction)
-                else:
-                    cell_cols, data = self.prepare_non_ratiometric_data(file, options.smoothing_range, options.correction)
-            except SyntaxError:
-                bad_sheet_files.append(file)
+            file_result = file_results.get(file.name)
+            if file_result is None:
                 continue
-            # measurements with neurons only will be called "neuron only {number}.xlsx" whereas neuron + DPC is going to
-            # be "neuron + DPC {number}.xlsx"
-            group1: str = self.conditions.group1
-            group2: str = self.conditions.group2
-            
-            if group1 in file.name:
-                condition = group1
-            elif group2 in file.name:
-                condition = group2
-            else:
+            if file_result.bad_sheets:
+                bad_sheet_files.append(file)
+            elif file_result.bad_groups:
                 bad_groups_files.append(file)
-                continue
-            
-            # determine if cells react to each of the agonists, and how big the response amplitudes are
-            # no default case because we already have a guard clause to make sure these 3 are the only options, which we
-            # do in main before reading any measurement data from disk, so if the program's gonna crash it does so quickly
-            match options.method:
-                case "baseline":
-                    baseline_threshold(data, self.treatment_windows, file_result, options.SD_multiplier)
-                case "previous":
-                    previous_threshold(data, self.treatment_windows, file_result, options.SD_multiplier)
-                case "derivative":
-                    derivate_threshold(data, self.treatment_windows, file_result, options.SD_multiplier)
-
-            neuron_filter(data, self.treatment_windows, file_result, options.amp_threshold, options.cv_threshold)
-
-            number_of_cells = data.shape[0]
-            file_result["cell_ID"] = [x for x in range(cell_ID, cell_ID + number_of_cells)]
-            cell_ID += number_of_cells
-            file_result["condition"] = [condition for _ in range(number_of_cells)]
-            # in the Excel files, columns will be called N1, N2, N3... for neurons and DPC1, DPC2, DPC3... for DPCs
-            cell_cols = [c.strip("1234567890") for c in cell_cols]
-            file_result["cell_type"] = cell_cols
-
-            results.append(file_result)
-            self.update_file_count(finished_files)
-
-        self.report = pd.concat(results)
+            elif file_result.bad_windows:
+                bad_window_files.append(file)
+            else:
+                results.append(file.name, file_result.condition, file_result.cell_types, file_result.values)
+
+        self.finish_report(results, bad_groups_files, bad_sheet_files, bad_window_files, error_list)
+
+    def classify_cells(self, stats: WindowStats) -> dict[str, np.ndarray]:
+        """Determines which cells of a measurement file react to each of the agonists, how big the response amplitudes
+        are, and which cells are neurons, using the reaction testing settings in the config.
+
+        Args:
+            stats (WindowStats): The window statistics of the file's processed traces.
+
+        Returns:
+            dict[str, np.ndarray]: The columns of the report's Cells sheet that come from the classification, in order,
+            with one value per cell of this file.
+        """
+        options = self.config.input
+        file_result: dict[str, np.ndarray] = {}
+        # no default case because we already have a guard clause to make sure these 3 are the only options, which we
+        # do in main before reading any measurement data from disk, so if the program's gonna crash it does so quickly
+        match options.method:
+            case "baseline":
+                baseline_threshold(stats, file_result, options.SD_multiplier)
+            case "previous":
+                previous_threshold(stats, file_result, options.SD_multiplier)
+            case "derivative":
+                derivate_threshold(stats, file_result, options.SD_multiplier)
+
+        neuron_filter(stats, file_result, options.amp_threshold, options.cv_threshold)
+        return file_result
+
+    def finish_report(self, results: ResultBuffer, bad_groups_files: list[Path], bad_sheet_files: list[Path],
+                      bad_window_files: list[Path], error_list: list[str]) -> None:
+        """Turns the results of every file into the report and saves it, then reports the files that could not be
+        processed.
+
+        Args:
+            results (ResultBuffer): The cells of every file that was processed.
+            bad_groups_files (list[Path]): Files whose names match neither experimental group.
+            bad_sheet_files (list[Path]): Files that have no cached sheet with the expected name.
+            bad_window_files (list[Path]): Files that end before one of the treatment windows begins.
+            error_list (list[str]): The error messages shared with the AnalysisEngine, the message about these files is
+            appended to it.
+        """
+        self.report = results.to_frame()
+        if not len(results): # no file had any cells, the report still gets the columns the summary counts by
+            self.report = self.report.assign(**{c: pd.Series(dtype=bool if "_reaction" in c else np.float64)
+                                                for c in self.treatment_col_names})
+        reaction_cols = [c for c in self.treatment_col_names if "_reaction" in c]
+        for file_name, rows in results.files.items():
+            self.reactions[file_name] = self.report.iloc[rows][reaction_cols].reset_index(drop=True)
 
         self.save_report()
 
@@ -144,28 +308,271 @@ class DataProcessor:
             for f in bad_sheet_files:
                 message += f"\n{str(f)}"
             message += "\nPlease consult the README and rename the sheet(s) appropriately."
+        if bad_window_files:
+            message += "\n\nThe following files end before one of the treatments begins:"
+            for f in bad_window_files:
+                message += f"\n{str(f)}"
+            message += "\nPlease check the begin and end values of the treatments in the metadata file."
         if message:
             with self._error_lock:
                 error_list.append(message)
 
-    def make_graphs(self, finished_files: IntVar):
-        if self.report is None:
-            self.report = pd.read_excel(self.report_path, sheet_name="Cells")
-        
+    def sweep_thresholds(self, sweep: Sweep, progress: Progress) -> tuple[pd.DataFrame, pd.DataFrame]:
+        """Counts how many cells react to each agonist with every SD multiplier, and how many pass the neuron filter
+        with every combination of amplitude and CV thresholds. Uses the processed traces from the cache whenever it
+        can, so apart from the first run this costs about as much as reading them.
+
+        Args:
+            sweep (Sweep): The values to try, empty lists mean the value from the input section of the config.
+            progress (Progress): publishes an event when a file is finished, see analysis.telemetry.
+
+        Returns:
+            tuple[pd.DataFrame, pd.DataFrame]: Reaction counts per SD multiplier, agonist, condition and cell type, and
+            neuron filter counts per amplitude threshold, CV threshold, condition and cell type. Both have the number
+            of cells in each group as well.
+        """
+        options = self.config.input
+        sd_mults = np.array(sweep.SD_multipliers or [options.SD_multiplier], dtype=np.float64)
+        amp_thresholds = np.array(sweep.amp_thresholds or [options.amp_threshold], dtype=np.float64)
+        cv_thresholds = np.array(sweep.cv_thresholds or [options.cv_threshold], dtype=np.float64)
+
+        reaction_counts: list[pd.DataFrame] = []
+        filter_counts: list[pd.DataFrame] = []
+        manifest = CacheManifest(self.store)
+        for file in self.measurement_files:
+            start = time.perf_counter()
+            condition = self.file_condition(file)
+            try:
+                cell_cols, data = self.load_cells(file, manifest)
+            except (SyntaxError, FileNotFoundError):
+                continue
+            if condition is None:
+                continue # the same files are reported as errors by make_report
+
+            # every value is evaluated at once, then counted for each cell type
+            try:
+                stats = WindowStats(data, self.treatment_windows)
+            except ValueError:
+                continue # too short for the treatments, also reported by make_report
+            all_reactions = sweep_reactions(stats, options.method, sd_mults)
+            all_passing = sweep_neuron_filter(stats, amp_thresholds, cv_thresholds)
+            amps, cvs = np.meshgrid(amp_thresholds, cv_thresholds, indexing="ij")
+            cell_types = np.array([c.strip("1234567890") for c in cell_cols])
+            for cell_type in np.unique(cell_types):
+                cells = cell_types == cell_type
+                group = {"experiment": self.path.name, "condition": condition, "cell_type": cell_type,
+                         "cells": int(cells.sum())}
+                for agonist, reactions in all_reactions.items():
+                    reaction_counts.append(pd.DataFrame({**group, "agonist": agonist, "SD_multiplier": sd_mults,
+                                                         "reacting": reactions[:, cells].sum(axis=1)}))
+                filter_counts.append(pd.DataFrame({**group, "amp_threshold": amps.ravel(), "cv_threshold": cvs.ravel(),
+                                                   "passing": all_passing[:, :, cells].sum(axis=2).ravel()}))
+            progress(FileFinished("sweep", self.path.name, file.name, len(cell_cols), data.shape[1],
+                                  duration=time.perf_counter() - start))
+
+        keys = ["experiment", "condition", "cell_type"]
+        reactions = pd.concat(reaction_counts) if reaction_counts else pd.DataFrame()
+        filters = pd.concat(filter_counts) if filter_counts else pd.DataFrame()
+        if not reactions.empty: # add up the files of each group
+            reactions = reactions.groupby(keys + ["agonist", "SD_multiplier"], sort=False, as_index=False).sum()
+            filters = filters.groupby(keys + ["amp_threshold", "cv_threshold"], sort=False, as_index=False).sum()
+        return reactions, filters
+
+    def load_cells(self, file: Path, manifest: CacheManifest) -> tuple[list[str], np.ndarray]:
+        """Returns the processed traces of a measurement file. Preprocessing doesn't depend on the reaction testing
+        settings, so if only those changed since the last run, the processed traces are taken from the cache and we go
+        straight to classifying the cells.
+
+        Args:
+            file (Path): The measurement file's path.
+            manifest (CacheManifest): The manifest of this folder's cache.
+
+        Raises:
+            FileNotFoundError: If the cache has no sheet with the expected name.
+
+        Returns:
+            tuple[list[str], np.ndarray]: The cell column names and the processed traces (cells x frames).
+        """
+        options = self.config.input
+        key = self.preprocessing_key(file, manifest)
+        preprocessed = self.load_preprocessed(file, key)
+        if preprocessed is not None:
+            return preprocessed
+        if self.conditions.ratiometric_dye.lower() == "true":
+            return self.prepare_ratiometric_data(file, options.smoothing_range, options.correction, key)
+        return self.prepare_non_ratiometric_data(file, options.smoothing_range, options.correction, key)
+
+    def file_condition(self, file: Path) -> str | None:
+        """Measurements with neurons only will be called "neuron only {number}.xlsx" whereas neuron + DPC is going to be
+        "neuron + DPC {number}.xlsx", the group names come from the metadata.
+
+        Returns:
+            str | None: The experimental condition (group) of the measurement file, or None if it's named incorrectly.
+        """
+        if self.conditions.group1 in file.name:
+            return self.conditions.group1
+        if self.conditions.group2 in file.name:
+            return self.conditions.group2
+        return None
+
+    def preprocessing_key(self, file: Path, manifest: CacheManifest) -> str | None:
+        """Builds the key that processed traces are cached under. It covers everything the preprocessing steps depend
+        on: the source data (through the hash recorded when it was converted), the dye type, the smoothing range and
+        filter, the photobleaching correction settings, and the baseline length used for normalization.
+
+        Args:
+            file (Path): The measurement file's path.
+            manifest (CacheManifest): The manifest of this folder's cache.
+
+        Returns:
+            str | None: The key, or None if the cache doesn't know the source file's hash, in which case processed
+            traces are never reused.
+        """
+        entry = manifest.entries.get(file.name)
+        if entry is None:
+            return None
+        options = self.config.input
+        parameters = {
+            "version": PREPROCESSING_VERSION,
+            "source": entry["hash"],
+            "ratiometric": self.conditions.ratiometric_dye.lower() == "true",
+            "smoothing_range": options.smoothing_range,
+            "smoothing_filter": options.smoothing_filter,
+            "correction": options.correction.lower() == "true",
+            "correction_model": options.correction_model,
+            "baseline": self.treatment_windows["baseline"].stop
+        }
+        return hashlib.blake2b(json.dumps(parameters, sort_keys=True).encode(), digest_size=16).hexdigest()
+
+    def load_preprocessed(self, file: Path, key: str | None) -> tuple[list[str], np.ndarray] | None:
+        """Looks for processed traces in the cache that were made from the same data with the same settings.
+
+        Args:
+            file (Path): The measurement file's path.
+            key (str | None): The key returned by preprocessing_key.
+
+        Returns:
+            tuple[list[str], np.ndarray] | None: The cell column names and the processed traces (cells x frames), the
+            same as the data preparation methods return, or None if they need to be computed.
+        """
+        if key is None:
+            return None
+        sheet_name = "Py_ratios" if self.conditions.ratiometric_dye.lower() == "true" else "Processed"
+        try:
+            if self.store.header(file.name, sheet_name)["attrs"].get("preprocessing_key") != key:
+                return None
+        except FileNotFoundError:
+            return None
+        traces = self.store.read(file.name, sheet_name)
+        cell_cols = traces.cell_columns
+        return cell_cols, traces.select(cell_cols)
+
+    def make_graphs(self, progress: Progress):
+        """Draws graphs of every cell in every measurement file of this folder.
+
+        Args:
+            progress (Progress): publishes an event when a file's graphs are finished, see analysis.telemetry.
+        """
         for file in self.measurement_files:
-            graphing_path: Path = self.path / Path(file.stem)
-            if not graphing_path.exists():
-                Path.mkdir(graphing_path)
-            sheet_name = "Py_ratios" if self.conditions.ratiometric_dye.lower() == "true" else "Processed"
-            ratios = pd.read_excel(file, sheet_name=sheet_name)
-            cell_cols = [c for c in ratios.columns if c != "Time"]
-            ratios = np.transpose(ratios.to_numpy())
+            self.graph_file(file, progress)
+
+    def graph_file(self, file: Path, progress: Progress) -> None:
+        """Draws graphs of every cell in a measurement file, into a folder named after the file. The processed traces
+        are read from the cache, where make_report saved them, only files without cached traces are read from Excel.
+
+        The graphs are drawn into a temporary folder, which is only moved into place once every graph is done, along
+        with the key of the data they were drawn from. Graphs that are already there and were drawn from the same
+        traces and reactions are kept, so an interrupted graphing run picks up with the first file it didn't finish.
+        Temporary folders left behind by an interrupted run are deleted and drawn again.
+
+        Args:
+            file (Path): The measurement file's path.
+            progress (Progress): publishes an event when a file's graphs are finished, see analysis.telemetry.
+        """
+        start = time.perf_counter()
+        sheet_name = "Py_ratios" if self.conditions.ratiometric_dye.lower() == "true" else "Processed"
+        graphing_path: Path = self.path / Path(file.stem)
+        partial_path = graphing_path.with_name(graphing_path.name + PARTIAL_SUFFIX)
+        try:
+            traces = self.store.read(file.name, sheet_name)
+            cell_cols = traces.cell_columns
+            x_data, ratios = traces["Time"], traces.select(cell_cols)
+            key = self.graph_key(file, traces)
+        except FileNotFoundError:
+            df = pd.read_excel(file, sheet_name=sheet_name, engine="calamine")
+            cell_cols = [c for c in df.columns if c != "Time"]
+            ratios = np.transpose(df.to_numpy())
             x_data, ratios = ratios[0], ratios[1:]
-            reaction_cols = [col for col in self.report.columns if "_reaction" in col]
+            key = None
+
+        if key is None or self.graphed_key(graphing_path) != key:
+            if partial_path.exists():
+                rmtree(partial_path)
+            Path.mkdir(partial_path)
+            self.graph_data(x_data.flatten(), ratios, cell_cols, self.load_reactions(file), partial_path)
+            with open(partial_path / GRAPHS_DONE_NAME, "w") as f:
+                json.dump({"key": key}, f)
+            if graphing_path.exists():
+                rmtree(graphing_path)
+            os.replace(partial_path, graphing_path)
+        progress(FileFinished("graph", self.path.name, file.name, len(cell_cols), len(x_data.flatten()),
+                              duration=time.perf_counter() - start))
+
+    def graph_key(self, file: Path, traces: TraceTable) -> str | None:
+        """Builds the key of the data a file's graphs are drawn from: the preprocessing key of its traces, the key of
+        the result its reactions come from, and the timing of the treatments and frames.
 
-            self.graph_data(x_data.flatten(), ratios, cell_cols, self.report[reaction_cols], graphing_path, finished_files)
+        Returns:
+            str | None: The key, or None if the traces or the reactions weren't cached with a key, in which case the
+            graphs are always drawn again.
+        """
+        try:
+            reactions = self.store.header(file.name, REACTIONS_SHEET)["attrs"].get("checkpoint")
+        except FileNotFoundError:
+            return None
+        preprocessing = traces.attrs.get("preprocessing_key")
+        if reactions is None or preprocessing is None:
+            return None
+        parameters = {
+            "preprocessing": preprocessing,
+            "reactions": reactions,
+            "framerate": self.conditions.framerate,
+            "treatments": {name: [window.start, window.stop] for name, window in self.treatment_windows.items()}
+        }
+        return hashlib.blake2b(json.dumps(parameters, sort_keys=True).encode(), digest_size=16).hexdigest()
+
+    @staticmethod
+    def graphed_key(graphing_path: Path) -> str | None:
+        """Returns the key that a graph folder was finished with, None if it isn't finished.
+        """
+        try:
+            with open(graphing_path / GRAPHS_DONE_NAME, "r") as f:
+                return json.load(f)["key"]
+        except (FileNotFoundError, json.JSONDecodeError, KeyError):
+            return None
+
+    def load_reactions(self, file: Path) -> pd.DataFrame:
+        """Finds which cells of a measurement file reacted to which agonists. Uses the results of make_report if it ran
+        in this session, then the cache, and only reads the report if neither has them.
+
+        Args:
+            file (Path): The measurement file's path.
+
+        Returns:
+            pd.DataFrame: The reaction columns, one row per cell of this file.
+        """
+        if file.name in self.reactions:
+            return self.reactions[file.name]
+        try:
+            table = self.store.read(file.name, REACTIONS_SHEET)
+            return pd.DataFrame(np.transpose(table.data).astype(bool), columns=table.columns)
+        except FileNotFoundError:
+            if self.report is None:
+                self.report = read_report(self.cache_path, self.report_path)
+            reaction_cols = [col for col in self.report.columns if "_reaction" in col]
+            return self.report[reaction_cols]
     
-    def graph_data(self, x_data: np.ndarray, traces: np.ndarray, col_names: list[str], reactions: pd.DataFrame, save_dir: Path, finished_files: IntVar) -> None:
+    def graph_data(self, x_data: np.ndarray, traces: np.ndarray, col_names: list[str], reactions: pd.DataFrame, save_dir: Path) -> None:
         """Creates line graphs for each cell in this particular measurement file. Is called from within make_report()
         because it needs the cell trace data and that funtion only returns the report DataFrame.
 
@@ -213,109 +620,149 @@ class DataProcessor:
             fig.tight_layout()
             fig.savefig(save_dir / f"Cell no. {i}.png", dpi=300)
             fig.clf()
-            self.update_file_count(finished_files)
 
-    def load_summary_from_report(self, finished_files: IntVar) -> None:
-            self.report = pd.read_excel(self.report_path, sheet_name="Summary", engine="calamine")
-            self.update_file_count(finished_files)
+    @property
+    def agonists(self) -> list[str]:
+        return [name for name in self.treatment_windows if name != "baseline"]
+
+    def reaction_counts(self) -> pd.Series:
+        """Counts the cells of the report with each combination of cell type and reactions, for the summary.
+        """
+        assert self.report is not None # the report is loaded before this is called
+        reaction_cols = [c for c in self.treatment_col_names if "_reaction" in c]
+        return self.report[["cell_type"] + reaction_cols].value_counts()
+
+    def load_summary_from_report(self, progress: Progress) -> None:
+        """Loads the Cells table of the report, from its sidecar if it has one, for the summary.
+        """
+        self.report, duration = timed(read_report, self.cache_path, self.report_path)
+        progress(FileFinished("summary", self.path.name, self.report_path.name, len(self.report),
+                              bytes=self.report_path.stat().st_size, duration=duration))
 
-    def prepare_ratiometric_data(self, file: Path, smoothing_window: int, corr: str) -> tuple[list[str], np.ndarray]:
+    def prepare_ratiometric_data(self, file: Path, smoothing_window: int, corr: str, key: str | None = None
+                                 ) -> tuple[list[str], np.ndarray]:
         """Reads data from Fura2 measurements, then performs background substraction, smoothing, and photobleaching
-        correction. Saves processed data to a pickle file as well as returning it.
+        correction. Saves processed data to the cache as well as returning it.
 
         Args:
             file (Path): The measurement file's path.
             smoothing_window (int): The average of this many elements will be taken for the smoothing. Defaults to 5,
             and it should be an odd number.
+            corr (str): Whether to do photobleaching correction, "True" or "False".
+            key (str | None, optional): The preprocessing key to save the processed data under. Defaults to None.
 
         Returns:
             tuple[list[str], np.ndarray]: The list contains the cell column names, while the numpy array contains the
             transformed data, transposed (compared to how it was in the input file).
         """
-        # read in 340 and 380 data separately
-        F340_data = pd.read_pickle(self.cache_path / f"{file.name}{NAME_SHEET_SEP}F340.pkl")
-        F380_data = pd.read_pickle(self.cache_path / f"{file.name}{NAME_SHEET_SEP}F380.pkl")
-        cell_cols = [c for c in F380_data.columns if c not in {"Time", "Background"}]
+        # read in 340 and 380 data separately, these are memory mapped so nothing is copied until we compute something
+        F340_data = self.store.read(file.name, "F340")
+        F380_data = self.store.read(file.name, "F380")
+        cell_cols = F380_data.cell_columns
+
+        if self.use_compiled_kernels():
+            # the compiled kernel does everything in one pass per cell, on all cores, without holding the GIL
+            x_data = np.ascontiguousarray(F380_data["Time"], dtype=np.float64)
+            ratios, coeffs = preprocess_ratiometric(x_data, F340_data["Background"], F340_data.select(cell_cols),
+                                                    F380_data["Background"], F380_data.select(cell_cols),
+                                                    smoothing_window, corr.lower() == "true", self.kernel_threads())
+            corr_arg = coeffs if corr.lower() == "true" else None
+            self.save_processed_data(file, x_data, ratios, cell_cols, corr_arg, key)
+            return cell_cols, ratios
         
-        # split the data
-        x_data, bgr_380, cells_380 = F380_data["Time"].to_numpy(), F380_data["Background"].to_numpy(), F380_data[cell_cols].to_numpy()
-        bgr_340, cells_340 = F340_data["Background"].to_numpy(), F340_data[cell_cols].to_numpy()
+        # split the data, the cached arrays are (columns x frames) so the cell data needs to be transposed
+        x_data, bgr_380, cells_380 = F380_data["Time"], F380_data["Background"], F380_data.select(cell_cols).T
+        bgr_340, cells_340 = F340_data["Background"], F340_data.select(cell_cols).T
+        x_data = np.asarray(x_data, dtype=np.float64) # the cache may be float32, but all processing is done in float64
         
-        # turn time and background into 2d arrays with one column each because this shape is needed for linalg.lstsq
+        # turn time and background into 2d arrays with one column each so they broadcast against the cells
         x_data, bgr_340, bgr_380 = x_data[:, np.newaxis], bgr_340[:, np.newaxis], bgr_380[:, np.newaxis]
         
         # substract backgrounds
-        cells_340 = cells_340 - bgr_340
-        cells_380 = cells_380 - bgr_380
+        cells_340 = np.subtract(cells_340, bgr_340, dtype=np.float64)
+        cells_380 = np.subtract(cells_380, bgr_380, dtype=np.float64)
         
-        # smoothing should probably go here
-        cells_340 = np.apply_along_axis(smooth, 0, cells_340, window_size = smoothing_window)
-        cells_380 = np.apply_along_axis(smooth, 0, cells_380, window_size = smoothing_window)
+        # smoothing, every cell at once
+        cells_340 = smooth_traces(cells_340, smoothing_window, self.config.input.smoothing_filter)
+        cells_380 = smooth_traces(cells_380, smoothing_window, self.config.input.smoothing_filter)
 
-        # photobleaching correction
+        # photobleaching correction, both channels in one call
         if corr.lower() == "true": # I know this looks stupid, see the docstring of the make_report method
-            matrix = np.hstack((np.ones_like(x_data), x_data))
-            coeffs_340, _, _, _ = np.linalg.lstsq(matrix, cells_340, rcond=None)
-            coeffs_380, _, _, _ = np.linalg.lstsq(matrix, cells_380, rcond=None)
-            coeffs_340, coeffs_380 = coeffs_340[1], coeffs_380[1] # we don't care about the y intercept
-            cells_340 = cells_340 - (x_data * coeffs_340)
-            cells_380 = cells_380 - (x_data * coeffs_380)
-            corr_arg = np.vstack((coeffs_340, coeffs_380))
+            corrected, corr_arg = correct_bleaching(x_data, np.hstack((cells_340, cells_380)), self.config.input.correction_model)
+            cells_340, cells_380 = np.hsplit(corrected, 2)
+            # one row per parameter for 340 nm first, then the same for 380 nm
+            corr_arg = np.vstack(np.hsplit(corr_arg, 2))
         else:
             corr_arg = None
         
         # I'm working with Fura2 so the actual data of interest is the ratios between emissions at 340 and 380 nm.
         ratios = np.transpose(cells_340 / cells_380)
-        self.save_processed_data(file, x_data, ratios, cell_cols, corr_arg)
+        self.save_processed_data(file, x_data, ratios, cell_cols, corr_arg, key)
 
         return cell_cols, ratios
     
-    def prepare_non_ratiometric_data(self, file:Path, smoothing_window: int, corr: str) -> tuple[list[str], np.ndarray]:
+    def prepare_non_ratiometric_data(self, file:Path, smoothing_window: int, corr: str, key: str | None = None
+                                     ) -> tuple[list[str], np.ndarray]:
         """Reads data from measurements non-ratiometric dyes such as Fluo4, then performs background substraction,
-        smoothing, and photobleaching correction. Saves processed data to a pickle file as well as returning it.
+        smoothing, and photobleaching correction. Saves processed data to the cache as well as returning it.
 
         Args:
             file (Path): The measurement file's path.
             smoothing_window (int): The average of this many elements will be taken for the smoothing. Defaults to 5,
             and it should be an odd number.
+            corr (str): Whether to do photobleaching correction, "True" or "False".
+            key (str | None, optional): The preprocessing key to save the processed data under. Defaults to None.
 
         Returns:
             tuple[list[str], np.ndarray]: The list contains the cell column names, while the numpy array contains the
             transformed data, transposed (compared to how it was in the input file).
         """
-        data = pd.read_pickle(self.cache_path / f"{file.name}{NAME_SHEET_SEP}Raw.pkl")
-        cell_cols = [c for c in data.columns if c not in {"Time", "Background"}]
-        x_data, bgr, cells = data["Time"].to_numpy(), data["Background"].to_numpy(), data[cell_cols].to_numpy()
+        data = self.store.read(file.name, "Raw")
+        cell_cols = data.cell_columns
+
+        if self.use_compiled_kernels():
+            x_data = np.ascontiguousarray(data["Time"], dtype=np.float64)
+            cells, coeffs = preprocess_single(x_data, data.select(cell_cols), self.treatment_windows["baseline"].stop,
+                                              smoothing_window, corr.lower() == "true", self.kernel_threads())
+            corr_arg = coeffs[np.newaxis, :] if corr.lower() == "true" else None
+            self.save_processed_data(file, x_data, cells, cell_cols, corr_arg, key)
+            return cell_cols, cells
+
+        x_data, bgr, cells = data["Time"], data["Background"], data.select(cell_cols).T
+        # the cache may be float32, but all processing is done in float64 (this doesn't copy float64 data)
+        x_data, cells = np.asarray(x_data, dtype=np.float64), np.asarray(cells, dtype=np.float64)
         x_data, bgr = x_data[:, np.newaxis], bgr[:, np.newaxis]
         
         # normalization and smoothing
         cells = np.apply_along_axis(normalize, 0, cells, baseline=self.treatment_windows["baseline"].stop)
-        cells = np.apply_along_axis(smooth, 0, cells, window_size = smoothing_window)
+        cells = smooth_traces(cells, smoothing_window, self.config.input.smoothing_filter)
         
         # photobleaching correction
         if corr.lower() == "true": # I know this looks stupid, see the docstring of the make_report method
-            matrix = np.hstack((np.ones_like(x_data), x_data))
-            coeffs, _, _, _ = np.linalg.lstsq(matrix, cells, rcond=None)
-            coeffs = coeffs[1] # we don't care about the y intercept
-            cells = cells - (x_data * coeffs)
-            corr_arg = coeffs
+            cells, corr_arg = correct_bleaching(x_data, cells, self.config.input.correction_model)
         else:
             corr_arg = None
 
-        self.save_processed_data(file, x_data, cells, cell_cols, corr_arg)
-        return cell_cols, cells.transpose()
+        cells = cells.transpose()
+        self.save_processed_data(file, x_data, cells, cell_cols, corr_arg, key)
+        return cell_cols, cells
 
-    def update_file_count(self, count: IntVar):
-        """Provides feedback to the user when a file is finished processing.
+    def use_compiled_kernels(self) -> bool:
+        """The compiled preprocessing kernels only implement the moving average and linear photobleaching correction,
+        other smoothing filters and correction models are done with NumPy.
+        """
+        options = self.config.input
+        return COMPILED_KERNELS and options.smoothing_filter == "mean" and options.correction_model == "linear"
 
-        Args:
-            count (tk.IntVar): The progress tracker shared between all processor instances.
+    def kernel_threads(self) -> int:
+        """The number of threads the compiled kernels may use: one in a worker process of the scheduler, as there is a
+        worker on every core already, and the workers setting (0 for every core) when processing in this process.
         """
-        with self._file_count_lock:
-            count.set(count.get() + 1)
+        return 1 if in_worker() else self.config.performance.workers
 
-    def save_processed_data(self, file: Path, x_data: np.ndarray, cell_data: np.ndarray, col_names: list[str], coeffs: np.ndarray | None) -> None:
-        """Saves processed Ca traces and photobleaching correction coefficients to pickle files in the cache.
+    def save_processed_data(self, file: Path, x_data: np.ndarray, cell_data: np.ndarray, col_names: list[str],
+                            coeffs: np.ndarray | None, key: str | None = None) -> None:
+        """Saves processed Ca traces and photobleaching correction coefficients to trace files in the cache.
 
         Args:
             file (Path): The measurement file's path.
@@ -323,39 +770,87 @@ class DataProcessor:
             cell_data (np.ndarray): The measurement data after it has been transformed by the relevant data preparation
             method.
             col_names (list[str]): The names of columns in the Excel file where cell data is found.
-            coeffs (np.ndarray | None): The coefficients used for photobleaching correction. None if we are not doing
-            correction.
+            coeffs (np.ndarray | None): The coefficients used for photobleaching correction, one row per parameter of
+            the correction model (for both wavelengths with a ratiometric dye), one column per cell. None if we are not
+            doing correction.
+            key (str | None, optional): The preprocessing key, stored with the traces so that later runs with the same
+            preprocessing settings can reuse them. Defaults to None.
         """
-        col_names = ["Time"] + col_names
-        data = np.vstack((x_data.flatten(), cell_data))
-        data = np.transpose(data)
+        data = np.vstack((x_data.flatten(), cell_data)) # already (columns x frames), the layout of the cache
         ratio: bool = self.conditions.ratiometric_dye.lower() == "true"
         if ratio:
             sheet_name: str = "Py_ratios"
         else:
             sheet_name: str = "Processed"
         
-        df = pd.DataFrame(data, columns=col_names)
-        df.to_pickle(self.cache_path / f"{file.name}{NAME_SHEET_SEP}{sheet_name}.pkl")
+        attrs = {"preprocessing_key": key} if key is not None else {}
+        tables = {sheet_name: TraceTable(["Time"] + col_names, data, attrs)}
         
         if coeffs is not None:
+            # the model's parameter names are stored with the coefficients, the linear model only has the slope
+            model = self.config.input.correction_model
+            attrs = {"model": model, "parameters": MODELS[model]}
             if ratio:
-                col_names[0] = "Wavelength"
-                first_col = np.array([340, 380])
+                first_col = np.repeat([340, 380], len(MODELS[model]))
                 first_col = first_col[:, np.newaxis]
                 coeffs = np.hstack((first_col, coeffs))
-                df = pd.DataFrame(coeffs, columns=col_names)
-                df.to_pickle(self.cache_path / f"{file.name}{NAME_SHEET_SEP}Coeffs.pkl")
+                tables["Coeffs"] = TraceTable(["Wavelength"] + col_names, coeffs.T, attrs)
             else:
-                df = pd.DataFrame(coeffs, columns=col_names)
-                df.to_pickle(self.cache_path / f"{file.name}{NAME_SHEET_SEP}Coeffs.pkl")
+                tables["Coeffs"] = TraceTable(col_names, coeffs.T, attrs)
             # If we're not using a ratiometric dye, we only have one set of coefficients, but if we are using Fura, then we
             # have two, and we should save which is which.
 
+        self.store.write(file.name, tables) # one write, so an archive only has to be appended to once
+
     def save_report(self) -> None:
         assert self.report is not None # report is guaranteed not to be None by the time this method is called
-        with pd.ExcelWriter(self.report_path) as writer:
-            self.report.to_excel(writer, sheet_name="Cells", index=False)
-            cols = [c for c in self.treatment_col_names if "_reaction" in c]
-            stats = self.report[["cell_type", "condition"] + cols].value_counts()
-            stats.to_excel(writer, sheet_name="Summary")
\ No newline at end of file
+        cols = [c for c in self.treatment_col_names if "_reaction" in c]
+        stats = self.report[["cell_type", "condition"] + cols].value_counts()
+        for writer in self.report_writers:
+            writer.write(self.report, stats)
+
+
+# The stages of the analysis run in worker processes (see analysis.scheduler), which get the folder's path and the
+# config, and set up a processor of their own. Everything they make is saved to disk, only the results needed by the
+# main process are returned.
+
+def file_task(file: Path, config: Config, progress: Progress) -> FileResult:
+    """Classifies the cells of a single measurement file, the report of its folder is put together afterwards.
+    """
+    processor = DataProcessor(file.parent, config)
+    processor.parse_metadata()
+    result, duration = timed(processor.process_file, file, CacheManifest(processor.store))
+    progress(result.event("process", file, duration))
+    return result
+
+def report_task(path: Path, config: Config, file_results: dict[str, FileResult], progress: Progress) -> list[str]:
+    """Numbers the cells of a folder's files and saves its report. Returns error messages about files that could not
+    be processed.
+    """
+    processor = DataProcessor(path, config)
+    errors: list[str] = []
+    processor.parse_metadata()
+    processor.assemble_report(file_results, errors)
+    return errors
+
+def counts_task(path: Path, config: Config, progress: Progress) -> pd.Series:
+    """Loads the report of a folder and returns its reaction counts, for the summary.
+    """
+    processor = DataProcessor(path, config)
+    processor.parse_metadata()
+    processor.load_summary_from_report(progress)
+    return processor.reaction_counts()
+
+def graph_task(file: Path, config: Config, progress: Progress) -> None:
+    """Draws the graphs of a measurement file.
+    """
+    processor = DataProcessor(file.parent, config)
+    processor.parse_metadata()
+    processor.graph_file(file, progress)
+
+def sweep_task(path: Path, config: Config, progress: Progress) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """Counts the reacting and passing cells of a folder with every value of the sweep, see sweep_thresholds.
+    """
+    processor = DataProcessor(path, config)
+    processor.parse_metadata()
+    return processor.sweep_thresholds(config.sweep, progress)
@@ -0,0 +1,156 @@
+"""Writing and reading the reports of the subdirectories.
+
+A report is written by every writer in a processor's list: the Excel workbook that people open, and a binary sidecar
+in the cache holding the same Cells table, which is what the program itself reads back (for the summary, the graphs and
+later runs), since parsing the workbook again is slow. The sidecar is a Feather file if pyarrow is installed, and an
+uncompressed .npz file otherwise. A sidecar older than its workbook is ignored, in case someone edited the workbook.
+"""
+from __future__ import annotations
+
+import os
+from pathlib import Path
+from typing import Iterator
+
+import numpy as np
+import pandas as pd
+from openpyxl import Workbook
+
+try:
+    import pyarrow # type: ignore # noqa: F401 pandas needs it for Feather files
+    SIDECAR_EXT = ".feather"
+except ImportError: # the .npz format only needs NumPy
+    SIDECAR_EXT = ".npz"
+
+try:
+    import xlsxwriter # type: ignore about twice as fast as openpyxl, which is used if it's not installed
+    XLSXWRITER = True
+except ImportError:
+    XLSXWRITER = False
+
+REPORT_CHUNK_ROWS = 1024 # this many rows are converted to Python objects at a time when writing the workbook
+COLUMNS_KEY = "columns" # the key of the column names in .npz sidecars, the columns themselves are stored by position
+
+
+def sidecar_path(cache_path: Path, report_path: Path, extension: str = SIDECAR_EXT) -> Path:
+    return cache_path / f"{report_path.stem}{extension}"
+
+
+def sheet_rows(frame: pd.DataFrame) -> Iterator[tuple]:
+    """Yields the header and then every row of a table as Python objects, only converting a block of rows at a time.
+    Missing values become None, which is written as an empty cell, the same as pandas does.
+    """
+    yield tuple(str(column) for column in frame.columns)
+    for start in range(0, len(frame), REPORT_CHUNK_ROWS):
+        block = frame.iloc[start:start + REPORT_CHUNK_ROWS].astype(object)
+        yield from block.where(block.notna(), None).itertuples(index=False, name=None)
+
+
+class ExcelReport:
+    """Writes the report workbook, with the Cells and Summary sheets. Rows are streamed to disk as they are written
+    (xlsxwriter's constant memory mode, or openpyxl's write-only mode), so memory use doesn't grow with the number of
+    cells. The workbook is saved under a temporary name first so that a failed write can't leave a broken report
+    behind.
+
+    Args:
+        path (Path): The report's path.
+    """
+    def __init__(self, path: Path) -> None:
+        self.path = path
+
+    def write(self, cells: pd.DataFrame, summary: pd.Series) -> None:
+        sheets = {"Cells": cells, "Summary": summary.reset_index()}
+        temp_path = self.path.with_suffix(".tmp")
+        if XLSXWRITER:
+            wb = xlsxwriter.Workbook(temp_path, {"constant_memory": True})
+            for name, frame in sheets.items():
+                ws = wb.add_worksheet(name)
+                for i, row in enumerate(sheet_rows(frame)):
+                    ws.write_row(i, 0, row)
+            wb.close()
+        else:
+            wb = Workbook(write_only=True)
+            for name, frame in sheets.items():
+                ws = wb.create_sheet(title=name)
+                for row in sheet_rows(frame):
+                    ws.append(row)
+            wb.save(temp_path)
+        os.replace(temp_path, self.path)
+
+
+class Sidecar:
+    """Writes the Cells table of a report to a binary file, which is much faster to read than the workbook.
+
+    Args:
+        path (Path): The sidecar's path, see sidecar_path.
+    """
+    def __init__(self, path: Path) -> None:
+        self.path = path
+
+    def write(self, cells: pd.DataFrame, summary: pd.Series) -> None:
+        self.path.parent.mkdir(exist_ok=True)
+        temp_path = self.path.with_suffix(".tmp")
+        if self.path.suffix == ".feather":
+            cells.reset_index(drop=True).to_feather(temp_path)
+        else:
+            with open(temp_path, "wb") as f: # np.savez would add .npz to the temporary name
+                np.savez(f, **encode_columns(cells))
+        os.replace(temp_path, self.path)
+
+type ReportWriter = ExcelReport | Sidecar
+
+
+def encode_columns(cells: pd.DataFrame) -> dict[str, np.ndarray]:
+    """Turns a table into arrays that .npz files can store without pickling. Text columns (the conditions and cell
+    types) are stored as codes into their distinct values, the same way the results are collected.
+    """
+    arrays = {COLUMNS_KEY: np.array([str(column) for column in cells.columns], dtype=str)}
+    for i, column in enumerate(cells.columns):
+        values = cells[column].to_numpy()
+        if values.dtype.kind in "biuf":
+            arrays[str(i)] = values
+        else:
+            categories, codes = np.unique(values.astype(str), return_inverse=True)
+            arrays[f"{i}_codes"], arrays[f"{i}_categories"] = codes, categories
+    return arrays
+
+def decode_columns(arrays: dict[str, np.ndarray]) -> pd.DataFrame:
+    columns = {}
+    for i, column in enumerate(arrays[COLUMNS_KEY].tolist()):
+        if str(i) in arrays:
+            columns[column] = arrays[str(i)]
+        else:
+            columns[column] = arrays[f"{i}_categories"].astype(object)[arrays[f"{i}_codes"]]
+    return pd.DataFrame(columns)
+
+def read_sidecar(cache_path: Path, report_path: Path) -> pd.DataFrame | None:
+    """Reads the Cells table of a report from its sidecar.
+
+    Args:
+        cache_path (Path): The cache folder of the report's subdirectory.
+        report_path (Path): The report workbook's path.
+
+    Returns:
+        pd.DataFrame | None: The Cells table, or None if there is no usable sidecar: it doesn't exist, it is older than
+        the workbook, or it was written as Feather and pyarrow isn't installed.
+    """
+    if not report_path.exists():
+        return None
+    report_time = report_path.stat().st_mtime
+    for extension in [SIDECAR_EXT] + [ext for ext in [".feather", ".npz"] if ext != SIDECAR_EXT]:
+        path = sidecar_path(cache_path, report_path, extension)
+        if not path.exists() or path.stat().st_mtime < report_time:
+            continue
+        if extension == ".npz":
+            with np.load(path, allow_pickle=False) as arrays:
+                return decode_columns(dict(arrays))
+        if SIDECAR_EXT == ".feather":
+            return pd.read_feather(path)
+    return None
+
+def read_report(cache_path: Path, report_path: Path) -> pd.DataFrame:
+    """Reads the Cells table of a report, from the sidecar if there is a usable one and from the workbook otherwise.
+    """
+    cells = read_sidecar(cache_path, report_path)
+    if cells is None:
+        cells = pd.read_excel(report_path, sheet_name="Cells", engine="calamine")
+    return cells
@@ -0,0 +1,131 @@
+"""Collects the cells of a report file by file, without making a DataFrame for every file.
+
+Each column of the report's Cells sheet is kept in a NumPy array that is preallocated and grows geometrically, so adding
+a file only copies its values into place. Conditions and cell types repeat a lot, so they are stored as integer codes
+into lists of the distinct values. The DataFrame is only built once, when the report is written.
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from .converter import TraceTable
+from .telemetry import FileFinished
+
+INITIAL_CAPACITY = 1024 # rows, about a few files' worth of cells
+
+
+@dataclass
+class FileResult:
+    """The cells of one measurement file, as classified by a worker, before they are numbered and added to the report.
+    A file that couldn't be processed has no cells, only the reason why.
+    """
+    condition: str = ""
+    cell_types: list[str] = field(default_factory=list)
+    values: dict[str, np.ndarray] = field(default_factory=dict)
+    frames: int = 0
+    bad_sheets: bool = False # no cached sheet with the expected name
+    bad_groups: bool = False # named after neither experimental group
+    bad_windows: bool = False # ends before one of the treatment windows begins
+
+    def event(self, stage: str, file: Path, duration: float) -> FileFinished:
+        return FileFinished(stage, file.parent.name, file.name, len(self.cell_types), self.frames, duration=duration)
+
+    def to_table(self, checkpoint: str) -> TraceTable:
+        """Turns the result into a table for the cache, one row per column of values. The rest of the result, and the
+        key it is only valid for, go into the attributes.
+        """
+        attrs = {"checkpoint": checkpoint, "condition": self.condition, "cell_types": self.cell_types,
+                 "frames": self.frames, "dtypes": {column: values.dtype.str for column, values in self.values.items()}}
+        data = np.empty((0, len(self.cell_types)))
+        if self.values:
+            data = np.vstack([values.astype(np.float64) for values in self.values.values()])
+        return TraceTable(list(self.values), data, attrs)
+
+    @classmethod
+    def from_table(cls, table: TraceTable) -> FileResult:
+        dtypes = table.attrs["dtypes"]
+        values = {column: np.array(table[column], dtype=dtypes[column]) for column in table.columns}
+        return cls(table.attrs["condition"], table.attrs["cell_types"], values, table.attrs["frames"])
+
+
+class ResultBuffer:
+    """The rows of a report's Cells sheet, in the order their files were added.
+
+    Args:
+        capacity (int, optional): The number of rows to preallocate. Defaults to INITIAL_CAPACITY.
+    """
+    def __init__(self, capacity: int = INITIAL_CAPACITY) -> None:
+        self.capacity = max(capacity, 1)
+        self.length = 0
+        self.columns: dict[str, np.ndarray] = {} # created when the first file is added, in the order of its columns
+        self.condition_codes = np.empty(self.capacity, dtype=np.int32)
+        self.cell_type_codes = np.empty(self.capacity, dtype=np.int32)
+        self.conditions: list[str] = []
+        self.cell_types: list[str] = []
+        self.files: dict[str, slice] = {} # file names mapped to their rows
+
+    def __len__(self) -> int:
+        return self.length
+
+    def append(self, file_name: str, condition: str, cell_types: list[str], values: dict[str, np.ndarray]) -> None:
+        """Adds the cells of a measurement file.
+
+        Args:
+            file_name (str): The measurement file's name.
+            condition (str): The experimental condition (group) of the file.
+            cell_types (list[str]): The type of every cell of the file.
+            values (dict[str, np.ndarray]): The results of the classification, column names mapped to one value per
+            cell. Every file must have the same columns.
+        """
+        count = len(cell_types)
+        if self.length + count > self.capacity:
+            self.grow(self.length + count)
+        if not self.columns:
+            self.columns = {name: np.empty(self.capacity, dtype=np.asarray(column).dtype)
+                            for name, column in values.items()}
+
+        rows = slice(self.length, self.length + count)
+        for name, column in self.columns.items():
+            column[rows] = values[name]
+        self.condition_codes[rows] = self.code(self.conditions, condition)
+        unique_types, inverse = np.unique(np.asarray(cell_types, dtype=str), return_inverse=True)
+        type_codes = np.array([self.code(self.cell_types, cell_type) for cell_type in unique_types], dtype=np.int32)
+        self.cell_type_codes[rows] = type_codes[inverse]
+        self.files[file_name] = rows
+        self.length += count
+
+    @staticmethod
+    def code(values: list[str], value: str) -> int:
+        if value not in values:
+            values.append(value)
+        return values.index(value)
+
+    def grow(self, minimum: int) -> None:
+        """Reallocates every column with at least twice the capacity, or more if the minimum requires it.
+        """
+        self.capacity = max(2 * self.capacity, minimum)
+        for name, column in self.columns.items():
+            self.columns[name] = self.resized(column)
+        self.condition_codes = self.resized(self.condition_codes)
+        self.cell_type_codes = self.resized(self.cell_type_codes)
+
+    def resized(self, column: np.ndarray) -> np.ndarray:
+        result = np.empty(self.capacity, dtype=column.dtype)
+        result[:self.length] = column[:self.length]
+        return result
+
+    def to_frame(self) -> pd.DataFrame:
+        """Builds the Cells sheet. Cell IDs are the row numbers, so they are unique within a folder.
+        """
+        frame = {
+            "cell_ID": np.arange(self.length),
+            "condition": np.asarray(self.conditions, dtype=object)[self.condition_codes[:self.length]],
+            "cell_type": np.asarray(self.cell_types, dtype=object)[self.cell_type_codes[:self.length]]
+        }
+        for name, column in self.columns.items():
+            frame[name] = column[:self.length]
+        return pd.DataFrame(frame)
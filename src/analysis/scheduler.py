@@ -0,0 +1,154 @@
+"""Runs the stages of the analysis (processing, summary and graphing) on a bounded pool of worker processes.
+
+The work of these stages holds the GIL most of the time (pandas, matplotlib), so threads barely run in parallel,
+processes do. Tasks are module level functions called with picklable arguments (paths and the config, never GUI
+objects), and report their progress through a queue, which a thread of the main process passes on. Results and errors
+come back to the main process, where they are merged.
+"""
+from __future__ import annotations
+
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+import os
+from threading import Thread
+from typing import Any, Callable, Hashable
+
+try:
+    import resource # not available on Windows, where the memory limit is ignored
+except ImportError:
+    resource = None
+
+from .telemetry import Event, Progress
+from .toml_data import Performance
+
+type Task = tuple[Callable[..., Any], tuple[Any, ...]] # a function, and its arguments except the progress callback
+type FollowUp = Callable[[Hashable, Any], dict[Hashable, Task]] # see Scheduler.stream
+
+FAILED: Any = object() # passed to follow-ups in place of the result of a task that failed
+BROKEN_POOL = "a worker process stopped unexpectedly (possibly out of memory)."
+TASKS_PER_WORKER = 2 # handed to the pool at a time, one running and one waiting so that no worker is ever idle
+# worker processes are started fresh rather than forked, forking a process that has threads running (the GUI's worker,
+# the progress forwarder) can leave a lock held forever in the child
+POOL_CONTEXT = multiprocessing.get_context("spawn")
+
+_progress_queue: Any = None # the worker side of the progress queue, set up when a worker process starts
+
+
+def start_worker(progress_queue: Any, memory_limit: int) -> None:
+    """Runs once in every worker process. The memory limit (in MB, 0 for none) caps the address space of the worker,
+    which runs one task at a time, so a task that needs more fails with a MemoryError instead of taking the whole
+    machine down with it.
+    """
+    global _progress_queue
+    _progress_queue = progress_queue
+    if memory_limit > 0 and resource is not None:
+        limit = memory_limit * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+def in_worker() -> bool:
+    """Tells whether this is a worker process of a scheduler, where every core is busy with a worker already.
+    """
+    return _progress_queue is not None
+
+def report_progress(event: Event) -> None:
+    _progress_queue.put(event)
+
+def run_task(function: Callable[..., Any], args: tuple[Any, ...]) -> Any:
+    return function(*args, report_progress)
+
+
+class Scheduler:
+    """Runs tasks on up to performance.workers processes (one per CPU core by default), but never more than there are
+    tasks.
+
+    Args:
+        performance (Performance): The performance section of the config.
+        progress (Progress): Called in the main process as the tasks make progress.
+    """
+    def __init__(self, performance: Performance, progress: Progress) -> None:
+        self.workers = performance.workers if performance.workers > 0 else (os.cpu_count() or 1)
+        self.memory_limit = performance.memory_limit
+        self.progress = progress
+
+    def run(self, tasks: dict[Hashable, Task]) -> tuple[dict[Hashable, Any], list[str]]:
+        """Runs every task and waits for all of them to finish.
+
+        Args:
+            tasks (dict[Hashable, Task]): Keys (used to tell the results apart) mapped to tasks. Each task's function is
+            called with its arguments and a Progress callback. The tasks wait in a single queue, in this order, and
+            every worker takes the next one as soon as it is idle, so the longest tasks should come first.
+
+        Returns:
+            tuple[dict[Hashable, Any], list[str]]: The keys of the tasks that finished mapped to their return values,
+            and error messages about the ones that failed.
+        """
+        return self.stream(tasks, lambda key, result: {}, min(self.workers, len(tasks)))
+
+    def stream(self, tasks: dict[Hashable, Task], follow_up: FollowUp,
+               workers: int | None = None) -> tuple[dict[Hashable, Any], list[str]]:
+        """Runs tasks that lead to further tasks, such as the stages of the analysis of a file, until there are none
+        left. Only a couple of tasks per worker are handed to the pool at a time, the rest wait in a queue where the
+        tasks that follow up on finished ones go to the front, so a file goes through every stage as soon as it can,
+        instead of every file waiting for the whole stage to finish.
+
+        Args:
+            tasks (dict[Hashable, Task]): The tasks to start with, as in run.
+            follow_up (FollowUp): Called in this process with the key and result of every task (FAILED for the ones
+            that failed), returns the tasks that can start because of it (an empty dict if there are none).
+            workers (int | None, optional): The number of processes to use. Defaults to the number in the config.
+
+        Returns:
+            tuple[dict[Hashable, Any], list[str]]: The results of every task that finished, including the follow-ups,
+            and error messages about the ones that failed.
+        """
+        results: dict[Hashable, Any] = {}
+        errors: list[str] = []
+        if not tasks:
+            return results, errors
+
+        workers = workers or self.workers
+        ready = deque(tasks.items())
+        progress_queue = POOL_CONTEXT.Queue()
+        forwarder = Thread(target=self.forward_progress, args=(progress_queue,))
+        forwarder.start()
+        try:
+            with ProcessPoolExecutor(max_workers=workers, mp_context=POOL_CONTEXT, initializer=start_worker,
+                                     initargs=(progress_queue, self.memory_limit)) as pool:
+                running: dict[Future, Hashable] = {}
+                while ready or running:
+                    while ready and len(running) < workers * TASKS_PER_WORKER:
+                        key, (function, args) = ready.popleft()
+                        try:
+                            running[pool.submit(run_task, function, args)] = key
+                        except BrokenProcessPool: # a worker died, the pool can't take new tasks
+                            errors.append(f"{key}: {BROKEN_POOL}")
+                            ready.extendleft(reversed(follow_up(key, FAILED).items()))
+                    if not running:
+                        continue
+                    finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        key = running.pop(future)
+                        try:
+                            result = results[key] = future.result()
+                        except MemoryError:
+                            errors.append(f"{key}: ran out of memory, the memory_limit setting is {self.memory_limit} MB.")
+                            result = FAILED
+                        except BrokenProcessPool:
+                            errors.append(f"{key}: {BROKEN_POOL}")
+                            result = FAILED
+                        except Exception as e:
+                            errors.append(f"{key}: {e}")
+                            result = FAILED
+                        ready.extendleft(reversed(follow_up(key, result).items()))
+        finally:
+            progress_queue.put(None)
+            forwarder.join()
+        return results, errors
+
+    def forward_progress(self, progress_queue: Any) -> None:
+        """Passes the events published by the workers on, until the None that stream puts in the queue at the end.
+        """
+        while (event := progress_queue.get()) is not None:
+            self.progress(event)
@@ -0,0 +1,98 @@
+"""Sharding: splitting the subfolders of a target folder between independent jobs, on one machine or many.
+
+Every subfolder belongs to exactly one of K shards, decided by a hash of its name, so every job agrees on the split
+without talking to the others, and a folder stays in its shard from one run to the next. A sharded job makes the caches,
+reports and graphs of its own folders, but instead of the summary it writes a summary index of its own. The merge step
+puts these together into the summary index of the target folder, and writes the same summary an unsharded run would.
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass
+import json
+from pathlib import Path
+import re
+import zlib
+
+from .summary import SummaryIndex
+
+SHARD_INDEX_PATTERN = re.compile(r"\.summary_index\.shard-(\d+)-of-(\d+)\.json")
+
+
+@dataclass(frozen=True)
+class Shard:
+    """One of the shards of a target folder.
+
+    Attributes:
+        number (int): Which shard this is, from 1 to count.
+        count (int): How many shards the target folder is split into.
+    """
+    number: int
+    count: int
+
+    @classmethod
+    def parse(cls, value: str) -> Shard:
+        """Reads a shard given like 2/8.
+
+        Raises:
+            ValueError: If the value is not two positive integers, the first one at most the second.
+        """
+        number, _, count = value.partition("/")
+        if not (number.isdigit() and count.isdigit()) or not 1 <= int(number) <= int(count):
+            raise ValueError(f"a shard is given as number/count, like 2/8, not {value}")
+        return cls(int(number), int(count))
+
+    def contains(self, folder: Path) -> bool:
+        """Checks whether a subfolder belongs to this shard. crc32 is used because Python's own string hash is different
+        in every process.
+        """
+        return zlib.crc32(folder.name.encode("utf-8")) % self.count == self.number - 1
+
+    @property
+    def index_name(self) -> str:
+        """The name of this shard's summary index, it's kept in the target folder like the full one.
+        """
+        return f".summary_index.shard-{self.number}-of-{self.count}.json"
+
+    def __str__(self) -> str:
+        return f"{self.number}/{self.count}"
+
+
+def in_shard(folder: Path, shard: Shard | None) -> bool:
+    """Checks whether a subfolder is to be worked on, every folder is when the run isn't sharded.
+    """
+    return shard is None or shard.contains(folder)
+
+
+def merge_shard_indexes(target_folder: Path) -> tuple[SummaryIndex, list[str]]:
+    """Puts the summary indexes of every shard of a target folder together into its summary index. The index is not
+    saved here.
+
+    Returns:
+        tuple[SummaryIndex, list[str]]: The merged index, and error messages if some of the shards are missing or from
+        a different split. Nothing is merged in that case, as the summary would miss experiments.
+    """
+    shard_files: dict[int, dict[int, Path]] = {} # by shard count, then shard number
+    for path in target_folder.iterdir():
+        if (match := SHARD_INDEX_PATTERN.fullmatch(path.name)) is not None:
+            shard_files.setdefault(int(match[2]), {})[int(match[1])] = path
+
+    index = SummaryIndex(target_folder)
+    if not shard_files:
+        return index, [f"No shard summary indexes found in {target_folder}, run the shards first."]
+    if len(shard_files) > 1:
+        counts = ", ".join(str(count) for count in sorted(shard_files))
+        return index, [f"Found the shard summary indexes of splits into {counts} shards, delete the old ones."]
+    count, files = shard_files.popitem()
+    missing = [str(number) for number in range(1, count + 1) if number not in files]
+    if missing:
+        return index, [f"Shard(s) {', '.join(missing)} of {count} have not written their summary index yet."]
+
+    entries: dict[str, dict] = {}
+    for number in sorted(files):
+        try:
+            with open(files[number], "r") as f:
+                entries.update(json.load(f))
+        except json.JSONDecodeError:
+            return index, [f"The summary index of shard {number}/{count} is damaged, run that shard again."]
+    index.entries = entries
+    return index, []
@@ -0,0 +1,80 @@
+"""The summary index: the reaction counts of every experiment that went into the summary, and the size and modification
+time their reports had when they were counted. A summary run only loads the reports that changed since they were last
+counted, the counts of every other experiment come from the index.
+"""
+from __future__ import annotations
+
+import json
+import os
+from pathlib import Path
+
+import pandas as pd
+
+SUMMARY_INDEX_NAME = ".summary_index.json" # kept in the target folder, next to the summary
+
+
+class SummaryIndex:
+    """The counts are stored with the names of the columns they were counted by (the cell type and the reactions), so
+    that they can be turned back into the same multi-indexed Series that value_counts returned.
+
+    Args:
+        target_folder (Path): The folder the summary is made of.
+        name (str, optional): The file name of the index, shards have their own. Defaults to SUMMARY_INDEX_NAME.
+    """
+    def __init__(self, target_folder: Path, name: str = SUMMARY_INDEX_NAME) -> None:
+        self.path = target_folder / name
+        self.entries: dict[str, dict] = {}
+        if self.path.exists():
+            try:
+                with open(self.path, "r") as f:
+                    self.entries = json.load(f)
+            except json.JSONDecodeError: # everything is counted again, which is what would happen without an index
+                self.entries = {}
+
+    def is_current(self, experiment: str, report_path: Path) -> bool:
+        """Checks whether the counts of an experiment were made from its current report.
+
+        Args:
+            experiment (str): The name of the experiment's folder.
+            report_path (Path): The experiment's report.
+
+        Returns:
+            bool: True if the report doesn't need to be loaded again.
+        """
+        entry = self.entries.get(experiment)
+        if entry is None or entry["report"] != report_path.name:
+            return False
+        stat = report_path.stat()
+        return stat.st_size == entry["size"] and stat.st_mtime_ns == entry["mtime_ns"]
+
+    def record(self, experiment: str, report_path: Path, agonists: list[str], counts: pd.Series) -> None:
+        stat = report_path.stat()
+        self.entries[experiment] = {
+            "report": report_path.name,
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "agonists": agonists,
+            "columns": list(counts.index.names),
+            "rows": [list(row) for row in counts.reset_index().itertuples(index=False, name=None)] # Python scalars
+        }
+
+    def experiment(self, experiment: str) -> tuple[tuple[str, ...], pd.Series]:
+        """Returns the agonists used in an experiment, and its reaction counts.
+        """
+        entry = self.entries[experiment]
+        table = pd.DataFrame(entry["rows"], columns=entry["columns"] + ["count"])
+        return tuple(entry["agonists"]), table.set_index(entry["columns"])["count"]
+
+    def retain(self, experiments: list[str]) -> None:
+        """Forgets the experiments that are no longer in the target folder.
+        """
+        self.entries = {name: entry for name, entry in self.entries.items() if name in experiments}
+
+    def save(self) -> None:
+        """Writes the index to a temporary file first and then moves it into place, so an interrupted save can't leave
+        a half-written index behind.
+        """
+        temp_path = self.path.with_suffix(".tmp")
+        with open(temp_path, "w") as f:
+            json.dump(self.entries, f, indent=1)
+        os.replace(temp_path, self.path)
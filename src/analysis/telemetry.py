@@ -0,0 +1,162 @@
+"""Progress telemetry: the stages of the analysis publish events about the work they finish, and whoever runs them (the
+GUI, or a headless run) consumes the events on its own thread.
+
+Every stage starts by announcing how many files it is going to finish, then publishes an event for every file it
+finishes, with the size of the file and how long it took. Events from worker processes are passed on by the scheduler,
+so they arrive in the main process like any other. Publishing only puts the event in a queue, it's safe to do from any
+thread, and never waits for the consumer.
+"""
+from __future__ import annotations
+
+from collections import deque
+from dataclasses import dataclass
+import queue
+import time
+from threading import Thread
+from typing import Any, Callable
+
+RATE_WINDOW = 10.0 # seconds, the rates are averaged over the events of this long a time
+
+
+@dataclass(frozen=True)
+class StageStarted:
+    """A stage is about to start.
+    """
+    stage: str # "convert", "export", "process", "summary", "graph", "sweep" or "batch"
+    files: int # how many FileFinished events it will publish
+
+
+@dataclass(frozen=True)
+class FileFinished:
+    """A stage is done with a file (or a report, for the summary).
+    """
+    stage: str
+    folder: str
+    file: str
+    cells: int = 0
+    frames: int = 0
+    bytes: int = 0 # of the file that was read
+    duration: float = 0.0 # seconds spent on this file, in whichever process did the work
+
+
+type Event = StageStarted | FileFinished
+type Progress = Callable[[Event], None] # what the stages publish their events with
+
+
+def timed(function: Callable[..., Any], *args: Any) -> tuple[Any, float]:
+    """Calls a function, and returns its result and how many seconds it took. Module level, so that worker processes can
+    run it.
+    """
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+class Telemetry:
+    """The event queue between the stages and the consumer. Pass publish to the stages as their Progress.
+    """
+    def __init__(self) -> None:
+        self.events: queue.SimpleQueue[Event | None] = queue.SimpleQueue()
+
+    def publish(self, event: Event) -> None:
+        self.events.put(event)
+
+    def drain(self) -> list[Event]:
+        """Takes every event that has been published since the last call, without waiting for more.
+        """
+        events = []
+        while True:
+            try:
+                event = self.events.get_nowait()
+            except queue.Empty:
+                return events
+            if event is not None:
+                events.append(event)
+
+    def consume(self, handler: Callable[[Event], None]) -> Thread:
+        """Calls the handler with every event on a thread of its own, until close is called. For consumers that don't
+        have an event loop of their own to poll drain from, like headless runs.
+
+        Returns:
+            Thread: The consumer thread, which finishes after close.
+        """
+        def run() -> None:
+            while (event := self.events.get()) is not None:
+                handler(event)
+
+        thread = Thread(target=run, daemon=True)
+        thread.start()
+        return thread
+
+    def close(self) -> None:
+        """Stops the consumer thread once it has handled every event published so far.
+        """
+        self.events.put(None)
+
+
+def format_duration(seconds: float) -> str:
+    """Formats a number of seconds like 1:05 or 2:03:20.
+    """
+    minutes, secs = divmod(round(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02}:{secs:02}" if hours else f"{minutes}:{secs:02}"
+
+
+class Throughput:
+    """Keeps track of how much of the announced work is done, and how fast it's going.
+
+    Args:
+        window (float, optional): The rates are averaged over this many seconds. Defaults to RATE_WINDOW.
+    """
+    def __init__(self, window: float = RATE_WINDOW) -> None:
+        self.window = window
+        self.reset()
+
+    def reset(self, now: float | None = None) -> None:
+        """Forgets everything, called when a new run starts.
+        """
+        self.started = time.monotonic() if now is None else now
+        self.planned = 0
+        self.finished = 0
+        self.cells = 0
+        self.stage = ""
+        self.recent: deque[tuple[float, int]] = deque() # the time each recent file was finished, and its cells
+
+    def add(self, event: Event, now: float | None = None) -> None:
+        now = time.monotonic() if now is None else now
+        if isinstance(event, StageStarted):
+            self.planned += event.files
+            self.stage = event.stage
+        else:
+            self.finished += 1
+            self.cells += event.cells
+            self.recent.append((now, event.cells))
+        while self.recent and self.recent[0][0] < now - self.window:
+            self.recent.popleft()
+
+    def files_per_second(self, now: float | None = None) -> float:
+        recent, elapsed = self.in_window(now)
+        return len(recent) / elapsed
+
+    def cells_per_second(self, now: float | None = None) -> float:
+        recent, elapsed = self.in_window(now)
+        return sum(cells for _, cells in recent) / elapsed
+
+    def eta(self, now: float | None = None) -> float | None:
+        """Estimates how many seconds are left, from the files still to be done and the current rate.
+
+        Returns:
+            float | None: The estimate, or None if nothing was finished recently to base it on.
+        """
+        rate = self.files_per_second(now)
+        if rate == 0:
+            return None
+        return max(self.planned - self.finished, 0) / rate
+
+    def in_window(self, now: float | None) -> tuple[list[tuple[float, int]], float]:
+        """Returns the files finished within the window, and how long the window is, which is shorter at the start of a
+        run.
+        """
+        now = time.monotonic() if now is None else now
+        elapsed = max(min(self.window, now - self.started), 1e-3)
+        return [entry for entry in self.recent if entry[0] >= now - self.window], elapsed
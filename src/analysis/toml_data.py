@@ -19,11 +19,29 @@ class Config:
                         input_section["smoothing_range"],
                         input_section["amp_threshold"],
                         input_section["cv_threshold"],
-                        input_section["correction"])
+                        input_section["correction"],
+                        # these are optional, older config files don't have them
+                        input_section.get("smoothing_filter", "mean"),
+                        input_section.get("correction_model", "linear"))
         
         output_section = config_as_dict["output"]
         self.output = Output(output_section["report_name"],
                             output_section["summary_name"])
+
+        # this section is optional so that config files written by older versions keep working
+        performance_section = config_as_dict.get("performance", {})
+        self.performance = Performance(performance_section.get("workers", 0),
+                                       performance_section.get("cache_dtype", "float64"),
+                                       performance_section.get("cache_layout", "files"),
+                                       performance_section.get("cache_compression", "none"),
+                                       performance_section.get("memory_limit", 0),
+                                       performance_section.get("pipeline", False))
+
+        # also optional, empty lists mean that only the values in the input section are used
+        sweep_section = config_as_dict.get("sweep", {})
+        self.sweep = Sweep(sweep_values(sweep_section.get("SD_multipliers", [])),
+                           sweep_values(sweep_section.get("amp_thresholds", [])),
+                           sweep_values(sweep_section.get("cv_thresholds", [])))
         
     def to_dict(self) -> dict[str, dict[str, Any]]:
         result = {}
@@ -32,6 +50,8 @@ class Config:
         path_as_str = str(result["input"]["target_folder"])
         result["input"]["target_folder"] = path_as_str
         result["output"] = asdict(self.output)
+        result["performance"] = asdict(self.performance)
+        result["sweep"] = asdict(self.sweep)
 
         return result
 
@@ -44,12 +64,45 @@ class Input:
     amp_threshold: float
     cv_threshold: float
     correction: str
+    smoothing_filter: str = "mean"
+    correction_model: str = "linear"
 
 @dataclass
 class Output:
     report_name: str
     summary_name: str
 
+@dataclass
+class Performance:
+    workers: int = 0 # 0 means one worker process per CPU core
+    cache_dtype: str = "float64"
+    cache_layout: str = "files" # "files" for one file per cached sheet, "archive" for one file per folder
+    cache_compression: str = "none"
+    memory_limit: int = 0 # in MB per worker process, 0 means no limit
+    pipeline: bool = False # run the stages as a pipeline instead of one after the other
+
+@dataclass
+class Sweep:
+    SD_multipliers: list[float] = field(default_factory=list)
+    amp_thresholds: list[float] = field(default_factory=list)
+    cv_thresholds: list[float] = field(default_factory=list)
+
+def sweep_values(value: list[float] | dict[str, float]) -> list[float]:
+    """Values to sweep can be given as a list, or as a range with a start, stop and step, in which case the stop value is
+    included, like this: {start = 1, stop = 5, step = 0.5}
+
+    Args:
+        value (list[float] | dict[str, float]): The value from the sweep section of the config file.
+
+    Returns:
+        list[float]: The values to try.
+    """
+    if isinstance(value, dict):
+        start, stop, step = value["start"], value["stop"], value["step"]
+        count = int(round((stop - start) / step)) + 1
+        return [round(start + i * step, 10) for i in range(max(count, 0))]
+    return [float(x) for x in value]
+
 @dataclass(init=False)
 class Metadata:
     def __init__(self, metadata_as_dict: dict[str, dict[str, Any]]):
@@ -1,7 +1,9 @@
-from numbers import Rational
+from numbers import Rational, Real
 from pathlib import Path
 from typing import Any
 
+from .bleaching import MODELS
+from .filters import FILTERS
 from .toml_data import Treatments
 
 
@@ -64,6 +66,14 @@ def validate_config(config: dict[str, dict[str, Any]]) -> str:
     except KeyError:
         message += "\n- correction key missing from input section"
 
+    # smoothing_filter and correction_model are optional, config files written by older versions don't have them
+    if "smoothing_filter" in config.get("input", {}):
+        if config["input"]["smoothing_filter"] not in FILTERS:
+            message += f"\n- smoothing_filter value incorrect. Supported values are: {', '.join(FILTERS)}."
+    if "correction_model" in config.get("input", {}):
+        if config["input"]["correction_model"] not in MODELS:
+            message += f"\n- correction_model value incorrect. Supported values are: {', '.join(MODELS)}."
+
     try:
         if not isinstance(config["output"]["report_name"], str):
             message += "\n- report_name value must be a string"
@@ -76,6 +86,39 @@ def validate_config(config: dict[str, dict[str, Any]]) -> str:
     except KeyError:
         message += "\n- summary_name key missing from output section"
 
+    # the sweep section is optional too, each value is a list of numbers or a range
+    for key, value in config.get("sweep", {}).items():
+        if key not in {"SD_multipliers", "amp_thresholds", "cv_thresholds"}:
+            message += f"\n- unknown key in sweep section: {key}"
+        elif isinstance(value, dict):
+            if set(value) != {"start", "stop", "step"} or not all(isinstance(v, Real) for v in value.values()):
+                message += f"\n- {key} range must have a numeric start, stop and step"
+            elif value["step"] <= 0:
+                message += f"\n- {key} step must be larger than 0"
+        elif not isinstance(value, list) or not all(isinstance(v, Real) for v in value):
+            message += f"\n- {key} value must be a list of numbers or a range"
+
+    # the performance section is optional, its values are only checked if they are present
+    performance = config.get("performance", {})
+    if "workers" in performance:
+        if not isinstance(performance["workers"], int) or performance["workers"] < 0:
+            message += "\n- workers value must be a non-negative integer (0 means one per CPU core)"
+    if "cache_dtype" in performance:
+        if performance["cache_dtype"] not in {"float64", "float32"}:
+            message += '\n- cache_dtype value incorrect; only "float64" and "float32" are accepted'
+    if "cache_layout" in performance:
+        if performance["cache_layout"] not in {"files", "archive"}:
+            message += '\n- cache_layout value incorrect; only "files" and "archive" are accepted'
+    if "cache_compression" in performance:
+        if performance["cache_compression"] not in {"none", "zlib", "lzma"}:
+            message += '\n- cache_compression value incorrect; only "none", "zlib", and "lzma" are accepted'
+    if "memory_limit" in performance:
+        if not isinstance(performance["memory_limit"], int) or performance["memory_limit"] < 0:
+            message += "\n- memory_limit value must be a non-negative integer (0 means no limit)"
+    if "pipeline" in performance:
+        if not isinstance(performance["pipeline"], bool):
+            message += "\n- pipeline value must be true or false"
+
     if len(message) > starting_len:
         message += ".\nExiting."
         return message
@@ -0,0 +1,159 @@
+"""Per-window statistics of every cell in a measurement, computed once and shared by all the reaction testing methods
+and the neuron filter.
+
+The treatment windows (and the short tails before each agonist that the "previous" method compares against) cut the
+measurement into segments at their boundaries. Every statistic is reduced over these segments in a single pass with
+NumPy's reduceat, and the statistics of a window are put together from the segments it covers.
+"""
+from __future__ import annotations
+
+from bisect import bisect_left
+from functools import cached_property
+
+import numpy as np
+
+
+TAIL_LENGTH = 10 # the number of frames before an agonist's window that the "previous" method compares against
+
+
+class SegmentReductions:
+    """Sums, sums of squares, maximums and the positions of the maximums of consecutive segments of a 2d array, along
+    its second axis.
+
+    Args:
+        data (np.ndarray): The data, cells x frames.
+        bounds (list[int]): The first frame of every segment, sorted and starting with 0, each segment ends where the
+        next one begins.
+    """
+    def __init__(self, data: np.ndarray, bounds: list[int]) -> None:
+        self.data = data
+        self.bounds = bounds
+        self.counts = np.diff(bounds + [data.shape[1]])
+        # subtracting the first frame keeps the sums small, so that variances computed from them stay accurate
+        self.offset = data[:, :1]
+        shifted = np.subtract(data, self.offset, dtype=np.float64)
+        self.sums = np.add.reduceat(shifted, bounds, axis=1)
+        self.squares = np.add.reduceat(np.square(shifted, out=shifted), bounds, axis=1) # reuses the same buffer
+        self.maximums = np.maximum.reduceat(data, bounds, axis=1)
+
+    @cached_property
+    def argmaxes(self) -> np.ndarray:
+        """The first position in each segment where the data equals the segment's maximum. Takes another pass over the
+        data, so it is only computed if it's needed.
+        """
+        segment_of_frame = np.repeat(np.arange(len(self.bounds)), self.counts)
+        frames = self.data.shape[1]
+        positions = np.where(self.data == self.maximums[:, segment_of_frame], np.arange(frames), frames)
+        return np.minimum.reduceat(positions, self.bounds, axis=1)
+
+    def segments(self, start: int, stop: int) -> slice:
+        """Returns the segments that make up the frames from start to stop, which must both be segment boundaries.
+        """
+        return slice(bisect_left(self.bounds, start), bisect_left(self.bounds, stop))
+
+    def mean(self, start: int, stop: int) -> np.ndarray:
+        segments = self.segments(start, stop)
+        return self.sums[:, segments].sum(axis=1) / self.counts[segments].sum() + self.offset[:, 0]
+
+    def std(self, start: int, stop: int) -> np.ndarray:
+        segments = self.segments(start, stop)
+        count = self.counts[segments].sum()
+        mean = self.sums[:, segments].sum(axis=1) / count
+        return np.sqrt(np.maximum(self.squares[:, segments].sum(axis=1) / count - mean * mean, 0))
+
+    def max(self, start: int, stop: int) -> np.ndarray:
+        return self.maximums[:, self.segments(start, stop)].max(axis=1)
+
+    def argmax(self, start: int, stop: int) -> np.ndarray:
+        segments = self.segments(start, stop)
+        best = np.argmax(self.maximums[:, segments], axis=1) # the first segment holding the maximum
+        return self.argmaxes[:, segments][np.arange(len(best)), best]
+
+
+def check_windows(agonist_slices: dict[str, slice[int]], frames: int) -> dict[str, tuple[int, int]]:
+    """Clips the treatment windows to the length of a measurement.
+
+    Args:
+        agonist_slices (dict[str, slice[int]]): The treatment windows, including the baseline.
+        frames (int): The length of the measurement.
+
+    Raises:
+        ValueError: If a window has no frames, because the measurement ends before it begins.
+
+    Returns:
+        dict[str, tuple[int, int]]: The first frame of every window and the frame after its last.
+    """
+    windows: dict[str, tuple[int, int]] = {}
+    for name, time_window in agonist_slices.items():
+        start, stop, _ = time_window.indices(frames)
+        if start >= stop: # every statistic of an empty window would be NaN
+            raise ValueError(f"The {name} window (frames {time_window.start} to {time_window.stop}) is past the end "
+                             f"of the measurement, which has {frames} frames.")
+        windows[name] = (start, stop)
+    return windows
+
+
+class WindowStats:
+    """Statistics of every cell in every treatment window of a measurement.
+
+    Args:
+        cell_data (np.ndarray): The processed traces, cells x frames.
+        agonist_slices (dict[str, slice[int]]): A dictionary mapping agonist names to the indices where each agonist was
+        applied, including the baseline.
+        tail_length (int, optional): The length of the tails before each agonist's window. Defaults to TAIL_LENGTH.
+
+    Raises:
+        ValueError: If a window has no frames, see check_windows.
+    """
+    def __init__(self, cell_data: np.ndarray, agonist_slices: dict[str, slice[int]], tail_length: int = TAIL_LENGTH
+                 ) -> None:
+        self.cell_data = cell_data
+        frames = cell_data.shape[1]
+        self.windows = check_windows(agonist_slices, frames)
+        self.tails = {name: (max(start - tail_length, 0), start) for name, (start, _) in self.windows.items()
+                      if name != "baseline"}
+
+        edges = {0} | {edge for window in list(self.windows.values()) + list(self.tails.values()) for edge in window}
+        self.bounds = sorted(edge for edge in edges if edge < frames)
+        self.values = SegmentReductions(cell_data, self.bounds)
+
+    @property
+    def agonists(self) -> list[str]:
+        """The names of the treatment windows, except the baseline, in the order they are in the metadata.
+        """
+        return [name for name in self.windows if name != "baseline"]
+
+    @cached_property
+    def derivatives(self) -> SegmentReductions:
+        """Statistics of the traces' first derivatives, only computed if a method needs them.
+        """
+        return SegmentReductions(np.gradient(self.cell_data, axis=1), self.bounds)
+
+    def mean(self, name: str) -> np.ndarray:
+        return self.values.mean(*self.windows[name])
+
+    def std(self, name: str) -> np.ndarray:
+        return self.values.std(*self.windows[name])
+
+    def max(self, name: str) -> np.ndarray:
+        return self.values.max(*self.windows[name])
+
+    def argmax(self, name: str) -> np.ndarray:
+        """Returns the frame where each cell's trace is at its maximum in this window, counted from the start of the
+        measurement.
+        """
+        return self.values.argmax(*self.windows[name])
+
+    def tail_mean(self, name: str) -> np.ndarray:
+        """Returns the mean of each cell's trace in the last frames before this agonist's window.
+        """
+        return self.values.mean(*self.tails[name])
+
+    def derivative_mean(self, name: str) -> np.ndarray:
+        return self.derivatives.mean(*self.windows[name])
+
+    def derivative_std(self, name: str) -> np.ndarray:
+        return self.derivatives.std(*self.windows[name])
+
+    def derivative_max(self, name: str) -> np.ndarray:
+        return self.derivatives.max(*self.windows[name])
@@ -0,0 +1,161 @@
+"""Runs the analysis without the graphical interface, on servers or as a scheduled job. Nothing here imports tkinter.
+
+Usage, from the src folder:
+    uv run cli.py [target_folder] [--config CONFIG] [--jobs N] [--stages convert,process,summarize] [--repeat]
+                  [--shard N/K]
+
+With --shard, only the subfolders in shard N of K are worked on (see analysis.shards), so K jobs can split a target
+folder between them, on one machine or on many that share the folder. Their summaries are put together afterwards with
+--stages merge.
+
+Progress is printed to standard output, one JSON object per line: the telemetry events (see analysis.telemetry) with
+their class name under "event", an "error" object for every error message, and a final "done" object. The exit status
+is 0 if everything went fine, 1 if there were errors, and 2 if the config or the command line was wrong.
+"""
+import argparse
+from dataclasses import asdict
+import json
+from multiprocessing import freeze_support
+from pathlib import Path
+import sys
+from threading import Lock
+import time
+
+import toml
+
+from analysis.engine import AnalysisEngine
+from analysis.shards import Shard
+from analysis.telemetry import Event, Telemetry
+from analysis.toml_data import Config
+from analysis.validation import validate_config
+
+STAGES = ["convert", "process", "summarize", "graph", "batch", "sweep", "merge"] # in the order they are run
+UNSHARDED_STAGES = {"batch", "sweep", "merge"} # these work on every subfolder at once
+DEFAULT_STAGES = "convert,process,summarize"
+
+_output_lock = Lock() # the events are printed by the telemetry's consumer thread, everything else by the main thread
+
+
+def emit(record: dict) -> None:
+    with _output_lock:
+        print(json.dumps(record, default=str), flush=True)
+
+def emit_event(event: Event) -> None:
+    emit({"event": type(event).__name__, **asdict(event)})
+
+def stage_list(value: str) -> list[str]:
+    stages = [stage.strip() for stage in value.split(",") if stage.strip()]
+    unknown = [stage for stage in stages if stage not in STAGES]
+    if unknown:
+        raise argparse.ArgumentTypeError(f"unknown stage(s): {', '.join(unknown)}; choose from {', '.join(STAGES)}")
+    return stages
+
+def positive_int(value: str) -> int:
+    if not value.isdigit() or int(value) < 1:
+        raise argparse.ArgumentTypeError("must be a positive integer")
+    return int(value)
+
+def shard(value: str) -> Shard:
+    try:
+        return Shard.parse(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+def parse_args(argv: list[str] | None) -> argparse.Namespace:
+    base_path = Path(sys.executable).parent if getattr(sys, "frozen", False) else Path(__file__).parent
+    parser = argparse.ArgumentParser(description="Analyzes Ca measurements without the graphical interface.")
+    parser.add_argument("target_folder", nargs="?", type=Path,
+                        help="the folder to analyze, defaults to target_folder in the config")
+    parser.add_argument("--config", type=Path, default=base_path / "config.toml",
+                        help="the config file, defaults to config.toml next to this program")
+    parser.add_argument("--jobs", type=positive_int,
+                        help="the number of worker processes, overrides workers in the config")
+    parser.add_argument("--stages", type=stage_list, default=stage_list(DEFAULT_STAGES),
+                        help=f"comma separated stages to run, from {','.join(STAGES)} (default: {DEFAULT_STAGES})")
+    parser.add_argument("--repeat", action="store_true",
+                        help="process folders that already have a report as well")
+    parser.add_argument("--shard", type=shard,
+                        help="only work on shard N of K of the subfolders, like 2/8, and leave the summary to merge")
+    args = parser.parse_args(argv)
+    if args.shard is not None and UNSHARDED_STAGES.intersection(args.stages):
+        parser.error(f"--shard can't be used with the {', '.join(sorted(UNSHARDED_STAGES))} stages")
+    return args
+
+def load_config(args: argparse.Namespace) -> tuple[Config | None, str]:
+    """Reads the config file and applies the command line overrides to it.
+
+    Returns:
+        tuple[Config | None, str]: The config, or None and the error message if it's missing or invalid.
+    """
+    if not args.config.exists():
+        return None, f"Config file not found: {args.config}"
+    with open(args.config, "r") as f:
+        config_as_dict = toml.load(f)
+    if args.target_folder is not None:
+        config_as_dict["input"]["target_folder"] = str(args.target_folder)
+    if args.jobs is not None:
+        config_as_dict.setdefault("performance", {})["workers"] = args.jobs
+
+    errors = validate_config(config_as_dict) # this checks the target folder too
+    if errors:
+        return None, errors
+    return Config(getattr(sys, "frozen", False), config_as_dict), ""
+
+def run(config: Config, stages: list[str], repeat: bool, telemetry: Telemetry,
+        shard: Shard | None = None) -> list[str]:
+    """Runs the selected stages the same way the graphical interface does.
+
+    Returns:
+        list[str]: The error messages of every stage.
+    """
+    engine = AnalysisEngine(config, telemetry.publish, repeat, shard)
+    process, summarize, graph = "process" in stages, "summarize" in stages, "graph" in stages
+    pipeline = config.performance.pipeline and (process or summarize or graph)
+
+    errors: list[str] = []
+    if "convert" in stages and not pipeline: # the pipeline converts whatever it works on
+        errors += engine.create_caches()
+    errors += engine.create_processor_instances()
+    if pipeline:
+        errors += engine.run_pipeline(process, summarize, graph)
+    else:
+        if process:
+            engine.process_data(errors)
+        if summarize:
+            errors += engine.summarize_results()
+        if graph:
+            errors += engine.graph_data()
+    if "batch" in stages:
+        errors += engine.run_batch()
+    if "sweep" in stages:
+        sweep_path, sweep_errors = engine.sweep_thresholds()
+        errors += sweep_errors
+        emit({"event": "sweep_saved", "path": sweep_path})
+    if "merge" in stages:
+        errors += engine.merge_shards()
+    return errors
+
+def main(argv: list[str] | None = None) -> int:
+    args = parse_args(argv)
+    config, message = load_config(args)
+    if config is None:
+        emit({"event": "error", "message": message})
+        return 2
+
+    start = time.perf_counter()
+    telemetry = Telemetry()
+    consumer = telemetry.consume(emit_event)
+    try:
+        errors = run(config, args.stages, args.repeat, telemetry, args.shard)
+    finally:
+        telemetry.close()
+        consumer.join()
+    for error in errors:
+        emit({"event": "error", "message": error})
+    emit({"event": "done", "stages": args.stages, "shard": args.shard, "errors": len(errors),
+          "seconds": time.perf_counter() - start})
+    return 1 if errors else 0
+
+if __name__ == "__main__":
+    freeze_support() # the work is done by worker processes, which frozen Windows builds need this for
+    raise SystemExit(main())
@@ -19,6 +19,7 @@ META_SECTION_2_BASE_Y = 230 # second section of the metadata editor panel
 EDITOR_PADDING_X = 200 # BASE_X + this is the x coord for items in the second column of the editor panels
 OFFSCREEN_X = 600 # this is used to move unwanted items offscreen
 BOTTOM_TABLE_Y = 270 # y coord for the treatment table on the metadata panel
+TELEMETRY_POLL_MS = 250 # how often the progress tracker is updated while work is in progress
 
 # this defines different screen sizes, resizing is done by a callback function that triggers when the value of
 # the StringVar storing the current mode changes.
@@ -49,11 +50,26 @@ CONFIG_TEMPLATE = {
         "smoothing_range": 5,
         "amp_threshold": 0.3,
         "cv_threshold": 0.1,
-        "correction": "True"
+        "correction": "True",
+        "smoothing_filter": "mean",
+        "correction_model": "linear"
     },
     "output": {
         "report_name": "report_",
         "summary_name": "summary"
+    },
+    "performance": {
+        "workers": 0,
+        "cache_dtype": "float64",
+        "cache_layout": "files",
+        "cache_compression": "none",
+        "memory_limit": 0,
+        "pipeline": False
+    },
+    "sweep": {
+        "SD_multipliers": [],
+        "amp_thresholds": [],
+        "cv_thresholds": []
     }
 }
 
@@ -4,13 +4,14 @@ from tkinter import messagebox
 
 
 from interface.gui_panels import ConfigFrame, MetadataFrame
-from interface.gui_constants import FONT_M
+from interface.gui_constants import FONT_M, FONT_S
 from interface.gui_constants import BASE_X, BASE_Y, PADDING_X, PADDING_Y, OFFSCREEN_X
 from interface.gui_constants import MAIN_BUTTON_Y, PANEL_W, CONFIG_H, META_H, PANEL_Y
-from interface.gui_constants import DISPLAY_MODES, MESSAGES
+from interface.gui_constants import DISPLAY_MODES, MESSAGES, TELEMETRY_POLL_MS
 
 from analysis.engine import AnalysisEngine
 from analysis.converter import Converter
+from analysis.telemetry import Telemetry, Throughput, format_duration
 from analysis.toml_data import Config
 
 
@@ -25,7 +26,8 @@ class MainWindow:
         self.root.resizable(False, True)
 
         self.analyzer: AnalysisEngine # to be instantiated later
-        self.converter = Converter(self.config.input.target_folder, self.config.output.report_name)
+        self.converter = Converter(self.config.input.target_folder, self.config.output.report_name,
+                                   self.config.performance)
         
         self.checkbox_frame = tk.Frame()
         self.checkbox_frame.place(x=0, y=0, width=460, height=90)
@@ -50,14 +52,25 @@ class MainWindow:
         self.check_r = tk.Checkbutton(self.checkbox_frame, text="Repeat", font=FONT_M, variable=self.check_r_state)
         self.check_r.place(x=BASE_X + 2 * PADDING_X, y=BASE_Y + PADDING_Y)
 
+        # Batch checkbox
+        self.check_b_state = tk.IntVar()
+        self.check_b = tk.Checkbutton(self.checkbox_frame, text="Batch", font=FONT_M, variable=self.check_b_state)
+        self.check_b.place(x=BASE_X + 3 * PADDING_X, y=BASE_Y)
+
+        # Sweep checkbox
+        self.check_sw_state = tk.IntVar()
+        self.check_sw = tk.Checkbutton(self.checkbox_frame, text="Sweep", font=FONT_M, variable=self.check_sw_state)
+        self.check_sw.place(x=BASE_X + 3 * PADDING_X, y=BASE_Y + PADDING_Y)
+
         # Progress tracker
         self.tracker_frame = tk.Frame()
 
         self.in_progress_label = tk.Label(self.tracker_frame, text="Work in progress...", font=FONT_M)
         self.in_progress_label.place(x=BASE_X, y=0)
 
-        self.finished_file_counter = tk.IntVar()
-        self.finished_file_counter.trace_add("write", self.update_counter)
+        # the work publishes its progress from other threads and processes, it's only shown by poll_telemetry
+        self.telemetry = Telemetry()
+        self.throughput = Throughput()
 
         self.finished_files_label = tk.Label(self.tracker_frame, text="Files finished:", font=FONT_M)
         self.finished_files_label.place(x=BASE_X, y=PADDING_Y)
@@ -65,6 +78,9 @@ class MainWindow:
         self.finished_number_label = tk.Label(self.tracker_frame, text="0", font=FONT_M)
         self.finished_number_label.place(x=BASE_X + 140, y=PADDING_Y)
 
+        self.rate_label = tk.Label(self.tracker_frame, text="", font=FONT_S)
+        self.rate_label.place(x=BASE_X, y=2 * PADDING_Y)
+
         # Frame for the buttons
         self.button_frame = tk.Frame()
         self.button_frame.place(x=BASE_X, y=MAIN_BUTTON_Y)
@@ -110,6 +126,7 @@ class MainWindow:
         self.root.geometry(DISPLAY_MODES[self.current_mode.get()])
         self.config_button_press() # this is here so the program can start in the config layout
         self.root.protocol("WM_DELETE_WINDOW", self.window_exit)
+        self.root.after(TELEMETRY_POLL_MS, self.poll_telemetry)
         self.root.mainloop()
     
     def window_exit(self) -> None:
@@ -149,15 +166,30 @@ class MainWindow:
         self.button_frame.place(x=OFFSCREEN_X)
         self.tracker_frame.place(x=0, y=MAIN_BUTTON_Y, width=460, height=90)
 
+        self.reset_tracker()
         worker_thread = Thread(target=self.analysis_work, args=(previous_mode,))
         worker_thread.start()
         # the processing work is put in a new thread so that the progress counter can be updated and displayed
 
-    def update_counter(self, *args) -> None:
-        """Called whenever the value of the finished_file_counter IntVar is written to (by a SubDir instance, indicating
-        it finished processing a file).
+    def poll_telemetry(self) -> None:
+        """Runs on the Tk thread every TELEMETRY_POLL_MS milliseconds, and shows the progress that was published since
+        the last time: the number of files finished out of those announced, the speed, and an estimate of the time left.
         """
-        self.finished_number_label.config(text=str(self.finished_file_counter.get()))
+        for event in self.telemetry.drain():
+            self.throughput.add(event)
+        throughput = self.throughput
+        self.finished_number_label.config(text=f"{throughput.finished} / {throughput.planned}")
+        eta = throughput.eta()
+        time_left = f"about {format_duration(eta)} left" if eta is not None else "estimating time left..."
+        self.rate_label.config(text=f"{throughput.files_per_second():.1f} files/s, "
+                                    f"{throughput.cells_per_second():.0f} cells/s, {time_left}")
+        self.root.after(TELEMETRY_POLL_MS, self.poll_telemetry)
+
+    def reset_tracker(self) -> None:
+        """Forgets the progress of the last run, called on the Tk thread before new work is started.
+        """
+        self.telemetry.drain()
+        self.throughput.reset()
 
     def config_button_press(self) -> None:
         """
@@ -185,30 +217,53 @@ class MainWindow:
         Args:
             mode (str): The display mode of the program that should be restored when this function finishes its work.
         """
-        self.in_progress_label.config(text="Converting files...")
-        self.analyzer = AnalysisEngine(self.config, self.finished_file_counter, bool(self.check_r_state.get()))
-        self.analyzer.create_caches()
+        self.analyzer = AnalysisEngine(self.config, self.telemetry.publish, bool(self.check_r_state.get()))
+        proc, summ, graph = self.check_p_state.get(), self.check_s_state.get(), self.check_g_state.get()
+        batch, sweep = self.check_b_state.get(), self.check_sw_state.get()
+        pipeline = self.config.performance.pipeline and (proc or summ or graph)
 
-        error_list = self.analyzer.create_processor_instances()
+        if pipeline: # the caches are brought up to date as part of the pipeline
+            error_list = self.analyzer.create_processor_instances()
+        else:
+            self.in_progress_label.config(text="Converting files...")
+            error_list = self.analyzer.create_caches()
+            error_list += self.analyzer.create_processor_instances()
         for error_message in error_list: # if there was no error, nothing happens
             messagebox.showerror(message=error_message)
-        
-        proc, summ, graph = self.check_p_state.get(), self.check_s_state.get(), self.check_g_state.get()
 
         error_list = []
-        if proc:
+        if pipeline:
+            self.in_progress_label.config(text="Working...")
+            error_list = self.analyzer.run_pipeline(bool(proc), bool(summ), bool(graph))
+        if proc and not pipeline:
             self.in_progress_label.config(text="Analyzing...")
             self.analyzer.process_data(error_list)
-            for error in error_list:
-                messagebox.showerror(message=error) # if the list is empty, nothing will happen
-        if summ:
+        for error in error_list:
+            messagebox.showerror(message=error) # if the list is empty, nothing will happen
+        if summ and not pipeline:
             self.in_progress_label.config(text="Working on summary...")
-            self.analyzer.summarize_results()
-        if graph:
+            for error in self.analyzer.summarize_results():
+                messagebox.showerror(message=error)
+        if graph and not pipeline:
             self.in_progress_label.config(text="Drawing graphs...")
-            self.analyzer.graph_data()
-
-        messagebox.showinfo(message=MESSAGES[(proc, summ, graph)])
+            for error in self.analyzer.graph_data():
+                messagebox.showerror(message=error)
+        if batch:
+            self.in_progress_label.config(text="Running batch...")
+            for error in self.analyzer.run_batch():
+                messagebox.showerror(message=error)
+        if sweep:
+            self.in_progress_label.config(text="Sweeping thresholds...")
+            sweep_path, sweep_errors = self.analyzer.sweep_thresholds()
+            for error in sweep_errors:
+                messagebox.showerror(message=error)
+
+        if proc or summ or graph or not (batch or sweep):
+            messagebox.showinfo(message=MESSAGES[(proc, summ, graph)])
+        if batch:
+            messagebox.showinfo(message="Finished running the batch variants.")
+        if sweep:
+            messagebox.showinfo(message=f"Threshold sweep saved to {sweep_path}")
 
         self.current_mode.set(mode)
         self.tracker_frame.place(x=OFFSCREEN_X)
@@ -218,40 +273,43 @@ class MainWindow:
         """Changes the window size to indicate work is in progress then calls the conversion method to convert all
         measurement files from Excel to the cached format.
         """
-        worker_thread = Thread(target=self.conversion, args=("pickle",))
+        self.reset_tracker()
+        worker_thread = Thread(target=self.conversion, args=("cache",))
         worker_thread.start() # conversion is in a new thread so we can update and display the progress tracker
 
     def to_excel_button_press(self) -> None:
         """Changes the window size to indicate work is in progress then calls the conversion method to convert all
         cached files from the cached format back to Excel.
         """
+        self.reset_tracker()
         worker_thread = Thread(target=self.conversion, args=("excel",))
         worker_thread.start() # conversion is in a new thread so we can update and display the progress tracker
 
     def conversion(self, target: str) -> None:
-        """Performs the actual conversion work between Excel files and the cached pickled format.
+        """Performs the actual conversion work between Excel files and the cached format.
 
         Args:
-            target (str): "pickle" or "excel", indicates the direction of conversion
+            target (str): "cache" or "excel", indicates the direction of conversion
         """
-        assert target in {"pickle", "excel"} # should never fail
+        assert target in {"cache", "excel"} # should never fail
         previous_mode = self.current_mode.get() # what the app looked like before
         self.current_mode.set("analysis")
         self.button_frame.place(x=OFFSCREEN_X)
         self.tracker_frame.place(x=0, y=MAIN_BUTTON_Y, width=460, height=230)
         self.in_progress_label.config(text="Converting...")
 
-        if target == "pickle":
-            self.converter.convert_to_pickle(self.finished_file_counter)
+        if target == "cache":
+            for error in self.converter.convert_to_cache(self.telemetry.publish):
+                messagebox.showerror(message=error)
         else:
-            self.converter.convert_to_excel(self.finished_file_counter)
+            for error in self.converter.convert_to_excel(self.telemetry.publish):
+                messagebox.showerror(message=error)
 
         messagebox.showinfo(message="Conversion finished!")
 
         self.current_mode.set(previous_mode) # restore previous window size
         self.button_frame.place(x=BASE_X, y=MAIN_BUTTON_Y)
         self.tracker_frame.place(x=OFFSCREEN_X)
-        self.finished_file_counter.set(0)
     
     def delete_cache_button_press(self) -> None:
         self.converter.purge_cache()
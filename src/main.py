@@ -1,5 +1,6 @@
 import toml
 import sys
+from multiprocessing import freeze_support
 from pathlib import Path
 from tkinter import messagebox
 from interface.gui_main import MainWindow
@@ -35,5 +36,6 @@ def main() -> int:
     return 0
 
 if __name__ == "__main__":
+    freeze_support() # the cache conversion uses worker processes, which frozen Windows builds need this for
     exit_status: int = main()
     raise SystemExit(exit_status)
\ No newline at end of file
@@ -0,0 +1,59 @@
+"""Builders for the small experiment and the configs that the processing, batch, pipeline and command line tests run on.
+"""
+import numpy as np
+import toml
+
+from analysis.converter import CACHE_NAME, CacheManifest, TraceTable, open_store
+from analysis.processor import DataProcessor
+from analysis.toml_data import Config
+
+
+def config_dict(folder, **changes) -> dict:
+    config = {"input": {"target_folder": str(folder), "method": "baseline", "SD_multiplier": 3, "smoothing_range": 5,
+                        "amp_threshold": 0.05, "cv_threshold": 0.01, "correction": "True"},
+              "output": {"report_name": "report_", "summary_name": "summary"}}
+    config["input"].update(changes)
+    return config
+
+def make_config(folder, **changes) -> Config:
+    return Config(False, config_dict(folder, **changes))
+
+def write_config(folder):
+    with open(folder / "config.toml", "w") as f:
+        toml.dump(config_dict(folder), f)
+    return folder / "config.toml"
+
+def make_experiment(folder) -> None:
+    """A subfolder called experiment with two measurements of six cells, only in the cache, without a manifest.
+    """
+    experiment = folder / "experiment"
+    experiment.mkdir()
+    metadata = {"conditions": {"ratiometric_dye": "false", "group1": "neuron only", "group2": "neuron + DPC",
+                               "framerate": 60},
+                "treatments": {"baseline": {"begin": 0, "end": 60}, "AITC": {"begin": 60, "end": 120},
+                               "KCl": {"begin": 120, "end": 180}}}
+    with open(experiment / "metadata.toml", "w") as f:
+        toml.dump(metadata, f)
+
+    rng = np.random.default_rng(0)
+    (experiment / CACHE_NAME).mkdir()
+    store = open_store(experiment / CACHE_NAME, make_config(folder).performance)
+    for i, group in enumerate(["neuron only", "neuron + DPC"]):
+        (experiment / f"{group} {i}.xlsx").touch() # only the cache is read
+        cells = 1 + rng.normal(0, 0.01, (6, 180))
+        cells[:3, 70:90] += 0.3 # reactions to AITC
+        cells[:, 125:140] += 0.2 # and KCl
+        data = np.vstack((np.arange(180.0), np.zeros(180), cells))
+        store.write(f"{group} {i}.xlsx", {"Raw": TraceTable(["Time", "Background"] + [f"N{n}" for n in range(6)], data)})
+
+def cached_experiment(folder):
+    """The test experiment, with a manifest, which processed traces and checkpoints need to know the measurements'
+    hashes. Returns the measurement files.
+    """
+    make_experiment(folder)
+    processor = DataProcessor(folder / "experiment", make_config(folder))
+    manifest = CacheManifest(processor.store)
+    for file in processor.measurement_files:
+        manifest.record(file, ["Raw"], "float64")
+    manifest.save()
+    return sorted(processor.measurement_files)
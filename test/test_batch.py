@@ -0,0 +1,79 @@
+import pandas as pd
+import toml
+
+from analysis.batch import BATCH_NAME, BatchRunner, load_batch, plan_jobs
+from analysis.converter import CacheManifest
+from analysis.processor import DataProcessor
+from analysis.scheduler import Scheduler
+
+from .helpers import cached_experiment, make_config, make_experiment
+
+
+def write_batch(folder, variants) -> None:
+    with open(folder / BATCH_NAME, "w") as f:
+        toml.dump({"variants": variants}, f)
+
+
+def test_load_batch_reports_errors(tmp_path):
+    config = make_config(tmp_path)
+    write_batch(tmp_path, {"good": {"SD_multiplier": 4}, "moved": {"target_folder": "elsewhere"},
+                           "wrong": {"method": "magic"}, "bad name": {"SD_multiplier": 2}})
+    variants, errors = load_batch(tmp_path / BATCH_NAME, config)
+    assert variants == []
+    for name in ["moved", "wrong", "bad name"]:
+        assert f"Variant {name}" in errors
+    assert "Variant good" not in errors
+
+def test_variants_sharing_preprocessing_are_grouped(tmp_path):
+    config = make_config(tmp_path)
+    write_batch(tmp_path, {"a": {"SD_multiplier": 4}, "b": {"smoothing_range": 9}, "c": {"method": "previous"}})
+    variants, errors = load_batch(tmp_path / BATCH_NAME, config)
+    assert errors == ""
+    assert variants[0].config.output.report_name == "report_a_"
+    assert variants[1].config.input.smoothing_range == 9
+    assert [[variant.name for variant in group.variants] for group in plan_jobs(variants)] == [["a", "c"], ["b"]]
+
+def test_batch_reports_match_single_runs(tmp_path):
+    make_experiment(tmp_path)
+    overrides = {"strict": {"SD_multiplier": 6}, "derivative": {"method": "derivative"}, "smooth": {"smoothing_range": 9}}
+    write_batch(tmp_path, overrides)
+    config = make_config(tmp_path)
+    variants, _ = load_batch(tmp_path / BATCH_NAME, config)
+    assert BatchRunner(config, variants, lambda count: None, False).run(Scheduler(config.performance, print)) == []
+
+    for name, changes in overrides.items():
+        batch_report = pd.read_excel(tmp_path / "experiment" / f"report_{name}_experiment.xlsx", sheet_name="Cells")
+        single = DataProcessor(tmp_path / "experiment", make_config(tmp_path, **changes))
+        single.preprocessing(True)
+        single.make_report(lambda count: None, [])
+        single_report = pd.read_excel(single.report_path, sheet_name="Cells")
+        pd.testing.assert_frame_equal(batch_report, single_report)
+
+def test_batch_loads_usable_files_once_per_group_and_keeps_the_configs_traces(tmp_path, monkeypatch):
+    first, _ = cached_experiment(tmp_path)
+    (tmp_path / "experiment" / "misnamed 1.xlsx").touch()
+    write_batch(tmp_path, {"strict": {"SD_multiplier": 6}, "smooth": {"smoothing_range": 9}})
+    config = make_config(tmp_path)
+    variants, _ = load_batch(tmp_path / BATCH_NAME, config)
+    loaded, prepared = [], []
+    load_cells, prepare = DataProcessor.load_cells, DataProcessor.prepare_non_ratiometric_data
+    def counted_load(self, file, manifest):
+        loaded.append(file.name)
+        return load_cells(self, file, manifest)
+    def counted_prepare(self, *args):
+        prepared.append(self.config.input.smoothing_range)
+        return prepare(self, *args)
+    monkeypatch.setattr(DataProcessor, "load_cells", counted_load)
+    monkeypatch.setattr(DataProcessor, "prepare_non_ratiometric_data", counted_prepare)
+
+    errors = []
+    BatchRunner(config, variants, lambda event: None, False).run_folder(tmp_path / "experiment", errors)
+    assert sorted(loaded) == ["neuron + DPC 1.xlsx"] * 2 + ["neuron only 0.xlsx"] * 2
+    assert len(errors) == 1 and "misnamed 1.xlsx" in errors[0]
+
+    # the traces of smoothing_range 9 were not written over the config's own
+    prepared.clear()
+    single = DataProcessor(tmp_path / "experiment", config)
+    single.parse_metadata()
+    single.load_cells(first, CacheManifest(single.store))
+    assert prepared == []
@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+from analysis.bleaching import MODELS, correct_bleaching
+
+
+def make_traces(frames: int = 1200, cells: int = 20):
+    rng = np.random.default_rng(2)
+    time = np.arange(frames, dtype=np.float64)
+    amplitudes, taus = rng.uniform(5, 20, cells), rng.uniform(300, 3000, cells)
+    traces = 100 + amplitudes * np.exp(-time[:, np.newaxis] / taus) + rng.normal(0, 0.1, (frames, cells))
+    return time, traces, amplitudes, taus
+
+def test_linear_matches_lstsq():
+    time, traces, _, _ = make_traces()
+    matrix = np.column_stack((np.ones_like(time), time))
+    slopes = np.linalg.lstsq(matrix, traces, rcond=None)[0][1]
+
+    corrected, parameters = correct_bleaching(time, traces, "linear")
+    assert parameters.shape == (1, traces.shape[1])
+    assert np.allclose(parameters[0], slopes, rtol=1e-10)
+    assert np.allclose(corrected, traces - time[:, np.newaxis] * slopes)
+
+def test_exponential_recovers_decay():
+    time, traces, amplitudes, taus = make_traces()
+    corrected, parameters = correct_bleaching(time, traces, "exponential")
+    assert np.allclose(parameters[0], amplitudes, rtol=0.1)
+    assert np.allclose(parameters[1], taus, rtol=0.2)
+    # the decay is removed, but the traces keep their starting level
+    assert np.abs(corrected - traces[0]).max() < 1.5
+
+@pytest.mark.parametrize("model", list(MODELS))
+def test_parameter_rows(model):
+    time, traces, _, _ = make_traces(300, 4)
+    corrected, parameters = correct_bleaching(time, traces, model)
+    assert corrected.shape == traces.shape
+    assert parameters.shape == (len(MODELS[model]), 4)
+
+def test_biexponential_terms_have_the_same_sign():
+    time, traces, _, _ = make_traces()
+    traces[400:500] += 30 # a response, which a pair of opposing terms could fit
+    _, parameters = correct_bleaching(time, traces, "biexponential")
+    amplitudes = parameters[[0, 2]]
+    assert (np.all(amplitudes >= 0, axis=0) | np.all(amplitudes <= 0, axis=0)).all()
+
+def test_unknown_model():
+    time, traces, _, _ = make_traces(100, 2)
+    with pytest.raises(ValueError):
+        correct_bleaching(time, traces, "quadratic")
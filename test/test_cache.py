@@ -0,0 +1,228 @@
+import os
+from pathlib import Path
+from threading import Thread
+
+import numpy as np
+from openpyxl import Workbook, load_workbook
+import pandas as pd
+
+from analysis.converter import (CACHE_NAME, MANIFEST_NAME, REACTIONS_SHEET, RESULT_SHEET, ArchiveStore, CacheManifest,
+                                Converter, FileLock, FolderStore, TraceTable, open_store, read_traces, write_traces,
+                                cached_sheet_path)
+from analysis.shards import Shard
+from analysis.toml_data import Performance
+
+
+def make_frame() -> pd.DataFrame:
+    frames = 50
+    return pd.DataFrame({
+        "Time": np.arange(frames, dtype=float),
+        "Background": np.full(frames, 10.0),
+        "N1": np.linspace(0, 1, frames),
+        "DPC1": np.linspace(1, 2, frames)
+    })
+
+def write_workbook(path: Path, sheets: dict[str, list[list]]) -> None:
+    """Writes a measurement workbook, the first row of every sheet is its header."""
+    wb = Workbook()
+    wb.remove(wb.active)
+    for name, rows in sheets.items():
+        ws = wb.create_sheet(name)
+        for row in rows:
+            ws.append(row)
+    wb.save(path)
+
+def measurement_rows(offset: float = 0.0) -> list[list]:
+    return [["Time", "Background", "N1", "DPC1"]] + [[t, 10.0, 1.0 + t / 10 + offset, 2.0] for t in range(5)]
+
+def test_manifest_checks_size_and_time_then_hash(tmp_path):
+    source = tmp_path / "kontrol 1.xlsx"
+    source.write_bytes(b"0123456789")
+    manifest = CacheManifest(ArchiveStore(tmp_path))
+    manifest.record(source, ["F340"], "float64")
+    recorded = manifest.entries[source.name]["mtime_ns"]
+    assert manifest.is_current(source, "float64")
+    assert not manifest.is_current(source, "float32") # cached as float64
+
+    os.utime(source, ns=(recorded + 10**9, recorded + 10**9)) # touched, same contents
+    assert manifest.is_current(source, "float64")
+    assert manifest.entries[source.name]["mtime_ns"] == recorded + 10**9
+
+    source.write_bytes(b"9876543210") # edited, same size
+    os.utime(source, ns=(recorded + 2 * 10**9, recorded + 2 * 10**9))
+    assert not manifest.is_current(source, "float64")
+
+    source.write_bytes(b"0123456789 and more")
+    assert not manifest.is_current(source, "float64")
+    assert not manifest.is_current(tmp_path / "new 1.xlsx", "float64")
+
+def test_conversion_forgets_deleted_and_replaced_files(tmp_path):
+    folder = tmp_path / "day 1"
+    folder.mkdir()
+    for name in ["kontrol 1.xlsx", "kontrol 2.xlsx", "X3 1.xlsx"]:
+        write_workbook(folder / name, {"Raw": measurement_rows()})
+    converter = Converter(tmp_path, "report_")
+    assert converter.convert_to_cache(lambda event: None) == []
+    store = open_store(folder / CACHE_NAME, Performance())
+    store.write("kontrol 2.xlsx", {"Processed": TraceTable(["N1"], np.zeros((1, 1)))})
+
+    (folder / "X3 1.xlsx").unlink()
+    write_workbook(folder / "kontrol 2.xlsx", {"Raw": measurement_rows(offset=1.0), "Extra": measurement_rows()})
+    manifests, tasks = converter.plan_conversion()
+    assert tasks == [(folder / "kontrol 2.xlsx", folder / CACHE_NAME)]
+    assert set(manifests[folder / CACHE_NAME].entries) == {"kontrol 1.xlsx"}
+    assert store.contents() == {"kontrol 1.xlsx": ["Raw"]}
+
+    assert converter.convert_to_cache(lambda event: None) == []
+    assert {name: sorted(sheets) for name, sheets in store.contents().items()} == {
+        "kontrol 1.xlsx": ["Raw"], "kontrol 2.xlsx": ["Extra", "Raw"]}
+    assert store.read("kontrol 2.xlsx", "Raw")["N1"][0] == 2.0
+
+def test_changing_the_cache_dtype_converts_again(tmp_path):
+    folder = tmp_path / "day 1"
+    folder.mkdir()
+    write_workbook(folder / "kontrol 1.xlsx", {"Raw": measurement_rows()})
+    assert Converter(tmp_path, "report_").convert_to_cache(lambda event: None) == []
+    assert Converter(tmp_path, "report_").plan_conversion()[1] == []
+
+    performance = Performance(cache_dtype="float32")
+    _, tasks = Converter(tmp_path, "report_", performance).plan_conversion()
+    assert tasks == [(folder / "kontrol 1.xlsx", folder / CACHE_NAME)]
+    assert Converter(tmp_path, "report_", performance).convert_to_cache(lambda event: None) == []
+    assert open_store(folder / CACHE_NAME, performance).read("kontrol 1.xlsx", "Raw").data.dtype == np.float32
+
+def test_conversion_adopts_cache_without_manifest(tmp_path):
+    folder = tmp_path / "day 1"
+    (folder / CACHE_NAME).mkdir(parents=True)
+    for name in ["kontrol 1.xlsx", "kontrol 2.xlsx"]:
+        write_workbook(folder / name, {"Raw": measurement_rows()})
+    store = open_store(folder / CACHE_NAME, Performance())
+    store.write("kontrol 1.xlsx", {"Raw": TraceTable.from_frame(make_frame())}) # made by a version without manifests
+
+    manifests, tasks = Converter(tmp_path, "report_").plan_conversion()
+    assert tasks == [(folder / "kontrol 2.xlsx", folder / CACHE_NAME)]
+    assert (folder / CACHE_NAME / MANIFEST_NAME).exists()
+    assert manifests[folder / CACHE_NAME].entries["kontrol 1.xlsx"]["sheets"] == ["Raw"]
+    assert len(store.read("kontrol 1.xlsx", "Raw")["N1"]) == len(make_frame()) # kept, not converted again
+
+def test_trace_round_trip(tmp_path):
+    frame = make_frame()
+    path = cached_sheet_path(tmp_path, "kontrol 1.xlsx", "F340")
+    write_traces(path, TraceTable.from_frame(frame, attrs={"source": "test"}))
+
+    table = read_traces(path)
+    assert table.columns == list(frame.columns)
+    assert table.attrs == {"source": "test"}
+    assert np.array_equal(table.to_frame().to_numpy(), frame.to_numpy())
+
+def test_trace_cell_columns_are_views(tmp_path):
+    path = tmp_path / "test.trc"
+    write_traces(path, TraceTable.from_frame(make_frame()))
+
+    table = read_traces(path)
+    cells = table.select(table.cell_columns)
+    assert table.cell_columns == ["N1", "DPC1"]
+    assert np.shares_memory(cells, table.data)
+
+def test_trace_text_becomes_nan():
+    frame = make_frame().astype(object)
+    frame.loc[3, "N1"] = "oops"
+
+    table = TraceTable.from_frame(frame)
+    assert table.data.dtype == np.float64
+    assert np.isnan(table["N1"][3])
+
+def test_folder_store_removes_names_with_pattern_characters(tmp_path):
+    store = FolderStore(tmp_path)
+    table = TraceTable.from_frame(make_frame())
+    for name in ["cells[1].xlsx", "cells1.xlsx"]: # as a pattern, the first name matches the second
+        store.write(name, {"Raw": table})
+    store.remove("cells[1].xlsx")
+    assert store.contents() == {"cells1.xlsx": ["Raw"]}
+
+def test_archive_replace_and_remove(tmp_path):
+    store = ArchiveStore(tmp_path)
+    first = TraceTable.from_frame(make_frame())
+    store.write("kontrol 1.xlsx", {"F340": first, "F380": first})
+    store.write("X3 1.xlsx", {"F340": first})
+
+    second = TraceTable(first.columns, first.data * 2)
+    store.write("kontrol 1.xlsx", {"F340": second})
+    store.remove("X3 1.xlsx")
+
+    assert store.contents() == {"kontrol 1.xlsx": ["F340", "F380"]}
+    assert np.array_equal(store.read("kontrol 1.xlsx", "F340").data, second.data)
+    assert np.array_equal(store.read("kontrol 1.xlsx", "F380").data, first.data)
+
+    store.compact()
+    assert np.array_equal(store.read("kontrol 1.xlsx", "F340").data, second.data)
+
+def test_archive_compaction_keeps_live_tables_and_waits_for_writers(tmp_path):
+    store = ArchiveStore(tmp_path)
+    tables = {n: TraceTable.from_frame(make_frame() * n) for n in range(1, 4)}
+    for _ in range(3): # every rewrite leaves the old tables behind
+        for n, table in tables.items():
+            store.write(f"kontrol {n}.xlsx", {"F340": table, "F380": table})
+    size = store.path.stat().st_size
+
+    with FileLock(store.lock_path): # another process is writing
+        compaction = Thread(target=store.compact)
+        compaction.start()
+        compaction.join(0.2)
+        assert compaction.is_alive()
+    compaction.join()
+    assert store.path.stat().st_size < size / 2
+    for n, table in tables.items():
+        for sheet in ["F340", "F380"]:
+            assert np.array_equal(store.read(f"kontrol {n}.xlsx", sheet).data, table.data)
+
+def test_compressed_round_trip(tmp_path):
+    frame = make_frame()
+    for codec in ["zlib", "lzma"]:
+        path = tmp_path / f"{codec}.trc"
+        write_traces(path, TraceTable.from_frame(frame), codec)
+        assert np.array_equal(read_traces(path).to_frame().to_numpy(), frame.to_numpy())
+
+def test_excel_round_trip(tmp_path):
+    folder = tmp_path / "day 1"
+    folder.mkdir()
+    rows = measurement_rows()
+    rows[2][2] = "saturated"
+    rows[4][3] = None
+    for name in ["kontrol 1.xlsx", "X3 1.xlsx"]:
+        write_workbook(folder / name, {"F380": rows, "F340": measurement_rows(offset=1.0)})
+    performance = Performance(workers=2, cache_dtype="float32")
+    assert Converter(tmp_path, "report_", performance).convert_to_cache(lambda event: None) == []
+
+    table = open_store(folder / CACHE_NAME, performance).read("kontrol 1.xlsx", "F380")
+    assert table.columns == rows[0]
+    assert table.data.dtype == np.float32
+    assert np.isnan(table["N1"][1]) and np.isnan(table["DPC1"][3])
+    assert np.array_equal(table["Time"], np.arange(5))
+
+    assert Converter(tmp_path, "report_", performance).convert_to_excel(lambda event: None) == []
+    wb = load_workbook(folder / "kontrol 1.xlsx")
+    assert wb.sheetnames == ["F380", "F340"]
+    exported = [list(row) for row in wb["F380"].iter_rows(values_only=True)]
+    assert exported[0] == rows[0]
+    assert exported[2][2] is None and exported[4][3] is None
+    assert exported[1] == [0, 10, 1, 2]
+
+def test_export_leaves_out_internal_tables_and_other_shards(tmp_path):
+    folders = [f"day {n}" for n in range(10)]
+    shard = Shard(1, 2)
+    inside = next(name for name in folders if shard.contains(Path(name)))
+    outside = next(name for name in folders if not shard.contains(Path(name)))
+    for name in [inside, outside]:
+        (tmp_path / name).mkdir()
+        write_workbook(tmp_path / name / "kontrol 1.xlsx", {"Raw": measurement_rows()})
+    assert Converter(tmp_path, "report_").convert_to_cache(lambda event: None) == []
+    for name in [inside, outside]:
+        store = open_store(tmp_path / name / CACHE_NAME, Performance())
+        table = TraceTable(["N1"], np.zeros((1, 1)))
+        store.write("kontrol 1.xlsx", {"Processed": table, REACTIONS_SHEET: table, RESULT_SHEET: table})
+    exported_before = (tmp_path / outside / "kontrol 1.xlsx").stat().st_mtime_ns
+
+    assert Converter(tmp_path, "report_", Performance(), shard).convert_to_excel(lambda event: None) == []
+    assert load_workbook(tmp_path / inside / "kontrol 1.xlsx", read_only=True).sheetnames == ["Raw", "Processed"]
+    assert (tmp_path / outside / "kontrol 1.xlsx").stat().st_mtime_ns == exported_before
@@ -0,0 +1,82 @@
+import numpy as np
+import pytest
+
+from analysis.converter import CacheManifest
+from analysis.processor import GRAPHS_DONE_NAME, PARTIAL_SUFFIX, DataProcessor, file_task, graph_task
+
+from .helpers import cached_experiment, make_config, make_experiment
+
+
+def test_processed_files_are_not_processed_again(tmp_path, monkeypatch):
+    file = cached_experiment(tmp_path)[0]
+    result = file_task(file, make_config(tmp_path), lambda event: None)
+
+    def interrupted(self, stats):
+        raise RuntimeError("should have been taken from the checkpoint")
+
+    monkeypatch.setattr(DataProcessor, "classify_cells", interrupted)
+    resumed = file_task(file, make_config(tmp_path), lambda event: None)
+    assert (resumed.condition, resumed.cell_types) == (result.condition, result.cell_types)
+    assert resumed.frames == result.frames
+    assert list(resumed.values) == list(result.values)
+    for column, values in result.values.items():
+        assert resumed.values[column].dtype == values.dtype
+        assert (resumed.values[column] == values).all()
+    with pytest.raises(RuntimeError): # other settings, other result
+        file_task(file, make_config(tmp_path, SD_multiplier=5), lambda event: None)
+
+def test_processed_traces_depend_only_on_preprocessing_settings(tmp_path, monkeypatch):
+    file = cached_experiment(tmp_path)[0]
+    prepared = []
+    prepare = DataProcessor.prepare_non_ratiometric_data
+    def counted(self, *args, **kwargs):
+        prepared.append(self.config.input)
+        return prepare(self, *args, **kwargs)
+    monkeypatch.setattr(DataProcessor, "prepare_non_ratiometric_data", counted)
+
+    def load_cells(**changes):
+        processor = DataProcessor(file.parent, make_config(tmp_path, **changes))
+        processor.parse_metadata()
+        return processor.load_cells(file, CacheManifest(processor.store))
+
+    columns, traces = load_cells()
+    assert len(prepared) == 1
+    for changes in [{"method": "derivative"}, {"SD_multiplier": 5}, {"amp_threshold": 0.5}, {"cv_threshold": 0.5}]:
+        reused_columns, reused = load_cells(**changes)
+        assert len(prepared) == 1, changes
+        assert reused_columns == columns and np.array_equal(reused, traces)
+
+    for changes in [{"smoothing_range": 9}, {"smoothing_filter": "median"}, {"correction": "False"},
+                    {"correction_model": "exponential"}]:
+        load_cells() # the defaults' traces are in the cache again
+        prepared.clear()
+        load_cells(**changes)
+        load_cells(**changes) # saved under the new settings' key
+        assert len(prepared) == 1, changes
+
+def test_finished_graphs_are_kept_and_partial_ones_redone(tmp_path):
+    config = make_config(tmp_path)
+    first, second = cached_experiment(tmp_path)
+    for file in [first, second]:
+        file_task(file, config, lambda event: None)
+    graph_task(first, config, lambda event: None)
+    graphs = tmp_path / "experiment" / first.stem
+    drawn = {png.name: png.stat().st_mtime_ns for png in graphs.glob("*.png")}
+    assert len(drawn) == 6 and (graphs / GRAPHS_DONE_NAME).exists()
+
+    # the second file was interrupted halfway through
+    partial = tmp_path / "experiment" / (second.stem + PARTIAL_SUFFIX)
+    partial.mkdir()
+    (partial / "Cell no. 0.png").touch()
+    graph_task(first, config, lambda event: None)
+    graph_task(second, config, lambda event: None)
+    assert {png.name: png.stat().st_mtime_ns for png in graphs.glob("*.png")} == drawn
+    assert not partial.exists()
+    assert len(list((tmp_path / "experiment" / second.stem).glob("*.png"))) == 6
+
+def test_cut_off_reports_are_made_again(tmp_path):
+    make_experiment(tmp_path)
+    processor = DataProcessor(tmp_path / "experiment", make_config(tmp_path))
+    processor.report_path.write_bytes(b"PK\x03\x04 half a workbook")
+    processor.preprocessing(False)
+    assert processor.need_to_work
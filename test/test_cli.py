@@ -0,0 +1,37 @@
+import json
+
+import pandas as pd
+import pytest
+
+import cli
+
+from .helpers import make_experiment, write_config
+
+
+def test_headless_run_prints_events(tmp_path, capsys):
+    make_experiment(tmp_path)
+    config = write_config(tmp_path)
+    assert cli.main(["--config", str(config), "--jobs", "1", "--stages", "process,summarize"]) == 0
+    records = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    finished = [record for record in records if record["event"] == "FileFinished" and record["stage"] == "process"]
+    assert len(finished) == 2
+    assert records[-1]["event"] == "done" and records[-1]["errors"] == 0
+    assert (tmp_path / "experiment" / "report_experiment.xlsx").exists()
+    assert (tmp_path / "summary.xlsx").exists()
+
+def test_bad_arguments_exit_with_2(tmp_path, capsys):
+    with pytest.raises(SystemExit) as exit:
+        cli.main(["--stages", "process,dance"])
+    assert exit.value.code == 2
+    config = write_config(tmp_path)
+    assert cli.main([str(tmp_path / "missing"), "--config", str(config)]) == 2
+    assert json.loads(capsys.readouterr().out)["event"] == "error"
+
+def test_sweep_without_experiments_reports_an_error(tmp_path, capsys):
+    (tmp_path / "no metadata").mkdir()
+    config = write_config(tmp_path)
+    assert cli.main(["--config", str(config), "--stages", "sweep"]) == 1
+    records = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert any("could be swept" in record.get("message", "") for record in records)
+    sweep = pd.read_excel(tmp_path / "summary_sweep.xlsx", sheet_name=None)
+    assert sweep["Reactions"].empty and not sweep["Settings"].empty
@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+
+from analysis.filters import FILTERS, smooth_traces
+from analysis.smooth import smooth
+
+
+def make_traces(frames: int = 300, cells: int = 8) -> np.ndarray:
+    rng = np.random.default_rng(0)
+    return 1 + np.cumsum(rng.normal(0, 0.05, (frames, cells)), axis=0)
+
+@pytest.mark.parametrize("window_size", [1, 3, 5, 9, 15])
+def test_moving_average_matches_smooth(window_size):
+    traces = make_traces()
+    expected = np.column_stack([smooth(trace, window_size) for trace in traces.T])
+    assert np.allclose(smooth_traces(traces, window_size, "mean"), expected, rtol=1e-12, atol=1e-12)
+
+def test_moving_average_keeps_nan_local():
+    traces = make_traces()
+    traces[100, 2] = np.nan
+    result = smooth_traces(traces, 5, "mean")
+    assert np.isnan(result[98:103, 2]).all()
+    assert not np.isnan(np.delete(result[:, 2], range(98, 103))).any()
+    assert not np.isnan(np.delete(result, 2, axis=1)).any()
+
+@pytest.mark.parametrize("method", list(FILTERS))
+def test_filters_keep_shape_and_constants(method):
+    traces = np.full((50, 3), 2.5)
+    result = smooth_traces(traces, 7, method)
+    assert result.shape == traces.shape
+    assert np.allclose(result, 2.5)
+
+def test_savgol_preserves_quadratics():
+    x = np.arange(40, dtype=float)
+    trace = 0.01 * x**2 - 0.3 * x + 4
+    assert np.allclose(smooth_traces(trace, 7, "savgol"), trace)
+
+def test_unknown_filter():
+    with pytest.raises(ValueError):
+        smooth_traces(make_traces(), 5, "boxcar")
@@ -0,0 +1,72 @@
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from analysis.converter import CACHE_NAME, TraceTable, open_store
+from analysis.engine import AnalysisEngine
+from analysis.pipeline import Step
+from analysis.processor import DataProcessor
+
+from .helpers import make_config, make_experiment
+
+
+def test_pipeline_matches_separate_stages(tmp_path):
+    make_experiment(tmp_path)
+    config = make_config(tmp_path)
+    single = DataProcessor(tmp_path / "experiment", config)
+    single.preprocessing(True)
+    single.make_report(lambda count: None, [])
+    expected = pd.read_excel(single.report_path, sheet_name="Cells")
+
+    engine = AnalysisEngine(config, lambda event: None, True)
+    assert engine.create_processor_instances() == []
+    assert engine.run_pipeline(True, True, False) == []
+    pd.testing.assert_frame_equal(pd.read_excel(single.report_path, sheet_name="Cells"), expected)
+    summary = pd.read_excel(tmp_path / "summary.xlsx", sheet_name=None)
+    assert list(summary) == ["AITC KCl"]
+
+def test_steps_read_as_their_target():
+    assert str(Step("process", "experiment", "neuron only 0.xlsx")) == "experiment/neuron only 0.xlsx (process)"
+    assert str(Step("report", "experiment")) == "experiment (report)"
+
+def test_folders_without_cells_get_an_empty_report(tmp_path):
+    make_experiment(tmp_path)
+    empty = tmp_path / "empty"
+    empty.mkdir()
+    shutil.copy(tmp_path / "experiment" / "metadata.toml", empty)
+    config = make_config(tmp_path)
+    engine = AnalysisEngine(config, lambda event: None, True)
+    assert engine.create_processor_instances() == []
+    assert engine.run_pipeline(True, True, False) == []
+    assert pd.read_excel(empty / "report_empty.xlsx", sheet_name="Cells").empty
+    summary = pd.read_excel(tmp_path / "summary.xlsx", sheet_name="AITC KCl", index_col=[0, 1, 2])
+    assert list(summary.columns) == ["empty", "experiment"]
+    assert (summary["empty"] == 0).all()
+
+    # the same goes for a folder whose every file failed, when the stages run one after the other
+    (empty / "report_empty.xlsx").unlink()
+    (empty / "neuron only 9.xlsx").touch() # not in the cache
+    engine = AnalysisEngine(config, lambda event: None, True)
+    engine.create_processor_instances()
+    errors = []
+    engine.process_data(errors)
+    assert len(errors) == 1 and "incorrectly named sheets" in errors[0]
+    assert pd.read_excel(empty / "report_empty.xlsx", sheet_name="Cells").empty
+
+def test_measurements_shorter_than_the_treatments_are_reported(tmp_path):
+    make_experiment(tmp_path)
+    config = make_config(tmp_path)
+    experiment = tmp_path / "experiment"
+    (experiment / "neuron only 2.xlsx").touch()
+    data = np.vstack((np.arange(100.0), np.zeros(100), np.ones((3, 100)))) # stops before KCl at frame 120
+    open_store(experiment / CACHE_NAME, config.performance).write(
+        "neuron only 2.xlsx", {"Raw": TraceTable(["Time", "Background", "N0", "N1", "N2"], data)})
+
+    engine = AnalysisEngine(config, lambda event: None, True)
+    engine.create_processor_instances()
+    errors = []
+    engine.process_data(errors)
+    assert len(errors) == 1 and "neuron only 2.xlsx" in errors[0] and "end before" in errors[0]
+    report = pd.read_excel(experiment / "report_experiment.xlsx", sheet_name="Cells")
+    assert len(report) == 12 and report["AITC_reaction"].notna().all()
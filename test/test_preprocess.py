@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+
+from analysis.filters import smooth_traces
+
+cy_preprocess = pytest.importorskip("analysis.compiled.cy_preprocess")
+
+
+def detrend(time: np.ndarray, cells: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    matrix = np.column_stack((np.ones_like(time), time))
+    slopes = np.linalg.lstsq(matrix, cells, rcond=None)[0][1]
+    return cells - time[:, np.newaxis] * slopes, slopes
+
+def make_measurement(dtype=np.float64):
+    rng = np.random.default_rng(1)
+    frames, cells = 400, 12
+    time = np.arange(frames, dtype=np.float64)
+    background = rng.normal(10, 0.1, frames)
+    traces = 100 + np.cumsum(rng.normal(0, 0.5, (cells, frames)), axis=1) - 0.02 * time
+    return time, background.astype(dtype), traces.astype(dtype)
+
+@pytest.mark.parametrize("dtype", [np.float64, np.float32])
+@pytest.mark.parametrize("workers", [1, 0])
+def test_ratiometric_kernel_matches_numpy(dtype, workers):
+    time, bgr_340, cells_340 = make_measurement(dtype)
+    bgr_380, cells_380 = bgr_340 * 2, cells_340 * 1.5 + 20
+    ratios, coeffs = cy_preprocess.preprocess_ratiometric(time, bgr_340, cells_340, bgr_380, cells_380, 5, True, workers)
+
+    smooth_340 = smooth_traces(np.subtract(cells_340, bgr_340, dtype=np.float64).T, 5)
+    smooth_380 = smooth_traces(np.subtract(cells_380, bgr_380, dtype=np.float64).T, 5)
+    (corrected_340, slopes_340), (corrected_380, slopes_380) = detrend(time, smooth_340), detrend(time, smooth_380)
+    assert np.allclose(ratios, (corrected_340 / corrected_380).T, rtol=1e-9)
+    assert np.allclose(coeffs, np.vstack((slopes_340, slopes_380)), rtol=1e-9)
+
+def test_single_kernel_matches_numpy():
+    time, _, cells = make_measurement()
+    traces, coeffs = cy_preprocess.preprocess_single(time, cells, 60, 7, True)
+
+    normalized = cells.T / cells[:, :60].mean(axis=1)
+    expected, slopes = detrend(time, smooth_traces(normalized, 7))
+    assert np.allclose(traces, expected.T, rtol=1e-9)
+    assert np.allclose(coeffs, slopes, rtol=1e-9)
+
+def test_kernel_without_correction():
+    time, _, cells = make_measurement()
+    traces, coeffs = cy_preprocess.preprocess_single(time, cells, 60, 5, False)
+    assert np.allclose(traces, smooth_traces(cells.T / cells[:, :60].mean(axis=1), 5).T)
+    assert np.isnan(coeffs).all()
+
+@pytest.mark.parametrize("baseline", [0, 401])
+def test_single_kernel_rejects_baselines_out_of_bounds(baseline):
+    time, _, cells = make_measurement()
+    with pytest.raises(ValueError):
+        cy_preprocess.preprocess_single(time, cells, baseline, 7, True)
+
+@pytest.mark.parametrize("shorter", ["time", "background_380", "cells_380"])
+def test_ratiometric_kernel_rejects_mismatched_wavelengths(shorter):
+    time, bgr_340, cells_340 = make_measurement()
+    inputs = {"time": time, "background_340": bgr_340, "cells_340": cells_340, "background_380": bgr_340 * 2,
+              "cells_380": cells_340 * 1.5 + 20}
+    inputs[shorter] = np.ascontiguousarray(inputs[shorter][..., :4]) # a truncated F380 sheet
+    with pytest.raises(ValueError):
+        cy_preprocess.preprocess_ratiometric(**inputs, window_size=5, correction=True)
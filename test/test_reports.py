@@ -0,0 +1,53 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import analysis.reports as reports
+from analysis.reports import ExcelReport, Sidecar, read_report, read_sidecar, sidecar_path
+
+
+def make_cells() -> pd.DataFrame:
+    rng = np.random.default_rng(0)
+    cells = pd.DataFrame({"cell_ID": np.arange(30), "condition": ["neuron only"] * 10 + ["neuron + DPC"] * 20,
+                          "cell_type": ["N", "DPC", "N"] * 10, "AITC_reaction": rng.random(30) > 0.5,
+                          "AITC_amp": rng.random(30)})
+    cells.loc[4, "AITC_amp"] = np.nan
+    return cells
+
+def write_report(tmp_path, cells):
+    report_path = tmp_path / "report_folder.xlsx"
+    summary = cells[["cell_type", "condition", "AITC_reaction"]].value_counts()
+    for writer in [ExcelReport(report_path), Sidecar(sidecar_path(tmp_path / ".cache", report_path, ".npz"))]:
+        writer.write(cells, summary)
+    return report_path
+
+@pytest.mark.parametrize("xlsxwriter", [True, False])
+def test_workbook_matches_table(tmp_path, monkeypatch, xlsxwriter):
+    if xlsxwriter and not reports.XLSXWRITER:
+        pytest.skip("xlsxwriter is not installed")
+    monkeypatch.setattr(reports, "XLSXWRITER", xlsxwriter)
+    monkeypatch.setattr(reports, "REPORT_CHUNK_ROWS", 7) # several blocks
+    cells = make_cells()
+    report_path = write_report(tmp_path, cells)
+    pd.testing.assert_frame_equal(pd.read_excel(report_path, sheet_name="Cells"), cells, check_dtype=False)
+    summary = pd.read_excel(report_path, sheet_name="Summary")
+    assert list(summary.columns) == ["cell_type", "condition", "AITC_reaction", "count"]
+    assert summary["count"].sum() == 30
+
+def test_npz_sidecar_round_trip(tmp_path):
+    cells = make_cells()
+    report_path = write_report(tmp_path, cells)
+    pd.testing.assert_frame_equal(read_sidecar(tmp_path / ".cache", report_path), cells, check_dtype=False)
+
+def test_stale_sidecar_is_ignored(tmp_path):
+    cells = make_cells()
+    report_path = write_report(tmp_path, cells)
+    edited = cells.assign(AITC_reaction=True)
+    with pd.ExcelWriter(report_path) as writer: # someone edits the workbook after the sidecar was written
+        edited.to_excel(writer, sheet_name="Cells", index=False)
+    sidecar = sidecar_path(tmp_path / ".cache", report_path, ".npz")
+    os.utime(sidecar, (report_path.stat().st_mtime - 10,) * 2)
+    assert read_sidecar(tmp_path / ".cache", report_path) is None
+    assert read_report(tmp_path / ".cache", report_path)["AITC_reaction"].all()
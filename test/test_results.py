@@ -0,0 +1,31 @@
+import numpy as np
+import pandas as pd
+
+from analysis.results import ResultBuffer
+
+
+def make_values(cells: int, seed: int) -> dict[str, np.ndarray]:
+    rng = np.random.default_rng(seed)
+    return {"AITC_reaction": rng.random(cells) > 0.5, "AITC_amp": rng.random(cells),
+            "KCl amp filter": rng.random(cells) > 0.5}
+
+def test_buffer_matches_concatenated_frames():
+    buffer = ResultBuffer(capacity=4) # small, so it has to grow a few times
+    frames = []
+    cell_ID = 0
+    for i, (condition, cell_types) in enumerate([("neuron only", ["N", "N", "DPC"]), ("neuron + DPC", ["DPC"] * 5),
+                                                 ("neuron only", ["N"] * 7)]):
+        values = make_values(len(cell_types), i)
+        buffer.append(f"file {i}.xlsx", condition, cell_types, values)
+        frame = pd.DataFrame({"cell_ID": range(cell_ID, cell_ID + len(cell_types)), "condition": condition,
+                              "cell_type": cell_types, **values})
+        frames.append(frame)
+        cell_ID += len(cell_types)
+
+    assert len(buffer) == 15
+    assert buffer.conditions == ["neuron only", "neuron + DPC"]
+    assert buffer.files["file 1.xlsx"] == slice(3, 8)
+    pd.testing.assert_frame_equal(buffer.to_frame(), pd.concat(frames, ignore_index=True))
+
+def test_empty_buffer():
+    assert ResultBuffer().to_frame().empty
@@ -0,0 +1,61 @@
+import pandas as pd
+
+from analysis.processor import DataProcessor, file_task, report_task
+from analysis.scheduler import Scheduler, in_worker
+from analysis.toml_data import Performance
+
+from .helpers import make_config, make_experiment
+
+
+def square(value, progress):
+    progress(value)
+    return value * value
+
+def fail(value, progress):
+    raise ValueError(f"bad value {value}")
+
+def allocate(size, progress):
+    return len(bytearray(size))
+
+def where(value, progress):
+    return in_worker()
+
+
+def test_results_and_progress_come_back():
+    counted = []
+    results, errors = Scheduler(Performance(workers=2), counted.append).run({n: (square, (n,)) for n in range(1, 5)})
+    assert errors == []
+    assert results == {1: 1, 2: 4, 3: 9, 4: 16}
+    assert sum(counted) == 10
+
+def test_tasks_know_they_run_in_a_worker():
+    # the compiled kernels use a single thread there, as every core has a worker already
+    results, _ = Scheduler(Performance(workers=2), lambda count: None).run({n: (where, (n,)) for n in range(2)})
+    assert results == {0: True, 1: True}
+    assert not in_worker()
+
+def test_failed_tasks_are_reported():
+    tasks = {"good": (square, (3,)), "bad": (fail, (2,))}
+    results, errors = Scheduler(Performance(workers=2), lambda count: None).run(tasks)
+    assert results == {"good": 9}
+    assert errors == ["bad: bad value 2"]
+
+def test_memory_limit_fails_only_the_task():
+    tasks = {"small": (allocate, (1024,)), "huge": (allocate, (8 * 1024**3,))}
+    results, errors = Scheduler(Performance(workers=1, memory_limit=2048), lambda count: None).run(tasks)
+    assert results == {"small": 1024}
+    assert len(errors) == 1 and errors[0].startswith("huge: ran out of memory")
+
+def test_file_tasks_make_the_same_report(tmp_path):
+    make_experiment(tmp_path)
+    config = make_config(tmp_path)
+    single = DataProcessor(tmp_path / "experiment", config)
+    single.preprocessing(True)
+    single.make_report(lambda count: None, [])
+    expected = pd.read_excel(single.report_path, sheet_name="Cells")
+
+    # finished in the opposite order, the cell IDs still follow the order of the files
+    files = sorted(single.measurement_files, key=single.file_size)[::-1]
+    results = {file.name: file_task(file, config, lambda count: None) for file in files}
+    assert report_task(single.path, config, results, lambda count: None) == []
+    pd.testing.assert_frame_equal(pd.read_excel(single.report_path, sheet_name="Cells"), expected)
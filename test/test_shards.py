@@ -0,0 +1,48 @@
+from pathlib import Path
+import shutil
+import subprocess
+import sys
+
+import pandas as pd
+import pytest
+
+import cli
+from analysis.engine import AnalysisEngine
+from analysis.shards import Shard
+
+from .helpers import make_experiment, write_config
+
+
+def test_every_folder_is_in_one_shard():
+    folders = [Path(f"day {n}") for n in range(50)]
+    shards = [Shard(number, 4) for number in range(1, 5)]
+    assert all(sum(shard.contains(folder) for shard in shards) == 1 for folder in folders)
+    assert Shard.parse("3/4") == shards[2]
+    with pytest.raises(ValueError):
+        Shard.parse("5/4")
+
+def test_merged_shards_match_the_summary(tmp_path):
+    make_experiment(tmp_path)
+    for n in range(5):
+        shutil.copytree(tmp_path / "experiment", tmp_path / f"experiment {n}")
+    config = write_config(tmp_path)
+    assert cli.main(["--config", str(config), "--stages", "process,summarize"]) == 0
+    expected = pd.read_excel(tmp_path / "summary.xlsx", sheet_name=None)
+    (tmp_path / "summary.xlsx").unlink()
+
+    script = Path(cli.__file__)
+    shards = [subprocess.Popen([sys.executable, script, "--config", config, "--jobs", "1", "--repeat",
+                                "--shard", f"{number}/3", "--stages", "process,summarize"],
+                               cwd=script.parent, stdout=subprocess.DEVNULL) for number in range(1, 4)]
+    assert [shard.wait() for shard in shards] == [0, 0, 0]
+    assert not (tmp_path / "summary.xlsx").exists()
+
+    engine = AnalysisEngine(cli.load_config(cli.parse_args(["--config", str(config)]))[0], lambda event: None, False)
+    assert engine.merge_shards() == []
+    merged = pd.read_excel(tmp_path / "summary.xlsx", sheet_name=None)
+    assert list(merged) == list(expected)
+    for sheet in expected:
+        pd.testing.assert_frame_equal(merged[sheet], expected[sheet])
+
+    (tmp_path / Shard(2, 3).index_name).unlink()
+    assert engine.merge_shards() == ["Shard(s) 2 of 3 have not written their summary index yet."]
@@ -0,0 +1,46 @@
+import os
+
+import pandas as pd
+
+from analysis.summary import SUMMARY_INDEX_NAME, SummaryIndex
+
+
+def make_counts() -> pd.Series:
+    cells = pd.DataFrame({"cell_type": ["N", "N", "DPC", "N"], "AITC_reaction": [True, False, False, True],
+                          "KCl_reaction": [True, True, False, True]})
+    return cells.value_counts()
+
+def test_counts_round_trip(tmp_path):
+    report = tmp_path / "report_exp.xlsx"
+    report.write_bytes(b"report")
+    index = SummaryIndex(tmp_path)
+    index.record("exp", report, ["AITC", "KCl"], make_counts())
+    index.save()
+
+    agonists, counts = SummaryIndex(tmp_path).experiment("exp")
+    assert agonists == ("AITC", "KCl")
+    pd.testing.assert_series_equal(counts, make_counts(), check_index_type=False)
+
+def test_changed_reports_are_not_current(tmp_path):
+    report = tmp_path / "report_exp.xlsx"
+    report.write_bytes(b"report")
+    index = SummaryIndex(tmp_path)
+    index.record("exp", report, ["AITC", "KCl"], make_counts())
+    assert index.is_current("exp", report)
+    assert not index.is_current("exp", tmp_path / "report_other_exp.xlsx") # a different report name
+    assert not index.is_current("new", report)
+
+    os.utime(report, ns=(report.stat().st_atime_ns, report.stat().st_mtime_ns + 1000))
+    assert not index.is_current("exp", report)
+
+def test_retain_and_broken_index(tmp_path):
+    report = tmp_path / "report_exp.xlsx"
+    report.write_bytes(b"report")
+    index = SummaryIndex(tmp_path)
+    for name in ["a", "b"]:
+        index.record(name, report, ["KCl"], make_counts())
+    index.retain(["b"])
+    assert list(index.entries) == ["b"]
+
+    (tmp_path / SUMMARY_INDEX_NAME).write_text("{not json")
+    assert SummaryIndex(tmp_path).entries == {}
@@ -0,0 +1,32 @@
+from analysis.telemetry import FileFinished, StageStarted, Telemetry, Throughput, format_duration
+
+
+def test_events_reach_the_consumer_in_order():
+    telemetry = Telemetry()
+    handled = []
+    consumer = telemetry.consume(handled.append)
+    events = [StageStarted("process", 2), FileFinished("process", "exp", "a.xlsx", cells=10),
+              FileFinished("process", "exp", "b.xlsx", cells=5)]
+    for event in events:
+        telemetry.publish(event)
+    telemetry.close()
+    consumer.join(timeout=5)
+    assert handled == events
+    assert telemetry.drain() == []
+
+def test_throughput_and_eta():
+    throughput = Throughput(window=10)
+    throughput.reset(now=0)
+    throughput.add(StageStarted("process", 10), now=0)
+    throughput.add(StageStarted("graph", 10), now=0)
+    for second in range(1, 5):
+        throughput.add(FileFinished("process", "exp", f"{second}.xlsx", cells=100), now=second)
+    assert throughput.finished == 4 and throughput.planned == 20
+    assert throughput.files_per_second(now=4) == 1
+    assert throughput.cells_per_second(now=4) == 100
+    assert throughput.eta(now=4) == 16
+    assert throughput.eta(now=30) is None # nothing finished recently
+
+def test_format_duration():
+    assert format_duration(65) == "1:05"
+    assert format_duration(2 * 3600 + 200) == "2:03:20"
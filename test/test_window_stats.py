@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+from analysis.processing_functions import baseline_threshold, previous_threshold, derivate_threshold, neuron_filter
+from analysis.processing_functions import sweep_reactions, sweep_neuron_filter
+from analysis.window_stats import WindowStats
+
+
+def make_stats():
+    rng = np.random.default_rng(3)
+    data = 1 + np.cumsum(rng.normal(0, 0.01, (6, 500)), axis=1)
+    windows = {"baseline": slice(0, 60), "CIM": slice(60, 200), "AITC": slice(250, 400), "KCl": slice(400, 600)}
+    return data, windows, WindowStats(data, windows)
+
+def test_statistics_match_slicing():
+    data, windows, stats = make_stats()
+    for name, window in windows.items():
+        assert np.allclose(stats.mean(name), data[:, window].mean(axis=1), rtol=1e-12)
+        assert np.allclose(stats.std(name), data[:, window].std(axis=1), rtol=1e-9)
+        assert np.array_equal(stats.max(name), data[:, window].max(axis=1))
+        assert np.array_equal(stats.argmax(name), window.start + data[:, window].argmax(axis=1))
+
+def test_tails_and_derivatives():
+    data, windows, stats = make_stats()
+    derivs = np.gradient(data, axis=1)
+    assert stats.agonists == ["CIM", "AITC", "KCl"]
+    for name in stats.agonists:
+        start = windows[name].start
+        assert np.allclose(stats.tail_mean(name), data[:, start - 10:start].mean(axis=1), rtol=1e-12)
+        assert np.array_equal(stats.derivative_max(name), derivs[:, windows[name]].max(axis=1))
+    assert np.allclose(stats.derivative_std("baseline"), derivs[:, :60].std(axis=1), rtol=1e-9)
+
+def test_windows_past_the_end_are_rejected():
+    data, windows, _ = make_stats()
+    with pytest.raises(ValueError, match="KCl"):
+        WindowStats(data[:, :400], windows) # cut off right where KCl begins
+    assert np.allclose(WindowStats(data[:, :450], windows).mean("KCl"), data[:, 400:450].mean(axis=1), rtol=1e-12)
+
+@pytest.mark.parametrize("method, function", [("baseline", baseline_threshold), ("previous", previous_threshold),
+                                              ("derivative", derivate_threshold)])
+def test_sweep_matches_threshold_functions(method, function):
+    _, _, stats = make_stats()
+    sd_mults = np.array([0.5, 2, 3.5])
+    swept = sweep_reactions(stats, method, sd_mults)
+    for i, sd_mult in enumerate(sd_mults):
+        result = {}
+        function(stats, result, sd_mult)
+        for agonist in stats.agonists:
+            assert np.array_equal(swept[agonist][i], result[agonist + "_reaction"])
+
+def test_neuron_filter_sweep():
+    _, _, stats = make_stats()
+    passing = sweep_neuron_filter(stats, np.array([0.0, 0.05]), np.array([0.001, 0.01, 0.1]))
+    assert passing.shape == (2, 3, 6)
+    result = {}
+    neuron_filter(stats, result, 0.05, 0.01)
+    assert np.array_equal(passing[1, 1], result["KCl amp filter"] & result["KCl cv filter"])